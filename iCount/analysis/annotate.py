@@ -9,6 +9,7 @@ Annotate each cross link site with types of regions that intersect with it.
 import re
 import os
 import logging
+import itertools
 
 import pybedtools
 from pybedtools import create_interval_from_list
@@ -19,7 +20,7 @@ LOGGER = logging.getLogger(__name__)
 
 
 def annotate_cross_links(annotation, sites, sites_annotated, subtype='biotype',
-                         excluded_types=None):
+                         excluded_types=None, native=False):
     """
     Annotate each cross-link site with all region types that intersect it.
 
@@ -46,6 +47,9 @@ def annotate_cross_links(annotation, sites, sites_annotated, subtype='biotype',
         Subtype.
     excluded_types : list_str
         Excluded types.
+    native : bool
+        Sort and intersect cross-links and annotation with
+        ``iCount.files.intervals`` instead of bedtools.
 
     Returns
     -------
@@ -57,33 +61,37 @@ def annotate_cross_links(annotation, sites, sites_annotated, subtype='biotype',
     metrics = iCount.Metrics()
 
     excluded_types = excluded_types or []
-    cross_links = pybedtools.BedTool(sites).sort().saveas()
-    annotation = pybedtools.BedTool(annotation).filter(
-        lambda x: x[2] not in excluded_types).sort().saveas()
+    annotation = pybedtools.BedTool(annotation).filter(lambda x: x[2] not in excluded_types)
 
     LOGGER.info('Calculating overlaps between cross-link and annotation_file...')
-    overlaps = cross_links.intersect(annotation, sorted=True, s=True, wb=True).saveas()
-    try:
-        # this will raise TypeError if overlaps is empty:
-        overlaps[0]
-    except (IndexError, TypeError):
+    if native:
+        # As with bedtools, both files are sorted:
+        intervals = iCount.files.intervals
+        cross_links = intervals.sort_intervals(intervals.read_intervals(sites))
+        annotation = intervals.sort_intervals(intervals.read_intervals(annotation.saveas().fn))
+        overlaps = intervals.intersect(cross_links, annotation, s=True, wb=True)
+    else:
+        cross_links = pybedtools.BedTool(sites).sort().saveas()
+        annotation = annotation.sort().saveas()
+        overlaps = iter(cross_links.intersect(annotation, sorted=True, s=True, wb=True).saveas())
+    previous_interval = next(overlaps, None)
+    if previous_interval is None:
         raise ValueError('No intersections found. This may be caused by '
                          'different naming of chromosomes in annotation and'
                          'cross_links file ("chr1" vs. "1")')
 
     data = []  # cotainer for final annotated BED file intervals
     site_types = []  # cotainer for all types intersecting with given cross-link
-    previous_interval = overlaps[0]
 
     def finalize(types, site):
         """Make annotated (with all intersecting types) cross link interval."""
         data.append(create_interval_from_list(
-            site[0:3] + ['; '.join(map(str, sorted(set(types))))] + site[4:6]))
+            list(site[0:3]) + ['; '.join(map(str, sorted(set(types))))] + list(site[4:6])))
 
-    for interval in overlaps:
-        # Detect new cross link:
-        if interval.start != previous_interval.start or \
-           interval.strand != previous_interval.strand:
+    for interval in itertools.chain([previous_interval], overlaps):
+        # Detect new cross link (by start and strand):
+        if interval[1] != previous_interval[1] or \
+           interval[5] != previous_interval[5]:
             finalize(site_types, previous_interval)
             site_types = []
         if subtype:
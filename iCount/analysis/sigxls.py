@@ -119,9 +119,10 @@ reported in it, no matter the FDR value.
 """
 import os
 import math
-import bisect
+import time
+import sqlite3
 import logging
-from collections import Counter
+import multiprocessing
 
 import numpy
 import pybedtools
@@ -131,6 +132,37 @@ from iCount.files import _f2s
 
 LOGGER = logging.getLogger(__name__)
 
+# Maximal number of elements in intermediate arrays of a batch of permutations:
+PERMUTATION_CHUNK_SIZE = 2 ** 22
+
+# Attributes, used as name of GTF feature (first existing one):
+GTF_NAME_ATTRIBUTES = ('ID', 'Name', 'gene_name', 'transcript_id', 'gene_id', 'Parent')
+
+
+def _window_sums(positions, values, half_window):
+    """
+    Sum ``values`` in windows of half-window size ``half_window``.
+
+    Positions must be sorted NumPy array of integers. Window bounds of all
+    positions are found at once with ``numpy.searchsorted``. Integer values are
+    summed as differences of cumulative sums. Summing floats in this way would
+    introduce rounding errors, so they are added one by one (vectorized over
+    all windows), in the same order as with built-in ``sum``.
+    """
+    starts = numpy.searchsorted(positions, positions - half_window, side='left')
+    stops = numpy.searchsorted(positions, positions + half_window + 1, side='left')
+
+    if values.dtype.kind in 'iub':
+        cumsum = numpy.concatenate([[0], numpy.cumsum(values, dtype=numpy.int64)])
+        return cumsum[stops] - cumsum[starts]
+
+    sums = numpy.zeros(len(values), dtype=values.dtype)
+    for offset in range(int(numpy.max(stops - starts))):
+        index = starts + offset
+        inside = index < stops
+        sums[inside] += values[index[inside]]
+    return sums
+
 
 def _sum_within_window(pos_val, half_window=3):
     """
@@ -150,36 +182,25 @@ def _sum_within_window(pos_val, half_window=3):
     """
     if not pos_val:
         return []
-    pos_val_ind = sorted((pos, val, i) for i, (pos, val) in enumerate(pos_val))
-    poss, vals, inds = zip(*pos_val_ind)
+    poss, vals = zip(*pos_val)
+    positions, values = numpy.asarray(poss), numpy.asarray(vals)
+    # Sort by position and value, as sorted(pos_val) would:
+    order = numpy.lexsort((values, positions))
 
-    ret_list = [None] * len(pos_val)
-    max_i = len(poss)
-    for i, pos in enumerate(poss):
-        i_start = bisect.bisect_left(
-            poss, pos - half_window, lo=max(0, i - half_window), hi=i)
-        i_stop = bisect.bisect_left(
-            poss, pos + 1 + half_window, lo=i_start, hi=min(i + half_window + 1, max_i))
-        ret_list[inds[i]] = (pos, sum(vals[i_start:i_stop]))
-    return ret_list
+    window_sums = _window_sums(positions[order], values[order], half_window)
+    sums = numpy.empty_like(window_sums)
+    sums[order] = window_sums
+    return list(zip(poss, sums.tolist()))
 
 
 def _sum_within_window_nopos(pos_val, half_window=3):
     """Make same thing as _sum_within_window but without positions."""
     if not pos_val:
         return []
-    pos_val = sorted(pos_val)
     poss, vals = zip(*pos_val)
-
-    ret_list = []
-    max_i = len(poss)
-    for i, pos in enumerate(poss):
-        i_start = bisect.bisect_left(
-            poss, pos - half_window, lo=max(0, i - half_window), hi=i)
-        i_stop = bisect.bisect_left(
-            poss, pos + 1 + half_window, lo=i_start, hi=min(i + half_window + 1, max_i))
-        ret_list.append(sum(vals[i_start:i_stop]))
-    return ret_list
+    positions, values = numpy.asarray(poss), numpy.asarray(vals)
+    order = numpy.lexsort((values, positions))
+    return _window_sums(positions[order], values[order], half_window).tolist()
 
 
 def cumulative_prob(vals, max_val):
@@ -229,10 +250,193 @@ def cumulative_prob(vals, max_val):
 #     return cum_prob_ret[::-1]
 
 
+def _permutation_sww(rnd_hits, size, half_window):
+    """
+    Compute SWW scores of random hits in a batch of permutations.
+
+    ``rnd_hits`` is a (permutations x hits) matrix of random positions.
+    Positions are counted per permutation (row) with a single ``bincount``,
+    where positions of each row are offset by ``row * stride``. The stride is
+    larger than ``size + half_window``, so windows of different rows never
+    overlap. Window sums are then differences of cumulative sums of counts.
+
+    If group is small compared to number of hits, counts are stored in dense
+    (rows x stride) matrix. Otherwise only occupied positions are kept (sorted)
+    and window bounds are found with ``numpy.searchsorted``.
+
+    Returns
+    -------
+    tuple
+        Row index and SWW score of each occupied position.
+
+    """
+    rows, hits = rnd_hits.shape
+    stride = size + half_window + 1
+    keys = (rnd_hits + numpy.arange(rows)[:, None] * stride).ravel()
+
+    if size <= hits:
+        counts = numpy.bincount(keys, minlength=rows * stride)
+        occupied = numpy.flatnonzero(counts)
+        cumsum = numpy.concatenate([[0], numpy.cumsum(counts)])
+        # Windows of first positions in row would start in padding of previous row:
+        starts = numpy.maximum(occupied - half_window, occupied - occupied % stride)
+        sww = cumsum[occupied + half_window + 1] - cumsum[starts]
+    else:
+        occupied, counts = numpy.unique(keys, return_counts=True)
+        cumsum = numpy.concatenate([[0], numpy.cumsum(counts)])
+        starts = numpy.searchsorted(occupied, occupied - half_window, side='left')
+        stops = numpy.searchsorted(occupied, occupied + half_window, side='right')
+        sww = cumsum[stops] - cumsum[starts]
+
+    return occupied // stride, sww
+
+
+def _rnd_cumulative_probs(size, total_hits, half_window, perms, rng=numpy.random):
+    """
+    Return ``cumulative_prob`` of SWW scores for ``perms`` random permutations.
+
+    All permutations are drawn at once as (perms x total_hits) matrix, in
+    chunks of at most ``PERMUTATION_CHUNK_SIZE`` elements. Random numbers are
+    drawn (from ``rng``) in the same order as with one ``randint`` call per
+    permutation. SWW scores of each permutation are counted with a single
+    ``bincount`` over (row, score) pairs.
+
+    Cumulative probabilities are zero above the largest SWW score, so only the
+    first (largest SWW score + 1) columns of the (perms x total_hits + 1)
+    matrix are returned.
+    """
+    chunk_rows = max(1, PERMUTATION_CHUNK_SIZE // max(1, total_hits, size + half_window + 1))
+
+    chunks = []
+    for chunk_start in range(0, perms, chunk_rows):
+        rows = min(chunk_rows, perms - chunk_start)
+        rnd_hits = rng.randint(size, size=(rows, total_hits))
+        row, sww = _permutation_sww(rnd_hits, size, half_window)
+
+        width = int(sww.max()) + 1 if len(sww) else 1
+        freqs = numpy.bincount(row * width + sww, minlength=rows * width).reshape(rows, width)
+        with numpy.errstate(invalid='ignore'):
+            # Same as density=True in numpy.histogram (bins have unit width):
+            freqs = freqs / numpy.bincount(row, minlength=rows)[:, None]
+        chunks.append(numpy.cumsum(freqs[:, ::-1], axis=1)[:, ::-1])
+
+    width = max(chunk.shape[1] for chunk in chunks)
+    rnd_ps = numpy.zeros((perms, width))
+    chunk_start = 0
+    for chunk in chunks:
+        rnd_ps[chunk_start:chunk_start + chunk.shape[0], :chunk.shape[1]] = chunk
+        chunk_start += chunk.shape[0]
+    return rnd_ps
+
+
 PS_CACHE = {}
 
+# Name of background cache file, if only directory is given:
+BG_CACHE_NAME = 'sigxls_background.sqlite'
+# Seconds to wait for lock of background cache, before it is skipped:
+BG_CACHE_TIMEOUT = 60
+
+NULL_MODELS = ['permutation', 'analytic']
+# Smallest group, for which 'analytic' null model is used:
+ANALYTIC_MIN_SIZE = 1000
 
-def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
+
+class _BackgroundCache:
+    """
+    Background distributions, stored on disk (SQLite database) between runs.
+
+    Distributions are stored under key (rnd_seed, size, total_hits,
+    half_window, perms), same as in ``PS_CACHE``. At most ``max_entries`` of them are kept: when cache
+    is closed, least recently used ones are removed. Multiple processes can
+    use the same file: database is in WAL mode and each distribution is
+    committed as soon as it is stored, so the write lock is only held briefly.
+    If database is locked (or cannot be used for other reasons), distributions
+    are computed without the cache.
+    """
+
+    def __init__(self, fname, max_entries=100000):
+        if os.path.isdir(fname):
+            fname = os.path.join(fname, BG_CACHE_NAME)
+        self.fname = fname
+        self.max_entries = max_entries
+        self.hits, self.misses = 0, 0
+        self._used = []
+
+        self._db = None
+        try:
+            self._db = sqlite3.connect(fname, timeout=BG_CACHE_TIMEOUT)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS background ('
+                'rnd_seed INTEGER, size INTEGER, total_hits INTEGER, half_window INTEGER, perms INTEGER, '
+                'distribution BLOB, last_used REAL, '
+                'PRIMARY KEY (rnd_seed, size, total_hits, half_window, perms))')
+            self._db.commit()
+        except sqlite3.DatabaseError as error:
+            self._failed('open', error)
+            # Database that cannot be opened is not used at all:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+
+    def _failed(self, action, error):
+        """Log failed database ``action`` and roll back its transaction."""
+        LOGGER.warning('Could not %s background cache %s (%s), continuing without it.', action, self.fname, error)
+        if self._db is None:
+            return
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+    def get(self, key):
+        """Return distribution stored under ``key`` or None."""
+        row = None
+        if self._db is not None:
+            try:
+                row = self._db.execute(
+                    'SELECT distribution FROM background WHERE rnd_seed=? AND size=? AND total_hits=? '
+                    'AND half_window=? AND perms=?', key).fetchone()
+            except sqlite3.DatabaseError as error:
+                self._failed('read from', error)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append(key)
+        return numpy.frombuffer(row[0], dtype=numpy.float64).tolist()
+
+    def put(self, key, distribution):
+        """Store ``distribution`` under ``key`` and commit it."""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO background VALUES (?, ?, ?, ?, ?, ?, ?)',
+                key + (numpy.asarray(distribution, dtype=numpy.float64).tobytes(), time.time()))
+            self._db.commit()
+        except sqlite3.DatabaseError as error:
+            self._failed('write to', error)
+
+    def close(self):
+        """Update usage of distributions and remove least recently used ones."""
+        if self._db is None:
+            return
+        try:
+            self._db.executemany(
+                'UPDATE background SET last_used=? WHERE rnd_seed=? AND size=? AND total_hits=? '
+                'AND half_window=? AND perms=?', [(time.time(),) + key for key in self._used])
+            self._db.execute(
+                'DELETE FROM background WHERE rowid IN '
+                '(SELECT rowid FROM background ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self._db.commit()
+        except sqlite3.DatabaseError as error:
+            self._failed('update', error)
+        self._db.close()
+        self._db = None
+
+
+def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000, bg_cache=None, rnd_seed=None):
     """
     Return background distribution for given region size and number of hits.
 
@@ -245,6 +449,13 @@ def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
 
     Results are cached, so they can be reused.
 
+    If ``rnd_seed`` is given, random generator is seeded from ``rnd_seed``
+    and all other parameters (with ``numpy.random.SeedSequence``). Returned
+    distribution then only depends on the parameters and not on the state of
+    global random generator (order in which distributions are computed).
+    Note: seed does not depend on group, for which distribution is computed,
+    so that groups with the same size and number of hits can share it.
+
     Parameters
     ----------
     size : int
@@ -255,6 +466,11 @@ def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
         Half-window size. The actual window size is: 2 * half_window + 1.
     perms : int
         Number of permutations to make.
+    bg_cache : _BackgroundCache
+        Cache of distributions from previous runs. Only used if ``rnd_seed``
+        is given.
+    rnd_seed : int
+        Seed for random generator.
 
     Returns
     -------
@@ -263,32 +479,114 @@ def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
         i-th element or returned array.
 
     """
-    cache_key = (size, total_hits, half_window, perms)
-    if cache_key not in PS_CACHE:
-
-        rnd_ps = numpy.zeros((perms, total_hits + 1))
-        for i in range(perms):
-
-            # Draw random distribution of cross-link events in a group with
-            # group size = `size` and number of cross-link events = `total_hits`
-            # pylint: disable=no-member
-            rnd_hits = Counter(numpy.random.randint(size, size=total_hits))
+    cache_key = (rnd_seed, size, total_hits, half_window, perms)
+    if cache_key not in PS_CACHE and bg_cache is not None and rnd_seed is not None:
+        rnd_dist_fixed = bg_cache.get(cache_key)
+        if rnd_dist_fixed is not None:
+            PS_CACHE[cache_key] = rnd_dist_fixed
 
-            # This is then list. i-th element in list is probability, that there
-            # is equal or more than i crossslinks on some position???
+    if cache_key not in PS_CACHE:
 
-            scores_cww = _sum_within_window_nopos(rnd_hits.items(), half_window=half_window)
-            rnd_ps[i, :] = cumulative_prob(scores_cww, total_hits)
+        # Draw random distributions of cross-link events in a group with group
+        # size = `size` and number of cross-link events = `total_hits`. For each
+        # of them, i-th element in row is probability, that there is equal or
+        # more than i cross-links (in window) on some position.
+        rng = numpy.random
+        if rnd_seed is not None:
+            seed = numpy.random.SeedSequence([rnd_seed, size, total_hits, half_window, perms])
+            rng = numpy.random.RandomState(numpy.random.MT19937(seed))
+        rnd_ps = _rnd_cumulative_probs(size, total_hits, half_window, perms, rng=rng)
 
         rnd_dist = numpy.mean(rnd_ps, axis=0) + numpy.std(rnd_ps, axis=0)
+        # Probabilities above the largest random SWW score are zero:
+        rnd_dist = numpy.concatenate([rnd_dist, numpy.zeros(total_hits + 1 - len(rnd_dist))])
         # Adding std, can make probability higher than 1, which is nonsense. Fix:
         rnd_dist_fixed = [min(1.0, prob) for prob in rnd_dist]
         PS_CACHE[cache_key] = rnd_dist_fixed
+        if bg_cache is not None and rnd_seed is not None:
+            bg_cache.put(cache_key, rnd_dist_fixed)
 
     return PS_CACHE[cache_key]
 
 
-def _process_group(pos_scores, group_size, half_window, perms):
+def _poisson_pmf(mean, max_k):
+    """Return probabilities of 0, 1, ..., ``max_k`` events in Poisson distribution."""
+    pmf = numpy.zeros(max_k + 1)
+    if mean == 0:
+        pmf[0] = 1.0
+        return pmf
+    log_factorial = numpy.concatenate([[0.0], numpy.cumsum(numpy.log(numpy.arange(1, max_k + 1)))])
+    return numpy.exp(numpy.arange(max_k + 1) * math.log(mean) - mean - log_factorial)
+
+
+def get_analytic_distrib(size, total_hits, half_window):
+    """
+    Return approximation of background distribution, computed analytically.
+
+    This is an approximation of ``get_avg_rnd_distrib`` for large groups. If
+    ``total_hits`` are randomly distributed in group of size ``size``, the
+    number of hits on each position is approximately Poisson distributed, with
+    mean ``total_hits / size``. SWW score on a cross-linked position is the
+    sum of hits on it (at least one) and hits on other positions in window.
+    Probability of SWW score i or more is therefore a tail of convolution of
+    the two Poisson distributions (edge effects are ignored). As in
+    ``get_avg_rnd_distrib``, standard deviation (of fraction of cross-linked
+    positions with such score) is added.
+
+    Parameters
+    ----------
+    size : int
+        Size of region.
+    total_hits : int
+        Number of cross-link events in region.
+    half_window : int
+        Half-window size. The actual window size is: 2 * half_window + 1.
+
+    Returns
+    -------
+    list
+        Probability to find CWW score i or more on chosen position is equal to
+        i-th element or returned list.
+
+    """
+    if total_hits == 0:
+        return [1.0]
+    mean = total_hits / size
+    window_mean = mean * (min(2 * half_window + 1, size) - 1)
+    # Probabilities of larger scores are negligible:
+    max_k = min(total_hits, math.ceil(mean + window_mean + 12 * math.sqrt(mean + window_mean) + 20))
+
+    # Distribution of SWW scores 1, 2, ... on positions with at least one hit:
+    sww_pmf = numpy.convolve(_poisson_pmf(mean, max_k)[1:], _poisson_pmf(window_mean, max_k))[:max_k]
+    sww_pmf /= -math.expm1(-mean)
+
+    probs = numpy.zeros(total_hits + 1)
+    probs[0] = 1.0
+    probs[1:max_k + 1] = numpy.minimum(numpy.cumsum(sww_pmf[::-1])[::-1], 1.0)
+    positions = -size * math.expm1(-mean)
+    probs += numpy.sqrt(probs * (1 - probs) / positions)
+    return [min(1.0, prob) for prob in probs]
+
+
+def _null_model_params(group_size, total_hits, null_model):
+    """
+    Return (size, total_hits) of random distribution, used for group.
+
+    Return None if distribution is computed analytically.
+    """
+    if null_model == 'analytic' and group_size >= ANALYTIC_MIN_SIZE:
+        return None
+    return group_size, total_hits
+
+
+def _get_background(group_size, total_hits, half_window, perms, rnd_seed=None, null_model='permutation'):
+    """Return background distribution for group, computed with ``null_model``."""
+    if _null_model_params(group_size, total_hits, null_model) is None:
+        return get_analytic_distrib(group_size, total_hits, half_window)
+    return get_avg_rnd_distrib(group_size, total_hits, half_window, perms=perms, rnd_seed=rnd_seed)
+
+
+def _process_group(pos_scores, group_size, half_window, perms, rnd_seed=None, null_model='permutation'):
     """
     Assign FDR value to each position in group.
 
@@ -350,6 +648,10 @@ def _process_group(pos_scores, group_size, half_window, perms):
         Lits with (position, scores) elements.
     group_size : list
         Size of region
+    rnd_seed : int
+        Seed for random generator (see ``get_avg_rnd_distrib``).
+    null_model : str
+        Null model used for background distribution (see ``run``).
 
     Returns
     -------
@@ -368,7 +670,7 @@ def _process_group(pos_scores, group_size, half_window, perms):
     observed = cumulative_prob(scores_sww, sum_scores)
 
     # Calculate random cumulative_prob for given group_size and sum_scores:
-    random_ = get_avg_rnd_distrib(group_size, sum_scores, half_window, perms=perms)
+    random_ = _get_background(group_size, sum_scores, half_window, perms, rnd_seed=rnd_seed, null_model=null_model)
 
     # This step follows the article [1] to produce FDR values. First, produce
     # mapping from sww_scores to FDR value:
@@ -380,8 +682,307 @@ def _process_group(pos_scores, group_size, half_window, perms):
     return zip(positions, scores, scores_sww, fdr_scores)
 
 
+def _background_key(pos_scores, group_size, half_window, perms, rnd_seed, null_model):
+    """Return key of background distribution for group in ``PS_CACHE`` (None if it is not cached)."""
+    params = _null_model_params(group_size, math.ceil(sum([score for _, score in pos_scores])), null_model)
+    if params is None:
+        return None
+    return (rnd_seed,) + params + (half_window, perms)
+
+
+def _init_worker(backgrounds):
+    """
+    Store background distributions in ``PS_CACHE`` of worker process.
+
+    This is the initializer of the process pool in ``_process_groups``, so
+    distributions that are already known to the main process are sent to each
+    worker once (and not with each task).
+    """
+    PS_CACHE.update(backgrounds)
+
+
+def _process_group_task(task):
+    """
+    Assign FDR value to each position in one group.
+
+    This is the unit of work for the process pool in ``_process_groups``. If
+    background distribution of group is computed by the task (it was not in
+    ``PS_CACHE``), it is also returned, so that main process can store it.
+    """
+    key, hits, group_size, half_window, perms, rnd_seed, null_model = task
+    cache_key = _background_key(hits, group_size, half_window, perms, rnd_seed, null_model)
+    computed = cache_key is not None and cache_key not in PS_CACHE
+
+    processed = list(_process_group(hits, group_size, half_window, perms, rnd_seed=rnd_seed, null_model=null_model))
+
+    background = PS_CACHE[cache_key] if computed else None
+    return key, processed, background
+
+
+def _parse_attributes(attr_str):
+    """
+    Parse attributes of GTF (or GFF) record into dict.
+
+    Attributes are parsed the same way as in ``pybedtools.Interval.attrs``.
+    """
+    attrs = {}
+    field_sep = '=' if attr_str.count('=') > attr_str.count(';') - 1 else ' '
+    for item in attr_str.strip().split(';'):
+        item = item.strip()
+        if item:
+            field, value = item.split(field_sep, 1)
+            attrs[field] = value.replace('"', '')
+    return attrs
+
+
+def _group_overlaps(records, group_by, multi_mode):
+    """
+    Group cross-linked sites by annotation features they intersect with.
+
+    Records are fields of ``intersect -wo`` output between annotation (GTF)
+    and cross-linked sites (BED6), from ``iCount.files.intervals.intersect``
+    or ``_split_lines``. They are parsed directly (without
+    ``pybedtools.Interval``). Attributes of annotation feature are parsed only
+    once for all of its (consecutive) overlaps with sites.
+
+    Feature name is the first existing attribute from ``GTF_NAME_ATTRIBUTES``
+    (same as ``pybedtools.Interval.name``).
+
+    Returns
+    -------
+    tuple
+        Dict (chrom, strand, group_id, name) -> list of (position, score) of
+        sites and dict (chrom, strand, group_id, name) -> set of (start, end) of
+        features in group.
+
+    """
+    groups = {}
+    group_sizes = {}
+    last_feature, hits = None, None
+    for fields in records:
+        chrom, strand = fields[0], fields[6]
+        site_chrom = fields[9]
+        site_pos = int(fields[10])
+        site_end = int(fields[11])
+        site_dot = fields[12]
+        site_score = float(fields[13])
+        site_strand = fields[14]
+        assert site_chrom == chrom
+        assert site_strand == strand
+        assert site_dot == '.'
+        assert site_pos == site_end - 1
+
+        feature = fields[:9]
+        if feature != last_feature:
+            last_feature = feature
+            attrs = _parse_attributes(feature[8])
+            name = next((attrs[key] for key in GTF_NAME_ATTRIBUTES if key in attrs), None)
+
+            # Determine group_id depending on multi_mode...
+            group_id = attrs[group_by]
+            if multi_mode:
+                group_id = feature[2] + '_' + group_id
+
+            key = (chrom, strand, group_id, name)
+            hits = groups.setdefault(key, [])
+            group_sizes.setdefault(key, set()).add((int(feature[3]) - 1, int(feature[4])))
+
+        hits.append((site_pos, site_score))
+
+    return groups, group_sizes
+
+
+def _process_groups(groups, group_sizes, half_window, perms, rnd_seed, null_model='permutation', cache=None,
+                    threads=1):
+    """
+    Assign FDR value to each position in all groups.
+
+    Groups are processed in a pool of ``threads`` processes. Random
+    distributions are drawn with seed derived from ``rnd_seed`` and their
+    parameters (see ``get_avg_rnd_distrib``), so results do not depend on
+    number of processes or on order in which groups are processed. Seed does
+    not depend on group itself (for example, its name), so that groups with
+    the same size and number of hits share the distribution. Distributions
+    are also loaded from and stored to ``cache`` (``_BackgroundCache``), if
+    given.
+
+    Distributions that are known before groups are processed, are sent to
+    worker processes once, when the pool is started. Distributions computed
+    by workers are sent back to the main process, so that they can be reused
+    for next groups and stored in ``cache``.
+
+    Returns
+    -------
+    dict
+        (chrom, pos, strand) -> list of (fdr_score, name, group_id, score,
+        score_extended) for each group, in which position is.
+
+    """
+    # Crucial step: each position in a group is given a fdr_score, based on
+    # hits in group, group_size, half-window size and number of
+    # permutations. Large groups take longest, so they are processed first:
+    tasks, backgrounds, missing = [], {}, set()
+    for key, hits in sorted(groups.items()):
+        cache_key = _background_key(hits, group_sizes[key], half_window, perms, rnd_seed, null_model)
+        if cache_key is not None and cache_key not in backgrounds:
+            if cache is not None and cache_key not in PS_CACHE and cache_key not in missing:
+                background = cache.get(cache_key)
+                if background is None:
+                    missing.add(cache_key)
+                else:
+                    PS_CACHE[cache_key] = background
+            if cache_key in PS_CACHE:
+                backgrounds[cache_key] = PS_CACHE[cache_key]
+        tasks.append((key, hits, group_sizes[key], half_window, perms, rnd_seed, null_model))
+    tasks.sort(key=lambda task: task[2], reverse=True)
+
+    pool = None
+    if threads > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(threads, len(tasks)), initializer=_init_worker, initargs=(backgrounds,))
+        processed_groups = pool.imap_unordered(_process_group_task, tasks)
+    else:
+        processed_groups = map(_process_group_task, tasks)
+
+    results = {}
+    try:
+        for key, processed, background in processed_groups:
+            chrom, strand, group_id, name = key
+
+            # FDR scores (+ some other info) are written to `results` container:
+            for (pos, val, val_extended, fdr_score) in processed:
+                results.setdefault((chrom, pos, strand), []).\
+                    append((fdr_score, name, group_id, val, val_extended))
+
+            if background is not None:
+                cache_key = _background_key(groups[key], group_sizes[key], half_window, perms, rnd_seed, null_model)
+                PS_CACHE[cache_key] = background
+                if cache_key in missing:
+                    cache.put(cache_key, background)
+                    missing.remove(cache_key)
+    finally:
+        if pool is not None:
+            # All results are received (or processing failed):
+            pool.terminate()
+            pool.join()
+
+    return results
+
+
+def _chrom_blocks(fname):
+    """
+    Return blocks of lines for each chromosome in (sorted) file ``fname``.
+
+    Returns
+    -------
+    dict
+        Chromosome -> list of (start, end) byte offsets of blocks of
+        consecutive lines with this chromosome.
+
+    """
+    blocks = {}
+    block_chrom, block_start, offset = None, 0, 0
+    with open(fname, 'rb') as handle:
+        for line in handle:
+            chrom = line.split(b'\t', 1)[0]
+            if chrom != block_chrom:
+                if block_chrom is not None:
+                    blocks.setdefault(block_chrom.decode(), []).append((block_start, offset))
+                block_chrom, block_start = chrom, offset
+            offset += len(line)
+    if block_chrom is not None:
+        blocks.setdefault(block_chrom.decode(), []).append((block_start, offset))
+    return blocks
+
+
+def _read_blocks(fname, blocks):
+    """Yield lines in ``blocks`` (list of byte offsets, from ``_chrom_blocks``) of file ``fname``."""
+    with open(fname, 'rb') as handle:
+        for start, end in blocks:
+            handle.seek(start)
+            offset = start
+            while offset < end:
+                line = handle.readline()
+                offset += len(line)
+                yield line.decode()
+
+
+def _add_not_annotated(site_lines, results):
+    """
+    Add cross-linked sites from ``site_lines`` that are not in ``results`` as not annotated.
+
+    Every site, that intersects with annotation, is already in ``results``
+    (it is in at least one group). Remaining sites are therefore the ones
+    that ``bedtools intersect -v`` would report, so a single pass over sites
+    suffices.
+
+    Returns
+    -------
+    int
+        Number of added (not annotated) sites.
+
+    """
+    added = 0
+    for line in site_lines:
+        fields = line.rstrip('\r\n').split('\t')
+        site_chrom = fields[0]
+        site_start = int(fields[1])
+        site_end = int(fields[2])
+        # site_name = fields[3]
+        site_score = fields[4]
+        site_strand = fields[5]
+        assert site_start == site_end - 1
+        k = (site_chrom, site_start, site_strand)
+        if k in results:
+            continue
+        results[k] = [(1.0, 'not_annotated', 'not_annotated', site_score, 'not_calculated')]
+        added += 1
+    return added
+
+
+def _split_lines(lines):
+    """Yield fields of tab-separated ``lines``."""
+    for line in lines:
+        yield line.rstrip('\r\n').split('\t')
+
+
+def _write_results(results, sigxls, scores, fdr):
+    """
+    Write results to ``sigxls`` and ``scores`` (if given) file handles, sorted by position.
+
+    Return number of significant positions.
+    """
+    significant_positions = 0
+    for (chrom, pos, strand), annot_list in sorted(results.items()):
+        annot_list = sorted(annot_list)
+
+        # Make sigxls: a BED6 file, with only the most significant cross-links.
+        # Report minimum fdr_score for each position in BED6:
+        min_fdr_score = annot_list[0][0]
+        if min_fdr_score < fdr:
+            significant_positions += 1
+            # position has significant records - report the most significant ones:
+            min_fdr_records = [rec for rec in annot_list if rec[0] == min_fdr_score]
+
+            _, names, group_ids, group_scores, _ = zip(*min_fdr_records)
+            if names == group_ids:
+                name = ','.join(names)
+            else:
+                name = ','.join(names) + '-' + ','.join(group_ids)
+            line = [chrom, pos, pos + 1, name, group_scores[0], strand]
+            sigxls.write('\t'.join([_f2s(i, dec=4)for i in line]) + '\n')
+
+        # Make scores: a tab-separated file, with ALL cross-links, (no significance threshold)
+        if scores:
+            for (fdr_score, name, group_id, score, val_extended) in annot_list:
+                line = [chrom, pos, strand, name, group_id, score, val_extended, fdr_score]
+                scores.write('\t'.join([_f2s(i, dec=6) for i in line]) + '\n')
+
+    return significant_positions
+
+
 def run(annotation, sites, sigxls, scores=None, features=None, group_by='gene_id',
-        merge_features=False, half_window=3, fdr=0.05, perms=100, rnd_seed=42,
+        merge_features=False, half_window=3, fdr=0.05, perms=100, rnd_seed=42, null_model='permutation',
+        bg_cache=None, bg_cache_size=100000, threads=1, native=False, sites_group='single',
         report_progress=False):
     """
     Find positions with high density of cross-linked sites.
@@ -399,7 +1000,8 @@ def run(annotation, sites, sigxls, scores=None, features=None, group_by='gene_id
     annotation : str
         Annotation file in GTF format, obtained from "iCount segment" command.
     sites : str
-        File with cross-links in BED6 format.
+        File with cross-links in BED6 format or NPZ file, written by
+        ``iCount xlsites`` (see ``sites_group``).
     sigxls : str
         File name for "sigxls" output. File reports positions with significant
         number of cross-link events. It should have .bed or .bed.gz extension.
@@ -422,7 +1024,30 @@ def run(annotation, sites, sigxls, scores=None, features=None, group_by='gene_id
     perms : int
         Number of permutations when calculating random distribution.
     rnd_seed : int
-        Seed for random generator.
+        Seed for random generator. Random distribution for each group size and
+        number of hits is drawn with its own seed, derived from this one.
+    null_model : str
+        How random (background) distribution of SWW scores is determined.
+        With 'permutation', it is computed for each group size and number of
+        hits with ``perms`` permutations. With 'analytic',
+        distribution for groups of at least 1000 nucleotides is approximated
+        with Poisson distribution instead.
+    bg_cache : str
+        SQLite file in which random distributions are cached between runs (with
+        the same ``rnd_seed``). If directory is given (for example, the one set
+        in ``ICOUNT_TMP_ROOT``), file sigxls_background.sqlite in it is used.
+    bg_cache_size : int
+        Maximal number of distributions in ``bg_cache``. Least recently used
+        ones are removed first.
+    threads : int
+        Number of processes used to compute FDR values. Groups (of each
+        chromosome) are distributed among them, largest ones first. Results do not depend on
+        number of processes.
+    native : bool
+        Intersect annotation and cross-links with
+        ``iCount.files.intervals.intersect`` instead of bedtools.
+    sites_group : str
+        Group of sites ('single' or 'multi'), used if ``sites`` is NPZ file.
     report_progress : bool
         Report analysis progress.
 
@@ -440,7 +1065,8 @@ def run(annotation, sites, sigxls, scores=None, features=None, group_by='gene_id
     assert sigxls.endswith(('.bed', '.bed.gz'))
     if scores:
         assert scores.endswith(('.tsv', '.tsv.gz', '.csv', '.csv.gz', 'txt', 'txt.gz'))
-    numpy.random.seed(rnd_seed)  # pylint: disable=no-member
+    assert threads >= 1
+    assert null_model in NULL_MODELS
 
     LOGGER.info('Loading annotation file...')
     annotation2 = iCount.files.decompress_to_tempfile(annotation)
@@ -458,127 +1084,99 @@ def run(annotation, sites, sigxls, scores=None, features=None, group_by='gene_id
                 metrics.annotation_used, metrics.annotation_all, metrics.annotation_skipped)
 
     LOGGER.info('Loading cross-links file...')
-    sites = pybedtools.BedTool(sites).sort().saveas()
+    if sites.endswith('.npz'):
+        sites_bed = iCount.files.npz.write_bed(
+            sites, sites_group, iCount.files.get_temp_file_name(extension='bed'))
+        sites = pybedtools.BedTool(sites_bed).sort().saveas()
+        os.remove(sites_bed)
+    else:
+        sites = pybedtools.BedTool(sites).sort().saveas()
 
     # intersect cross-linked sites with regions
     LOGGER.info('Calculating intersection between annotation and cross-link file...')
-    overlaps = annotation.intersect(sites, sorted=True, s=True, wo=True).saveas()
-
-    groups = {}
-    group_sizes = {}
-    multi_mode = len(features) > 1 and not merge_features
-    LOGGER.info('Processing intersections...')
-    for feature in overlaps:
-        chrom = feature.chrom
-        start = feature.start
-        end = feature.stop
-        name = feature.name
-        strand = feature.strand
-        site_chrom = feature.fields[9]
-        site_pos = int(feature.fields[10])
-        site_end = int(feature.fields[11])
-        site_dot = feature.fields[12]
-        site_score = float(feature.fields[13])
-        site_strand = feature.fields[14]
-        assert site_chrom == chrom
-        assert site_strand == strand
-        assert site_dot == '.'
-        assert site_pos == site_end - 1
-
-        # Determine group_id depending on multi_mode...
-        group_id = feature.attrs[group_by]
-        if multi_mode:
-            group_id = feature[2] + '_' + group_id
-
-        groups.setdefault((chrom, strand, group_id, name), []).append((site_pos, site_score))
-        group_sizes.setdefault((chrom, strand, group_id, name), set()).add((start, end))
+    if native:
+        annotation_intervals = iCount.files.intervals.read_intervals(annotation.fn)
+        sites_intervals = iCount.files.intervals.read_intervals(sites.fn)
+
+        def chrom_overlaps(chrom):
+            """Return overlaps on chromosome ``chrom``."""
+            return iCount.files.intervals.intersect(
+                annotation_intervals, sites_intervals, s=True, wo=True, chroms=[chrom])
+    else:
+        overlaps = annotation.intersect(sites, sorted=True, s=True, wo=True).saveas()
+        overlaps_blocks = _chrom_blocks(overlaps.fn)
 
-    # Validate that segments in same group do not overlap: start of next feature
-    # is greater than stop of the current one:
-    for sizes in group_sizes.values():
-        sizes = sorted(sizes)
-        for first, second in zip(sizes, sizes[1:]):
-            assert first[1] < second[0]
+        def chrom_overlaps(chrom):
+            """Return overlaps on chromosome ``chrom``."""
+            return _split_lines(_read_blocks(overlaps.fn, overlaps_blocks.get(chrom, [])))
 
-    # calculate total length of each group by summing element sizes:
-    group_sizes = dict([(name, sum([end - start for start, end in elements])) for
-                        name, elements in group_sizes.items()])
+    # Results are computed and written for one chromosome at a time, so that
+    # only results for one chromosome are kept in memory. Cross-linked sites
+    # outside annotated regions are determined in the same pass over sites:
+    sites_blocks = _chrom_blocks(sites.fn)
+    chroms = sorted(sites_blocks)
+    sites_size = sum(end - start for blocks in sites_blocks.values() for start, end in blocks)
 
-    # calculate and assign FDRs to each cross-linked site. FDR values are
-    # calculated together for each group.
-    results = {}
-    metrics.all_groups = len(groups)
-    progress, j = 0, 0
-    for (chrom, strand, group_id, name), hits in sorted(groups.items()):
-        j += 1
-        if report_progress:
-            new_progress = j / metrics.all_groups
-            # pylint: disable=protected-access
-            progress = iCount._log_progress(new_progress, progress, LOGGER)
-
-        group_size = group_sizes[(chrom, strand, group_id, name)]
-
-        # Crucial step: each position in a group is given a fdr_score, based on
-        # hits in group, group_size, half-window size and number of
-        # permutations. Than, FDR scores (+ some other info) are written to
-        # `results` container:
-        processed = _process_group(hits, group_size, half_window, perms)
-        for (pos, val, val_extended, fdr_score) in processed:
-            results.setdefault((chrom, pos, strand), []).\
-                append((fdr_score, name, group_id, val, val_extended))
-    metrics.positions_annotated = len(results)
-
-    # cross-linked sites outside annotated regions
-    LOGGER.info('Determining cross-links not intersecting with annotation...')
-    skipped = sites.intersect(annotation, sorted=True, s=True, v=True).saveas()
-    for feature in skipped:
-        site_chrom = feature.chrom
-        site_start = feature.start
-        site_end = feature.stop
-        # site_name = feature.name
-        site_score = feature.score
-        site_strand = feature.strand
-        assert site_start == site_end - 1
-        k = (site_chrom, site_start, site_strand)
-        assert k not in results
-        results.setdefault(k, []).\
-            append((1.0, 'not_annotated', 'not_annotated', site_score, 'not_calculated'))
+    multi_mode = len(features) > 1 and not merge_features
+    metrics.null_model = null_model
+    metrics.all_groups = 0
+    metrics.positions_annotated = 0
+    metrics.positions_all = 0
+    metrics.significant_positions = 0
+    cache = _BackgroundCache(bg_cache, max_entries=bg_cache_size) if bg_cache else None
+    sigxls = iCount.files.gz_open(sigxls, 'wt')
+    if scores:
+        header = ['chrom', 'position', 'strand', 'name', 'group_id', 'score', 'score_extended', 'FDR']
+        scores = iCount.files.gz_open(scores, 'wt')
+        scores.write('\t'.join(header) + '\n')
+
+    LOGGER.info('Processing intersections and calculating FDR values...')
+    progress, sites_done = 0, 0
+    try:
+        for chrom in chroms:
+            groups, group_sizes = _group_overlaps(chrom_overlaps(chrom), group_by, multi_mode)
+
+            # Validate that segments in same group do not overlap: start of next feature
+            # is greater than stop of the current one:
+            for sizes in group_sizes.values():
+                sizes = sorted(sizes)
+                for first, second in zip(sizes, sizes[1:]):
+                    assert first[1] < second[0]
+
+            # calculate total length of each group by summing element sizes:
+            group_sizes = dict([(name, sum([end - start for start, end in elements])) for
+                                name, elements in group_sizes.items()])
+
+            # calculate and assign FDRs to each cross-linked site. FDR values are
+            # calculated together for each group.
+            metrics.all_groups += len(groups)
+            results = _process_groups(groups, group_sizes, half_window, perms, rnd_seed, null_model=null_model,
+                                      cache=cache, threads=threads)
+            metrics.positions_annotated += len(results)
+            _add_not_annotated(_read_blocks(sites.fn, sites_blocks[chrom]), results)
+            metrics.positions_all += len(results)
+
+            metrics.significant_positions += _write_results(results, sigxls, scores, fdr)
+
+            sites_done += sum(end - start for start, end in sites_blocks[chrom])
+            if report_progress:
+                # pylint: disable=protected-access
+                progress = iCount._log_progress(sites_done / sites_size, progress, LOGGER)
+    finally:
+        sigxls.close()
+        if scores:
+            scores.close()
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        metrics.bg_cache_hits = cache.hits
+        metrics.bg_cache_misses = cache.misses
+        LOGGER.info('Random distributions found in cache: %d (computed: %d).', cache.hits, cache.misses)
 
-    metrics.positions_all = len(results)
     metrics.positions_not_annotated = metrics.positions_all - metrics.positions_annotated
-    LOGGER.info('Significant crosslinks calculation finished. Writing results to files...')
-
-    # Make sigxls: a BED6 file, with only the most significant cross-links:
-    metrics.significant_positions = 0
-    with iCount.files.gz_open(sigxls, 'wt') as sigxls:
-        for (chrom, pos, strand), annot_list in sorted(results.items()):
-            annot_list = sorted(annot_list)
-
-            # report minimum fdr_score for each position in BED6
-            min_fdr_score = annot_list[0][0]
-            if min_fdr_score < fdr:
-                metrics.significant_positions += 1
-                # position has significant records - report the most significant ones:
-                min_fdr_records = [rec for rec in annot_list if rec[0] == min_fdr_score]
-
-                _, names, group_ids, group_scores, _ = zip(*min_fdr_records)
-                if names == group_ids:
-                    name = ','.join(names)
-                else:
-                    name = ','.join(names) + '-' + ','.join(group_ids)
-                line = [chrom, pos, pos + 1, name, group_scores[0], strand]
-                sigxls.write('\t'.join([_f2s(i, dec=4)for i in line]) + '\n')
     LOGGER.info('BED6 file with significant crosslinks saved to: %s', sigxls.name)
-
-    # Make scores: a tab-separated file, with ALL cross-links, (no significance threshold)
-    header = ['chrom', 'position', 'strand', 'name', 'group_id', 'score', 'score_extended', 'FDR']
     if scores:
-        with iCount.files.gz_open(scores, 'wt') as scores:
-            scores.write('\t'.join(header) + '\n')
-            for (chrom, pos, strand), annot_list in sorted(results.items()):
-                for (fdr_score, name, group_id, score, val_extended) in sorted(annot_list):
-                    line = [chrom, pos, strand, name, group_id, score, val_extended, fdr_score]
-                    scores.write('\t'.join([_f2s(i, dec=6) for i in line]) + '\n')
         LOGGER.info('Scores for each cross-linked position saved to: %s', scores.name)
 
     if to_delete_temp:
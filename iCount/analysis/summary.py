@@ -5,6 +5,7 @@ Cross-link site summary
 
 Report count of cross-link events in each region type.
 """
+import itertools
 import logging
 import math
 import re
@@ -56,19 +57,40 @@ def _parse_overlay_annotations(overlay_annotations):
     return specs
 
 
-def _build_site_type_lookup(sites, annotation):
-    """Build a lookup mapping (chrom, start, stop, strand) -> region type."""
+def _intersect(sites, annotation, native=False, **kwargs):
+    """
+    Intersect ``sites`` with ``annotation``, reporting both (``wb``).
+
+    Intersection is computed with bedtools or with
+    ``iCount.files.intervals.intersect``, if ``native`` is given. Records
+    can be indexed the same way in both cases (fields of sites, followed by
+    fields of annotation). Records are returned as iterator, so that all of
+    them are never held in memory.
+    """
+    if native:
+        return iCount.files.intervals.intersect(sites, annotation, wb=True, **kwargs)
     # pylint: disable=too-many-function-args,unexpected-keyword-arg
-    overlaps = BedTool(sites).intersect(
-        BedTool(annotation), sorted=True, s=True, wb=True, nonamecheck=True).saveas()
+    overlaps = BedTool(sites).intersect(BedTool(annotation), sorted=True, wb=True, nonamecheck=True, **kwargs)
     # pylint: enable=too-many-function-args,unexpected-keyword-arg
+    return iter(overlaps.saveas())
+
+
+def _build_site_type_lookup(sites, annotation, native=False):
+    """Build a lookup mapping (chrom, start, stop, strand) -> region type."""
+    overlaps = _intersect(sites, annotation, native=native, s=True)
     lookup = {}
     for seg in overlaps:
-        key = (seg.chrom, seg.start, seg.stop, seg.strand)
+        key = (seg[0], int(seg[1]), int(seg[2]), seg[5])
         lookup[key] = seg[8]
     return lookup
 
 
+def _trna_biotypes():
+    """Return biotypes of tRNA genes."""
+    from iCount.genomes.segment import SUBTYPE_GROUPS
+    return set(SUBTYPE_GROUPS.get('tRNA', []))
+
+
 def isotype_summary(overlaps, sum_cdna, out_dir):
     """
     Produce tRNA isotype-level summary cross-tabulated with the runner-up type.
@@ -81,16 +103,16 @@ def isotype_summary(overlaps, sum_cdna, out_dir):
 
     Parameters
     ----------
-    overlaps : pybedtools.BedTool
-        Pre-computed site-vs-annotation intersection (with wb=True).
+    overlaps : iterable
+        Pre-computed site-vs-annotation intersection (with wb=True). It is
+        enough to pass overlaps with regions of tRNA biotype.
     sum_cdna : float
         Total cDNA count across all sites.
     out_dir : str
         Output directory.
 
     """
-    from iCount.genomes.segment import SUBTYPE_GROUPS
-    trna_biotypes = set(SUBTYPE_GROUPS.get('tRNA', []))
+    trna_biotypes = _trna_biotypes()
 
     isotype_counter = {}
     label_regions = {}
@@ -103,7 +125,7 @@ def isotype_summary(overlaps, sum_cdna, out_dir):
         if not any(bt in trna_biotypes for bt in biotype_list):
             continue
 
-        score = float(segment.score)
+        score = float(segment[4])
         gene_name = re.match(r'.*gene_name "(.*?)";', segment[-1])
         gene_name = gene_name.group(1) if gene_name else ''
         isotype = _parse_isotype(gene_name)
@@ -138,7 +160,7 @@ def isotype_summary(overlaps, sum_cdna, out_dir):
             out.write('\t'.join(map(str, line)) + '\n')
 
 
-def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir):
+def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir, native=False):
     """
     Produce a cross-tabulated summary of overlay annotation groups x region type.
 
@@ -159,11 +181,14 @@ def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir):
         GTF attribute to use as group label (e.g. 'gene_id', 'family_id').
     out_dir : str
         Output directory.
+    native : bool
+        Compute intersections with ``iCount.files.intervals.intersect``
+        instead of bedtools.
 
     """
     LOGGER.info('Building overlay summary for %s (group_by=%s)...', name, group_by)
 
-    type_lookup = _build_site_type_lookup(sites, regions)
+    type_lookup = _build_site_type_lookup(sites, regions, native=native)
 
     # Use strand-specific intersection only if the overlay has strand info
     overlay_bt = BedTool(overlay_gtf)
@@ -174,16 +199,9 @@ def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir):
     else:
         LOGGER.info('Overlay %s is unstranded, using strand-agnostic intersection.', name)
 
-    # pylint: disable=too-many-function-args,unexpected-keyword-arg
-    intersect_kwargs = dict(sorted=True, wb=True, nonamecheck=True)
-    if stranded:
-        intersect_kwargs['s'] = True
-    overlay_overlaps = BedTool(sites).intersect(overlay_bt, **intersect_kwargs).saveas()
-    # pylint: enable=too-many-function-args,unexpected-keyword-arg
-
-    try:
-        overlay_overlaps[0]
-    except (IndexError, TypeError):
+    overlay_overlaps = _intersect(sites, overlay_gtf, native=native, s=stranded)
+    first = next(overlay_overlaps, None)
+    if first is None:
         LOGGER.warning('No intersections found for overlay %s. Skipping.', name)
         return
 
@@ -194,9 +212,9 @@ def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir):
     overlay_counter = {}
     label_features = {}
     all_features = set()
-    for seg in overlay_overlaps:
-        score = float(seg.score)
-        key = (seg.chrom, seg.start, seg.stop, seg.strand)
+    for seg in itertools.chain([first], overlay_overlaps):
+        score = float(seg[4])
+        key = (seg[0], int(seg[1]), int(seg[2]), seg[5])
         region_type = type_lookup.get(key, 'intergenic')
 
         group_label = re.match(r'.*{} "(.*?)";'.format(re.escape(group_by)), seg[-1])
@@ -226,7 +244,7 @@ def overlay_summary(sites, overlay_gtf, regions, name, group_by, out_dir):
             out.write('\t'.join(map(str, line)) + '\n')
 
 
-def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_annotations=None):
+def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_annotations=None, native=False):
     """
     Make summary reports for a cross-link file.
 
@@ -245,6 +263,9 @@ def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_anno
     overlay_annotations : str
         Overlay annotation GTFs for cross-tabulated summaries. Semicolon-separated specs in format
         gtf_path:name:group_by_attribute (e.g. TE.gtf:TE:gene_id;CRE.gtf:CRE:gene_id).
+    native : bool
+        Intersect cross-links and annotation with
+        ``iCount.files.intervals.intersect`` instead of bedtools.
 
     Returns
     -------
@@ -260,25 +281,23 @@ def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_anno
         summary_templates(annotation, templates_dir)
 
     LOGGER.info('Calculating intersection between cross-link and annotation...')
-    # pylint: disable=too-many-function-args,unexpected-keyword-arg
-    overlaps = BedTool(sites).intersect(
-        BedTool(annotation),
-        sorted=True,  # invokes memory efficient algorithm for large files
-        s=True,  # only report hits in B that overlap A on the same strand
-        wb=True,  # write the original entry in B for each overlap
-        nonamecheck=True,  # Do not print warnings about name inconsistency to stdout
-    ).saveas()
-    # pylint: enable=too-many-function-args,unexpected-keyword-arg
-    try:
-        overlaps[0]  # will raise Error if overlaps is empty:
-    except (IndexError, TypeError):
+    overlaps = _intersect(
+        sites,
+        annotation,
+        native=native,
+        s=True,  # only report hits in annotation that overlap site on the same strand
+    )
+    first = next(overlaps, None)
+    if first is None:
         raise ValueError('No intersections found. This may be caused by different naming of chromosomes in annotation'
                          'and cross-links file (example: "chr1" vs. "1")')
 
     type_counter, subtype_counter, gene_counter = {}, {}, {}
+    # Overlaps are not stored, except the few needed for tRNA isotype summary:
+    trna_biotypes, trna_overlaps = _trna_biotypes(), []
     LOGGER.info('Extracting summary data from intersection...')
-    for segment in overlaps:
-        score = float(segment.score)
+    for segment in itertools.chain([first], overlaps):
+        score = float(segment[4])
 
         type_ = segment[8]
         type_counter[type_] = type_counter.get(type_, 0) + score
@@ -289,6 +308,8 @@ def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_anno
         for biotype in biotypes:
             sbtyp = iCount.genomes.segment.make_subtype(type_, biotype)
             subtype_counter[sbtyp] = subtype_counter.get(sbtyp, 0) + score / len(biotypes)
+        if any(biotype in trna_biotypes for biotype in biotypes):
+            trna_overlaps.append(segment)
 
         gene_id = re.match(r'.*gene_id "(.*?)";', segment[-1])
         gene_id = gene_id.group(1) if gene_id else None
@@ -338,13 +359,13 @@ def summary_reports(annotation, sites, out_dir, templates_dir=None, overlay_anno
             out.write('\t'.join(map(str, line)) + '\n')
 
     # tRNA isotype summary (auto-detected from annotation biotypes)
-    isotype_summary(overlaps, sum_cdna, out_dir)
+    isotype_summary(trna_overlaps, sum_cdna, out_dir)
 
     # Overlay summaries (TE, CRE, etc.)
     if overlay_annotations:
         overlay_specs = _parse_overlay_annotations(overlay_annotations)
         for gtf_path, name, group_by in overlay_specs:
-            overlay_summary(sites, gtf_path, annotation, name, group_by, out_dir)
+            overlay_summary(sites, gtf_path, annotation, name, group_by, out_dir, native=native)
 
     LOGGER.info('Done.')
     return metrics
@@ -352,6 +352,7 @@ def main():
     make_parser_from_function(iCount.mapping.mapstar.run, subparsers,
                               module=iCount.mapping.mapstar)
     make_parser_from_function(iCount.mapping.xlsites.run, subparsers)
+    make_parser_from_function(iCount.mapping.xlsites.xlsites_batch, subparsers, only_func=True)
 
     # Analysis:
     make_parser_from_function(
@@ -36,11 +36,11 @@ iCount mapstar demultiplexed/demux_NNNGGCGNN.fastq.gz hs88 mapping_NNNGGCGNN
 ls -lh mapping_NNNGGCGNN
 
 iCount xlsites mapping_NNNGGCGNN/Aligned.sortedByCoord.out.bam \
-NNNGGCGNN_cDNA_unique.bed  NNNGGCGNN_cDNA_multiple.bed NNNGGCGNN_cDNA_skipped.bam \
+NNNGGCGNN_cDNA_unique.bed  NNNGGCGNN_cDNA_multiple.bed --skipped NNNGGCGNN_cDNA_skipped.bam \
 --group_by start --quant cDNA
 
 iCount xlsites mapping_NNNGGCGNN/Aligned.sortedByCoord.out.bam \
-NNNGGCGNN_reads_unique.bed  NNNGGCGNN_reads_multiple.bed NNNGGCGNN_reads_skipped.bam \
+NNNGGCGNN_reads_unique.bed  NNNGGCGNN_reads_multiple.bed --skipped NNNGGCGNN_reads_skipped.bam \
 --group_by start --quant reads
 
 iCount segment homo_sapiens.88.gtf.gz hs88seg.gtf.gz \
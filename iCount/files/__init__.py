@@ -22,6 +22,15 @@ Parsing of `GTF`_ files is done with `pybedtools`_.
 .. automodule:: iCount.files.fasta
    :members:
 
+.. automodule:: iCount.files.npz
+   :members:
+
+.. automodule:: iCount.files.intervals
+   :members:
+
+.. automodule:: iCount.files.icidx
+   :members:
+
 
 .. _FASTA:
     https://en.wikipedia.org/wiki/FASTA_format
@@ -54,6 +63,9 @@ from . import bed
 from . import bedgraph
 from . import fasta
 from . import fastq
+from . import icidx
+from . import intervals
+from . import npz
 
 
 def gz_open(fname, mode):
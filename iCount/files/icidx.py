@@ -0,0 +1,219 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+ICIDX
+-----
+
+Binary, memory-mappable index of segmentation and regions files.
+
+Parsing of segmentation (``segmentation.gtf.gz``) or regions
+(``regions.gtf.gz``) as text can take more time than the analysis itself.
+``iCount segment`` therefore also writes a binary companion of each file
+(``segmentation.icidx`` and ``regions.icidx``). Intervals are grouped by
+(chromosome, strand) and sorted by start. For all intervals, the following
+arrays are stored:
+
+    * ``start``: start (int64, 0-based)
+    * ``stop``: stop (int64)
+    * ``type``: index (int32) in table of types (3rd column of GTF)
+    * ``biotype``: index (int32) in table of values of ``biotype`` attribute
+    * ``gene``: index (int32) in table of values of ``gene_id`` attribute
+    * ``line``: index (int64) of interval in GTF file
+
+File starts with ``ICIDX`` magic string, length of header and JSON header,
+that holds string tables, offsets of arrays, offsets of (chromosome, strand)
+groups and size, modification time and checksum of GTF file. Arrays follow
+the header (aligned to ``ALIGNMENT`` bytes), so that they can be
+memory-mapped with ``numpy.memmap``. Index is used only if it matches the GTF
+file, next to which it is stored. Checksum is only computed if size or
+modification time of GTF file changed.
+
+Currently, index is used by ``iCount.mapping.xlsites`` (segment borders) and
+``iCount.genomes.segment.summary_templates``. Other analyses parse the GTF
+file.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+
+import numpy
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_EXTENSION = '.icidx'
+GTF_EXTENSIONS = ['.gtf', '.gtf.gz', '.gff', '.gff.gz', '.gff3', '.gff3.gz']
+MAGIC = b'ICIDX\x01'
+ALIGNMENT = 64
+ARRAYS = [
+    ('start', numpy.int64),
+    ('stop', numpy.int64),
+    ('type', numpy.int32),
+    ('biotype', numpy.int32),
+    ('gene', numpy.int32),
+    ('line', numpy.int64),
+]
+
+_RE_ATTRIBUTE = re.compile(r'([^\s;]+) "([^"]*)"')
+
+
+def index_fname(gtf):
+    """Return name of index file (``.icidx`` next to ``gtf``, without GTF extension)."""
+    name = iCount.files.remove_extension(gtf, GTF_EXTENSIONS)
+    return os.path.join(os.path.dirname(os.path.abspath(gtf)), name + INDEX_EXTENSION)
+
+
+def checksum(fname):
+    """Return SHA-256 checksum of file ``fname``."""
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as handle:
+        for block in iter(lambda: handle.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _aligned(offset):
+    """Return first offset, aligned to ``ALIGNMENT``, that is not lower than ``offset``."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_index(gtf):
+    """
+    Write binary index of intervals in ``gtf``.
+
+    Parameters
+    ----------
+    gtf : str
+        Segmentation or regions file, produced by ``iCount segment``.
+
+    Returns
+    -------
+    str
+        Path to index file.
+
+    """
+    tables = {'type': {}, 'biotype': {}, 'gene': {}}
+    gene_names = {}
+    columns = {}
+    line_no = 0
+    with iCount.files.gz_open(gtf, 'rt') as handle:
+        for line in handle:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            attrs = dict(_RE_ATTRIBUTE.findall(fields[8]))
+            gene_id = attrs.get('gene_id', '')
+            gene = tables['gene'].setdefault(gene_id, len(tables['gene']))
+            # As in iCount.genomes.segment.summary_templates, the last name of gene is used:
+            gene_names[gene_id] = attrs.get('gene_name', '')
+
+            group = columns.setdefault((fields[0], fields[6]), ([], [], [], [], [], []))
+            group[0].append(int(fields[3]) - 1)
+            group[1].append(int(fields[4]))
+            group[2].append(tables['type'].setdefault(fields[2], len(tables['type'])))
+            group[3].append(tables['biotype'].setdefault(attrs.get('biotype', ''), len(tables['biotype'])))
+            group[4].append(gene)
+            group[5].append(line_no)
+            line_no += 1
+
+    groups, arrays = [], [[] for _ in ARRAYS]
+    size = 0
+    for (chrom, strand), values in sorted(columns.items()):
+        values = [numpy.array(column, dtype=dtype) for column, (_, dtype) in zip(values, ARRAYS)]
+        order = numpy.lexsort((values[1], values[0]))
+        for array, column in zip(arrays, values):
+            array.append(column[order])
+        groups.append([chrom, strand, size, size + order.size])
+        size += order.size
+
+    stat = os.stat(gtf)
+    header = {
+        'source': os.path.basename(gtf),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime_ns,
+        'checksum': checksum(gtf),
+        'size': size,
+        'groups': groups,
+        'types': list(tables['type']),
+        'biotypes': list(tables['biotype']),
+        'genes': list(tables['gene']),
+        'gene_names': [gene_names[gene_id] for gene_id in tables['gene']],
+        'arrays': {},
+    }
+    offsets = header['arrays']
+    offset = 0
+    for name, dtype in ARRAYS:
+        offsets[name] = offset
+        offset = _aligned(offset + size * numpy.dtype(dtype).itemsize)
+    header = json.dumps(header).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    fname = index_fname(gtf)
+    with open(fname, 'wb') as handle:
+        handle.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for (name, dtype), values in zip(ARRAYS, arrays):
+            values = numpy.concatenate(values) if values else numpy.array([], dtype=dtype)
+            handle.seek(data_start + offsets[name])
+            handle.write(values.astype(numpy.dtype(dtype).newbyteorder('<')).tobytes())
+    LOGGER.info('Index of %s saved to: %s', os.path.basename(gtf), fname)
+    return fname
+
+
+def load_index(gtf):
+    """
+    Load binary index of ``gtf``, if it exists and matches ``gtf``.
+
+    Arrays are memory-mapped (not read into memory). If size and
+    modification time of ``gtf`` are the same as when index was written,
+    ``gtf`` is not read. Otherwise, its checksum is compared.
+
+    Parameters
+    ----------
+    gtf : str
+        Segmentation or regions file, produced by ``iCount segment``.
+
+    Returns
+    -------
+    dict
+        Tables ``types``, ``biotypes``, ``genes`` and ``gene_names`` (list of
+        str), arrays (see module documentation) of all intervals and
+        ``groups``: dict (chrom, strand) -> dict of arrays of intervals in
+        group. None is returned if index does not exist or if it was made
+        from a different file.
+
+    """
+    fname = index_fname(gtf)
+    if not os.path.isfile(fname):
+        return None
+
+    with open(fname, 'rb') as handle:
+        if handle.read(len(MAGIC)) != MAGIC:
+            LOGGER.warning('File %s is not an iCount index, ignoring it.', fname)
+            return None
+        header_size = struct.unpack('<Q', handle.read(8))[0]
+        header = json.loads(handle.read(header_size).decode())
+    stat = os.stat(gtf)
+    unchanged = header.get('source_size') == stat.st_size and header.get('source_mtime') == stat.st_mtime_ns
+    if not unchanged and header['checksum'] != checksum(gtf):
+        LOGGER.warning('Index %s does not match %s, ignoring it.', fname, gtf)
+        return None
+
+    data_start = _aligned(len(MAGIC) + 8 + header_size)
+    index = {name: header[name] for name in ['types', 'biotypes', 'genes', 'gene_names']}
+    for name, dtype in ARRAYS:
+        dtype = numpy.dtype(dtype).newbyteorder('<')
+        if header['size']:
+            index[name] = numpy.memmap(fname, dtype=dtype, mode='r', offset=data_start + header['arrays'][name],
+                                       shape=(header['size'],))
+        else:
+            index[name] = numpy.array([], dtype=dtype)
+    index['groups'] = {
+        (chrom, strand): {name: index[name][begin:end] for name, _ in ARRAYS}
+        for chrom, strand, begin, end in header['groups']
+    }
+    LOGGER.debug('Using index %s of %s.', fname, gtf)
+    return index
@@ -0,0 +1,301 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Intervals
+---------
+
+Intersecting `BED`_ and `GTF`_ intervals without ``bedtools``.
+
+Intervals of each chromosome are read into NumPy arrays of start and end
+coordinates (0-based, half-open) and strands. Intersection is then computed
+in the same process with a sorted sweep: intervals in ``b`` are sorted by
+start and for each interval in ``a`` all candidates are found with binary
+search in running maximum of ends and in starts of ``b``.
+
+Output follows ``bedtools intersect -sorted`` with options ``-wa``, ``-wb``,
+``-wo``, ``-v`` and ``-s``. Each record is a tuple of fields (str): for each
+interval in ``a`` (in order of file), overlapping intervals in ``b`` are
+reported in order of file. This is the order of ``bedtools intersect
+-sorted`` only if ``b`` is sorted (as ``bedtools`` requires). Unsorted input
+can be sorted with ``sort_intervals``.
+
+Analyses use ``bedtools`` by default and this module only if they are
+called with ``native`` argument. Both are compared in tests, if ``bedtools``
+is installed.
+
+.. _BED:
+    http://bedtools.readthedocs.io/en/latest/content/general-usage.html#bed-format
+
+.. _GTF:
+    http://www.gencodegenes.org/gencodeformat.html
+
+"""
+import logging
+
+import numpy
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+# Columns of start and end coordinate and offset of start coordinate from 0-based start:
+COORDINATE_COLUMNS = {
+    'bed': (1, 2, 0),
+    'gtf': (3, 4, 1),
+}
+# Maximal number of candidate pairs of intervals, checked for overlap at once:
+PAIRS_CHUNK_SIZE = 2**20
+
+
+def _detect_format(fields):
+    """Return format of interval (``bed`` or ``gtf``), given its ``fields``."""
+    if len(fields) >= 3 and fields[1].isdigit() and fields[2].isdigit():
+        return 'bed'
+    if len(fields) >= 9 and fields[3].isdigit() and fields[4].isdigit():
+        return 'gtf'
+    raise ValueError('Unknown interval format (should be BED or GTF): {}'.format('\t'.join(fields)))
+
+
+def read_intervals(fname):
+    """
+    Read intervals from BED or GTF file into NumPy arrays.
+
+    Comment, ``track`` and ``browser`` lines are skipped. BED files without
+    strand column have strand ``.``.
+
+    Parameters
+    ----------
+    fname : str
+        BED or GTF file (can be gzipped).
+
+    Returns
+    -------
+    dict
+        Chromosome -> dict with arrays ``start``, ``end`` (0-based,
+        half-open), ``strand`` and list ``lines`` (without newlines) of
+        intervals in order of file. Format of file (``bed`` or ``gtf``) is
+        stored under ``format``.
+
+    """
+    columns = {}
+    fmt = None
+    with iCount.files.gz_open(fname, 'rt') as handle:
+        for line in handle:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            line = line.rstrip('\r\n')
+            fields = line.split('\t')
+            if fmt is None:
+                fmt = _detect_format(fields)
+                start_col, end_col, offset = COORDINATE_COLUMNS[fmt]
+                strand_col = 6 if fmt == 'gtf' else 5
+
+            chrom_columns = columns.get(fields[0])
+            if chrom_columns is None:
+                chrom_columns = columns[fields[0]] = ([], [], [], [])
+            chrom_columns[0].append(int(fields[start_col]) - offset)
+            chrom_columns[1].append(int(fields[end_col]))
+            chrom_columns[2].append(fields[strand_col] if len(fields) > strand_col else '.')
+            chrom_columns[3].append(line)
+
+    return {chrom: {
+        'start': numpy.array(starts, dtype=numpy.int64),
+        'end': numpy.array(ends, dtype=numpy.int64),
+        'strand': numpy.array(strands, dtype='U1'),
+        'lines': lines,
+        'format': fmt,
+    } for chrom, (starts, ends, strands, lines) in columns.items()}
+
+
+def sort_intervals(intervals):
+    """
+    Sort intervals by chromosome and start, as ``bedtools sort``.
+
+    Intervals with the same start keep their order.
+
+    Parameters
+    ----------
+    intervals : dict
+        Intervals, returned by ``read_intervals``.
+
+    Returns
+    -------
+    dict
+        Sorted intervals (chromosomes are in sorted order).
+
+    """
+    sorted_intervals = {}
+    for chrom in sorted(intervals):
+        columns = intervals[chrom]
+        order = numpy.argsort(columns['start'], kind='stable')
+        sorted_intervals[chrom] = {
+            'start': columns['start'][order],
+            'end': columns['end'][order],
+            'strand': columns['strand'][order],
+            'lines': [columns['lines'][i] for i in order.tolist()],
+            'format': columns['format'],
+        }
+    return sorted_intervals
+
+
+def _overlap_pairs(a_start, a_end, b_start, b_end):
+    """
+    Return indices of all pairs of overlapping intervals in ``a`` and ``b``.
+
+    Intervals in ``b`` are sorted by start. All intervals in ``b`` that
+    overlap interval in ``a`` are then between first interval whose
+    running maximum of ends is past start of ``a`` and first interval that
+    starts after end of ``a``. Candidates are checked for overlap in chunks
+    of at most ``PAIRS_CHUNK_SIZE`` pairs.
+
+    Returns
+    -------
+    tuple
+        Arrays of indices of intervals in ``a`` and ``b``.
+
+    """
+    if not a_start.size or not b_start.size:
+        empty = numpy.array([], dtype=numpy.int64)
+        return empty, empty
+
+    order = numpy.argsort(b_start, kind='stable')
+    b_end_sorted = b_end[order]
+    lows = numpy.searchsorted(numpy.maximum.accumulate(b_end_sorted), a_start, side='right')
+    highs = numpy.searchsorted(b_start[order], a_end, side='left')
+    counts = numpy.maximum(highs - lows, 0)
+    bounds = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+    a_idxs, b_idxs = [], []
+    first = 0
+    while first < a_start.size:
+        last = numpy.searchsorted(bounds, bounds[first] + PAIRS_CHUNK_SIZE, side='right') - 1
+        last = min(max(last, first + 1), a_start.size)
+        chunk_counts = counts[first:last]
+        a_idx = numpy.repeat(numpy.arange(first, last), chunk_counts)
+        # position of each candidate pair within candidates of its interval in ``a``:
+        offsets = numpy.arange(a_idx.size) - numpy.repeat(bounds[first:last] - bounds[first], chunk_counts)
+        b_pos = lows[a_idx] + offsets
+        overlapping = b_end_sorted[b_pos] > a_start[a_idx]
+        a_idxs.append(a_idx[overlapping])
+        b_idxs.append(order[b_pos[overlapping]])
+        first = last
+
+    return numpy.concatenate(a_idxs), numpy.concatenate(b_idxs)
+
+
+def _chrom_pairs(a_columns, b_columns, s):
+    """Return indices of overlapping intervals in ``a`` and ``b``, sorted by ``a`` and ``b`` index."""
+    if not s:
+        a_idx, b_idx = _overlap_pairs(a_columns['start'], a_columns['end'], b_columns['start'], b_columns['end'])
+    else:
+        a_idxs, b_idxs = [], []
+        for strand in ('+', '-'):
+            a_sel = numpy.flatnonzero(a_columns['strand'] == strand)
+            b_sel = numpy.flatnonzero(b_columns['strand'] == strand)
+            a_idx, b_idx = _overlap_pairs(
+                a_columns['start'][a_sel], a_columns['end'][a_sel],
+                b_columns['start'][b_sel], b_columns['end'][b_sel],
+            )
+            a_idxs.append(a_sel[a_idx])
+            b_idxs.append(b_sel[b_idx])
+        a_idx, b_idx = numpy.concatenate(a_idxs), numpy.concatenate(b_idxs)
+
+    order = numpy.lexsort((b_idx, a_idx))
+    return a_idx[order], b_idx[order]
+
+
+def intersect(a, b, s=False, wa=False, wb=False, wo=False, v=False, chroms=None):
+    """
+    Intersect intervals in ``a`` with intervals in ``b``.
+
+    Options have the same meaning as in ``bedtools intersect``. Without
+    ``wa`` (or ``wo``), coordinates of interval in ``a`` are replaced with
+    coordinates of overlap. Output of ``intersect(a, b, s=True, wb=True)``
+    is therefore the same as output of ``bedtools intersect -a a -b b
+    -sorted -s -wb``, split into fields.
+
+    If ``s`` is given, intervals with strand ``.`` do not overlap any
+    interval (not even other intervals with strand ``.``). Tests compare
+    this with ``bedtools``, if it is installed.
+
+    Parameters
+    ----------
+    a : str or dict
+        BED or GTF file or intervals, returned by ``read_intervals``.
+    b : str or dict
+        BED or GTF file or intervals, returned by ``read_intervals``.
+    s : bool
+        Only report overlaps of intervals on the same strand.
+    wa : bool
+        Report original interval in ``a``.
+    wb : bool
+        Report interval in ``b`` after interval in ``a``.
+    wo : bool
+        Report original intervals in ``a`` and ``b`` and number of
+        overlapping bases.
+    v : bool
+        Only report intervals in ``a`` without overlaps.
+    chroms : list
+        Only report intervals on these chromosomes (in given order).
+        By default all chromosomes in ``a`` are reported in order of file.
+
+    Yields
+    ------
+    tuple
+        Fields of each record.
+
+    """
+    if isinstance(a, str):
+        a = read_intervals(a)
+    if isinstance(b, str):
+        b = read_intervals(b)
+    if chroms is None:
+        chroms = list(a)
+
+    for chrom in chroms:
+        a_columns = a.get(chrom)
+        if a_columns is None:
+            continue
+        a_lines = a_columns['lines']
+        b_columns = b.get(chrom)
+        if b_columns is None:
+            if v:
+                for line in a_lines:
+                    yield tuple(line.split('\t'))
+            continue
+
+        a_idx, b_idx = _chrom_pairs(a_columns, b_columns, s)
+        if v:
+            overlapping = numpy.zeros(len(a_lines), dtype=bool)
+            overlapping[a_idx] = True
+            for i in numpy.flatnonzero(~overlapping):
+                yield tuple(a_lines[i].split('\t'))
+            continue
+
+        b_lines = b_columns['lines']
+        starts = numpy.maximum(a_columns['start'][a_idx], b_columns['start'][b_idx])
+        ends = numpy.minimum(a_columns['end'][a_idx], b_columns['end'][b_idx])
+        # Interval in ``a`` is reported unchanged if it is within interval in ``b``:
+        clipped = (starts != a_columns['start'][a_idx]) | (ends != a_columns['end'][a_idx])
+        start_col, end_col, offset = COORDINATE_COLUMNS[a_columns['format']]
+        # Fields of intervals in ``b`` are split once, even if they overlap many intervals in ``a``:
+        b_fields = {}
+        last_i, a_fields = None, None
+        for i, j, start, end, clip in zip(a_idx.tolist(), b_idx.tolist(), starts.tolist(), ends.tolist(),
+                                          clipped.tolist()):
+            if i != last_i:
+                last_i, a_fields = i, tuple(a_lines[i].split('\t'))
+
+            record = a_fields
+            if clip and not (wa or wo):
+                record = list(a_fields)
+                record[start_col] = str(start + offset)
+                record[end_col] = str(end)
+                record = tuple(record)
+            if wb or wo:
+                fields = b_fields.get(j)
+                if fields is None:
+                    fields = b_fields[j] = tuple(b_lines[j].split('\t'))
+                record = record + fields
+            if wo:
+                record = record + (str(end - start),)
+            yield record
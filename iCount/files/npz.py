@@ -0,0 +1,217 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+NPZ
+---
+
+Reading and writing cross-linked sites in binary, columnar `NPZ`_ format.
+
+Text parsing of BED files can take more time than the analysis itself.
+Cross-linked sites can therefore also be stored in a NumPy NPZ archive, with
+one array per column. Several groups of sites (for example, from single and
+multi-mapped reads) can be stored in the same file. For each group ``name``
+the following arrays are stored:
+
+    * ``<name>_chrom``: index of chromosome (int32) in array ``chroms``
+    * ``<name>_strand``: strand (``+`` or ``-``)
+    * ``<name>_pos``: position (int32)
+    * ``<name>_cdna``: cDNA count (float32)
+    * ``<name>_reads``: read count (int32)
+
+Array ``chroms`` holds names of all chromosomes. Sites are sorted in the same
+way as in BED files, written by ``iCount xlsites``: by chromosome name, position
+and strand.
+
+Analyses that take BED6 file with cross-linked sites, but can also be given
+NPZ file (``iCount sigxls``), convert it with ``write_bed``.
+
+.. _NPZ:
+    https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+
+"""
+import logging
+import os
+import zipfile
+
+import numpy
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+COLUMNS = ['chrom', 'strand', 'pos', 'cdna', 'reads']
+DTYPES = [numpy.int32, 'S1', numpy.int32, numpy.float32, numpy.int32]
+
+
+class SitesWriter:
+    """
+    Write cross-linked sites to NPZ file, one chromosome at a time.
+
+    Columns of each chromosome are written to a temporary file as soon as
+    they are given, so only one chromosome needs to be kept in memory. When
+    writer is closed, columns are copied from temporary files to arrays in
+    NPZ file, in lexicographical order of chromosome names.
+    """
+
+    def __init__(self, fname, names):
+        """Prepare writer of groups ``names`` to output file ``fname``."""
+        self.fname = fname
+        # Group name -> chromosome -> (temporary file, number of sites):
+        self.parts = {name: {} for name in names}
+
+    def write(self, name, chrom, columns):
+        """
+        Write sites of group ``name`` on chromosome ``chrom``.
+
+        Parameters
+        ----------
+        name : str
+            Name of group of sites.
+        chrom : str
+            Chromosome name.
+        columns : tuple
+            Positions, strands, cDNA counts and read counts. Strands are given
+            as 0 ('+') and 1 ('-').
+
+        Returns
+        -------
+        None
+            None.
+
+        """
+        assert chrom not in self.parts[name]
+        positions, strands, cdna, reads = columns
+        part = iCount.files.get_temp_file_name(extension='bin')
+        with open(part, 'wb') as handle:
+            for values, dtype in zip([numpy.array(['+', '-'], dtype='S1')[numpy.asarray(strands, dtype=int)],
+                                      positions, cdna, reads], DTYPES[1:]):
+                handle.write(numpy.asarray(values, dtype=dtype).tobytes())
+        self.parts[name][chrom] = (part, len(positions))
+
+    def close(self):
+        """Join the sites of all chromosomes into output file."""
+        chroms = sorted(set(chrom for by_chrom in self.parts.values() for chrom in by_chrom))
+        with zipfile.ZipFile(self.fname, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with archive.open('chroms.npy', 'w', force_zip64=True) as handle:
+                numpy.lib.format.write_array(handle, numpy.array(chroms, dtype=str))
+
+            for name, by_chrom in self.parts.items():
+                size = sum(part_size for _, part_size in by_chrom.values())
+                # Columns are stored one after another in temporary files:
+                itemsizes = 0
+                for column, dtype in zip(COLUMNS, DTYPES):
+                    with _open_array(archive, '{}_{}'.format(name, column), dtype, size) as handle:
+                        for chrom in sorted(by_chrom):
+                            part, part_size = by_chrom[chrom]
+                            if column == 'chrom':
+                                values = numpy.full(part_size, chroms.index(chrom), dtype=dtype)
+                            else:
+                                values = numpy.fromfile(part, dtype=dtype, count=part_size,
+                                                        offset=part_size * itemsizes)
+                            handle.write(values.tobytes())
+                    if column != 'chrom':
+                        itemsizes += numpy.dtype(dtype).itemsize
+
+        for by_chrom in self.parts.values():
+            for part, _ in by_chrom.values():
+                os.remove(part)
+        self.parts = {}
+        LOGGER.info('Saved to NPZ file: %s', self.fname)
+
+
+def _open_array(archive, name, dtype, size):
+    """Open array ``name`` of ``size`` values in ``archive`` for writing, after its header."""
+    handle = archive.open(name + '.npy', 'w', force_zip64=True)
+    numpy.lib.format.write_array_header_1_0(handle, {
+        'descr': numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)),
+        'fortran_order': False,
+        'shape': (size,),
+    })
+    return handle
+
+
+def save_sites(fname, sites):
+    """
+    Save cross-linked sites to NPZ file.
+
+    Parameters
+    ----------
+    fname : str
+        Output NPZ file.
+    sites : dict
+        Sites in each group: name -> chromosome -> (positions, strands,
+        cDNA counts, read counts) arrays. Strands are given as 0 ('+') and 1
+        ('-').
+
+    Returns
+    -------
+    None
+        None.
+
+    """
+    writer = SitesWriter(fname, list(sites))
+    for name, by_chrom in sites.items():
+        for chrom, columns in by_chrom.items():
+            writer.write(name, chrom, columns)
+    writer.close()
+
+
+def load_sites(fname, name):
+    """
+    Load cross-linked sites of group ``name`` from NPZ file.
+
+    Parameters
+    ----------
+    fname : str
+        NPZ file, written by ``save_sites`` or ``SitesWriter``.
+    name : str
+        Name of group of sites (for example, 'single' or 'multi').
+
+    Returns
+    -------
+    dict
+        Column name -> NumPy array. Chromosome names are in column
+        ``chrom`` and strands in column ``strand`` (as str).
+
+    """
+    with numpy.load(fname) as data:
+        if '{}_pos'.format(name) not in data:
+            raise ValueError('No sites named "{}" in file: {}'.format(name, fname))
+        sites = {column: data['{}_{}'.format(name, column)] for column in COLUMNS}
+        sites['chrom'] = data['chroms'][sites['chrom']]
+    sites['strand'] = sites['strand'].astype(str)
+    return sites
+
+
+def write_bed(fname, name, bed, value='cdna'):
+    """
+    Write cross-linked sites of group ``name`` from NPZ file to BED6 file.
+
+    Sites are written in the same format and order as by ``iCount xlsites``.
+    Note: cDNA counts are stored as float32, so they can differ from the ones
+    in BED file, written by ``iCount xlsites``, in the last decimal place.
+
+    Parameters
+    ----------
+    fname : str
+        NPZ file, written by ``save_sites`` or ``SitesWriter``.
+    name : str
+        Name of group of sites (for example, 'single' or 'multi').
+    bed : str
+        Output BED6 file.
+    value : str
+        Value to report in score column: 'cdna' or 'reads'.
+
+    Returns
+    -------
+    str
+        Path to BED6 file.
+
+    """
+    assert value in ('cdna', 'reads')
+    sites = load_sites(fname, name)
+    # pylint: disable=protected-access
+    with iCount.files.gz_open(bed, 'wt') as handle:
+        for chrom, pos, strand, val in zip(sites['chrom'].tolist(), sites['pos'].tolist(),
+                                           sites['strand'].tolist(), sites[value].tolist()):
+            handle.write('{}\t{}\t{}\t.\t{}\t{}\n'.format(chrom, pos, pos + 1, iCount.files._f2s(val), strand))
+    return bed
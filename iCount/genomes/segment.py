@@ -33,6 +33,9 @@ Two "versions" of segmentation are produced: transcript-wise-segmentation and ge
       genome, and should also not intersect with each other (neither the ones from different genes/transcripts).
       Intervals in genome wise segmentation are called regions and the file is also called regions.
 
+Each of the two files is accompanied by a binary index (``.icidx``, see ``iCount.files.icidx``), which is used by
+``iCount xlsites`` and ``summary_templates`` instead of parsing the file, if it matches the file.
+
 It is best to present both segmentations and their relation to annotation visualy. Example of annotation::
 
             ------------------------------------------------------------------------------------->
@@ -67,12 +70,15 @@ taken into account: CDS > UTR3 > UTR5 > ncRNA > intron > intergenic::
 import itertools
 import logging
 import math
+import multiprocessing
 import os
 import re
 import shutil
 import tempfile
 from collections import Counter, OrderedDict
 
+import numpy
+import pybedtools
 from pybedtools import BedTool, create_interval_from_list
 
 import iCount
@@ -87,6 +93,8 @@ SUMMARY_TYPE = 'summary_type.tsv'
 SUMMARY_SUBTYPE = 'summary_subtype.tsv'
 SUMMARY_GENE = 'summary_gene.tsv'
 SUMMARY_TRNA_ISOTYPE = 'summary_tRNA_isotype.tsv'
+# Number of genes sent to worker process at once by ``get_segments``:
+GENE_BATCH_SIZE = 50
 
 TYPE_HIERARCHY = [
     'ncRNA',
@@ -335,8 +343,8 @@ def sort_types_subtypes(entry):
     return [get_index(type_, type_hierarchy), get_index(biotype, list(SUBTYPE_GROUPS.keys()))]
 
 
-def summary_templates(annotation, templates_dir):
-    """Make summary templates."""
+def _gtf_templates(annotation):
+    """Compute lengths of types, subtypes and genes by parsing ``annotation``."""
     type_template, subtype_template, gene_template = {}, {}, {}
     for interval in BedTool(annotation):
         length = len(interval)
@@ -354,6 +362,58 @@ def summary_templates(annotation, templates_dir):
         current_size = gene_template.get(gene_id, ['', 0])[1]
         gene_template[gene_id] = [gene_name, current_size + length]
 
+    return type_template, subtype_template, gene_template
+
+
+def _index_templates(index):
+    """
+    Compute lengths of types, subtypes and genes from binary index (``iCount.files.icidx``).
+
+    Subtype lengths are summed in order of intervals in GTF file, so that
+    results are the same as when GTF file is parsed.
+    """
+    order = numpy.argsort(index['line'])
+    types = numpy.asarray(index['type'])[order]
+    biotypes = numpy.asarray(index['biotype'])[order]
+    genes = numpy.asarray(index['gene'])[order]
+    lengths = (numpy.asarray(index['stop']) - numpy.asarray(index['start']))[order]
+
+    type_lengths = numpy.bincount(types, weights=lengths, minlength=len(index['types']))
+    type_template = {type_: int(type_lengths[i]) for i, type_ in enumerate(index['types'])}
+
+    # Subtypes of each (type, biotype) pair; interval is split evenly between its subtypes:
+    pairs, pair_idx = numpy.unique(types.astype(numpy.int64) * len(index['biotypes']) + biotypes, return_inverse=True)
+    pair_subtypes = []
+    for pair in pairs.tolist():
+        type_ = index['types'][pair // len(index['biotypes'])]
+        pair_subtypes.append([make_subtype(type_, biotype) for biotype in
+                              index['biotypes'][pair % len(index['biotypes'])].split(',')])
+    subtype_template = {}
+    for pair, length in zip(pair_idx.ravel().tolist(), lengths.tolist()):
+        subtypes = pair_subtypes[pair]
+        for sbtyp in subtypes:
+            subtype_template[sbtyp] = subtype_template.get(sbtyp, 0) + length / len(subtypes)
+
+    gene_lengths = numpy.bincount(genes, weights=lengths, minlength=len(index['genes']))
+    gene_template = {gene_id: [gene_name, int(gene_lengths[i])]
+                     for i, (gene_id, gene_name) in enumerate(zip(index['genes'], index['gene_names']))}
+
+    return type_template, subtype_template, gene_template
+
+
+def summary_templates(annotation, templates_dir):
+    """
+    Make summary templates.
+
+    If ``annotation`` has a binary index (``iCount.files.icidx``), lengths
+    are computed from it, without parsing ``annotation``.
+    """
+    index = iCount.files.icidx.load_index(annotation)
+    if index is not None:
+        type_template, subtype_template, gene_template = _index_templates(index)
+    else:
+        type_template, subtype_template, gene_template = _gtf_templates(annotation)
+
     # Write type template
     with open(os.path.join(templates_dir, TEMPLATE_TYPE), 'wt') as outfile:
         for type_, length in sorted(type_template.items(), key=lambda x: sort_types_subtypes(x[0])):
@@ -376,8 +436,14 @@ _RE_GENE_ID = re.compile(r'gene_id "([^"]*)"')
 _RE_GENE_NAME = re.compile(r'gene_name "([^"]*)"')
 
 
-def make_regions(segmentation, out_dir=None):
-    """Make regions file (regions.gtf.gz) and summary templates."""
+def make_regions(segmentation, out_dir=None, native=False):
+    """
+    Make regions file (regions.gtf.gz), its binary index and summary templates.
+
+    Borders are intersected with segmentation with bedtools or with
+    ``iCount.files.intervals.intersect``, if ``native`` is given. In both
+    cases, bedtools is still needed to construct borders and to sort regions.
+    """
     if out_dir is None:
         out_dir = os.getcwd()
     if not os.path.isdir(out_dir):
@@ -386,17 +452,21 @@ def make_regions(segmentation, out_dir=None):
     seg_filtered = BedTool(segmentation).filter(lambda x: x[2] not in ['transcript', 'gene']).saveas()
 
     borders = construct_borders(seg_filtered)
-    # pylint: disable=unexpected-keyword-arg, too-many-function-args
-    overlaps = BedTool(borders).intersect(
-        seg_filtered, sorted=True, s=True, wa=True, wb=True, nonamecheck=True).saveas()
-    # pylint: enable=unexpected-keyword-arg, too-many-function-args
+    if native:
+        overlaps = iCount.files.intervals.intersect(borders, seg_filtered.fn, s=True, wa=True, wb=True)
+    else:
+        # pylint: disable=unexpected-keyword-arg, too-many-function-args
+        overlaps = iter(BedTool(borders).intersect(
+            seg_filtered, sorted=True, s=True, wa=True, wb=True, nonamecheck=True).saveas())
+        # pylint: enable=unexpected-keyword-arg, too-many-function-args
 
     intervals, types, biotypes, genes = [], [], [], []
     gene_sizes = get_gene_sizes(segmentation)
-    pseg = overlaps[0]  # Set initial value for "previous segment"
-    for seg in overlaps:
-        if seg.start != pseg.start or seg.stop != pseg.stop or seg.strand != pseg.strand:
-            intervals.append(make_uniq_region(pseg, types, biotypes, genes))
+    pseg = next(overlaps)  # Set initial value for "previous segment"
+    for seg in itertools.chain([pseg], overlaps):
+        # Border (chrom, start, stop, strand) is in the first six fields of each overlap:
+        if seg[1] != pseg[1] or seg[2] != pseg[2] or seg[5] != pseg[5]:
+            intervals.append(make_uniq_region(create_interval_from_list(list(pseg[:6])), types, biotypes, genes))
             types, biotypes, genes = [], [], []
 
         attrs_str = seg[-1]
@@ -413,12 +483,13 @@ def make_regions(segmentation, out_dir=None):
 
         pseg = seg
 
-    intervals.append(make_uniq_region(pseg, types, biotypes, genes))
+    intervals.append(make_uniq_region(create_interval_from_list(list(pseg[:6])), types, biotypes, genes))
     nonmerged = BedTool(interval for interval in intervals).saveas()
 
     # Merge intervals where possible
     merged = os.path.join(out_dir, REGIONS_FILE)
     merge_regions(nonmerged, merged)
+    iCount.files.icidx.write_index(merged)
 
     # Finally, make templates
     summary_templates(merged, out_dir)
@@ -1060,7 +1131,102 @@ def _load_trna_bed(bed_path, chromosomes):
     return data
 
 
-def get_segments(annotation, segmentation, fai, report_progress=False, trna_annotation=None):
+def _process_gene(gene_content):
+    """
+    Process each group of intervals belonging to gene.
+
+    Process each transcript_group in gene_content, add 'biotype'
+    attribute to all intervals and return their fields (transcript
+    groups first, gene last).
+
+    If GTF does not contain transcripts which completely cover the gene,
+    then add in "mortar" to fill.
+    """
+    assert 'gene' in gene_content
+
+    for id_, transcript_group in gene_content.items():
+        if id_ == 'gene':
+            continue
+        gene_content[id_] = _process_transcript_group(transcript_group)
+
+    # Add 'intragenic_unannotated' to deal with GTFs where transcripts do not span the whole gene -------
+    gene_span = BedTool([gene_content['gene']])
+
+    transcript_intervals = [
+        i for id_, transcript_group in gene_content.items()
+        if id_ != 'gene'
+        for i in transcript_group if i[2] == 'transcript'
+    ]
+
+    transcript_bricks = BedTool(transcript_intervals).merge()
+    transcript_gaps = gene_span.subtract(transcript_bricks, s = True)
+
+    # GTF format for downstream
+    gene = gene_content['gene']
+    gene_id = gene.attrs.get('gene_id', '.')
+    gene_name = gene.attrs.get('gene_name', '.')
+    strand = gene.strand
+    chrom = gene.chrom
+
+    attrs = f'gene_id "{gene_id}"; gene_name "{gene_name}"; biotype "intragenic_unannotated";'
+
+    for gap in transcript_gaps:
+        transcript_mortar = create_interval_from_list([
+            chrom,
+            '.',
+            'intragenic_unannotated',
+            str(gap.start+1),
+            str(gap.stop),
+            '.',
+            strand,
+            '.',
+            attrs,
+        ])
+        # Add to dictionary
+        gene_content[id_].append(transcript_mortar)
+
+    # Add biotype attribute to all intervals:
+    gene_content = _add_biotype_attribute(gene_content)
+
+    data = []
+    for id_, transcript_group in gene_content.items():
+        if id_ == 'gene':
+            continue
+        data.extend(interval.fields for interval in transcript_group)
+    data.append(gene_content['gene'].fields)
+    return data
+
+
+def _process_gene_batch(batch):
+    """
+    Process a batch of genes in worker process, return fields of intervals of each gene.
+
+    Temporary files, made by pybedtools while processing genes, are removed
+    after the batch, since worker processes do not clean them up on exit.
+    """
+    temp_files = len(pybedtools.filenames.TEMPFILES)
+    try:
+        return [_process_gene(gene_content) for gene_content in batch]
+    finally:
+        for fname in pybedtools.filenames.TEMPFILES[temp_files:]:
+            if os.path.exists(fname):
+                os.remove(fname)
+        del pybedtools.filenames.TEMPFILES[temp_files:]
+
+
+def _batches(items, batch_size):
+    """Yield lists of (at most) ``batch_size`` consecutive elements of ``items``."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_segments(annotation, segmentation, fai, report_progress=False, trna_annotation=None, processes=1):
     """
     Create GTF file with transcript level segmentation.
 
@@ -1093,6 +1259,11 @@ def get_segments(annotation, segmentation, fai, report_progress=False, trna_anno
     trna_annotation : str
         Optional path to a BED file with tRNA annotations (e.g. from GtRNAdb /
         tRNAscan-SE). Entries are added as ncRNA with biotype=tRNA.
+    processes : int
+        Number of processes used to segment genes. Genes are sent to
+        processes in batches of ``GENE_BATCH_SIZE``, and results are
+        collected in the same order as genes in annotation, so
+        segmentation does not depend on number of processes.
 
     Returns
     -------
@@ -1104,7 +1275,7 @@ def get_segments(annotation, segmentation, fai, report_progress=False, trna_anno
     metrics = iCount.Metrics()
     metrics.genes = 0
 
-    # Container for storing intermediate data
+    # Container for storing intermediate data (fields of intervals)
     data = []
 
     LOGGER.debug('Opening genome file: %s', fai)
@@ -1112,80 +1283,27 @@ def get_segments(annotation, segmentation, fai, report_progress=False, trna_anno
     with open(fai) as gfile:
         chromosomes = [line.strip().split()[0] for line in gfile]
 
-    def process_gene(gene_content):
-        """
-        Process each group of intervals belonging to gene.
-
-        Process each transcript_group in gene_content, add 'biotype'
-        attribute to all intervals and include them in `data`.
-
-        If GTF does not contain transcripts which completely cover the gene,
-        then add in "mortar" to fill.
-        """
-        assert 'gene' in gene_content
-
-        for id_, transcript_group in gene_content.items():
-            if id_ == 'gene':
-                continue
-            gene_content[id_] = _process_transcript_group(transcript_group)
-
-        # Add 'intragenic_unannotated' to deal with GTFs where transcripts do not span the whole gene -------
-        gene_span = BedTool([gene_content['gene']])
-
-        transcript_intervals = [
-            i for id_, transcript_group in gene_content.items()
-            if id_ != 'gene'
-            for i in transcript_group if i[2] == 'transcript'
-        ]
-
-        transcript_bricks = BedTool(transcript_intervals).merge()
-        transcript_gaps = gene_span.subtract(transcript_bricks, s = True)
-
-        # GTF format for downstream
-        gene = gene_content['gene']
-        gene_id = gene.attrs.get('gene_id', '.')
-        gene_name = gene.attrs.get('gene_name', '.')
-        strand = gene.strand
-        chrom = gene.chrom
-
-        attrs = f'gene_id "{gene_id}"; gene_name "{gene_name}"; biotype "intragenic_unannotated";'
-
-        for gap in transcript_gaps:
-            transcript_mortar = create_interval_from_list([
-                chrom,
-                '.',
-                'intragenic_unannotated',
-                str(gap.start+1),
-                str(gap.stop),
-                '.',
-                strand,
-                '.',
-                attrs,
-            ])
-            # Add to dictionary
-            gene_content[id_].append(transcript_mortar)
-
-        # Add biotype attribute to all intervals:
-        gene_content = _add_biotype_attribute(gene_content)
-
-        for id_, transcript_group in gene_content.items():
-            if id_ == 'gene':
-                continue
-            data.extend(transcript_group)
-        data.append(gene_content['gene'])
-
     LOGGER.debug('Processing genome annotation from: %s', annotation)
-    for gene_content in _get_gene_content(annotation, chromosomes, report_progress):
-        process_gene(gene_content)
-        LOGGER.debug('Just processed gene: %s', gene_content['gene'].attrs['gene_id'])
-        metrics.genes += 1
+    gene_contents = _get_gene_content(annotation, chromosomes, report_progress)
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            for genes_data in pool.imap(_process_gene_batch, _batches(gene_contents, GENE_BATCH_SIZE)):
+                for gene_data in genes_data:
+                    data.extend(gene_data)
+                LOGGER.debug('Just processed %d genes.', len(genes_data))
+                metrics.genes += len(genes_data)
+    else:
+        for gene_content in gene_contents:
+            data.extend(_process_gene(gene_content))
+            LOGGER.debug('Just processed gene: %s', gene_content['gene'].attrs['gene_id'])
+            metrics.genes += 1
 
     if trna_annotation:
         LOGGER.info('Loading tRNA annotation from BED: %s', trna_annotation)
-        data.extend(_load_trna_bed(trna_annotation, chromosomes))
+        data.extend(i.fields for i in _load_trna_bed(trna_annotation, chromosomes))
 
     # Produce GTF/GFF file from data:
-    gtf = BedTool(i.fields for i in data).saveas()
+    gtf = BedTool(data).saveas()
 
     LOGGER.info('Calculating intergenic intervals...')
     intergenic_pos = _complement(gtf.fn, fai, '+')
@@ -1199,6 +1317,7 @@ def get_segments(annotation, segmentation, fai, report_progress=False, trna_anno
 
     file3 = BedTool(file2.name).sort().saveas(segmentation)
     LOGGER.info('Segmentation stored in %s', file3.fn)
+    iCount.files.icidx.write_index(segmentation)
 
     LOGGER.info('Making also gene level segmentation...')
     make_regions(segmentation, out_dir=os.path.dirname(os.path.abspath(segmentation)))
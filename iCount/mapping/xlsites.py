@@ -73,10 +73,23 @@ end position of read. By default, score is of course assigned to cross-link
 location. But for diagnostic purpuses, scores can also be assigned to middle or
 end coordinate of the read.
 """
+import os
 import re
+import time
+import shutil
+import sys
+import array
 import logging
+import functools
+import collections
+import multiprocessing
 
+from threading import Thread
+from queue import Queue
+
+import numpy
 import pybedtools
+import pysam
 from pysam import AlignmentFile  # pylint: disable=no-name-in-module
 
 import iCount
@@ -84,64 +97,168 @@ from iCount.files import _f2s
 
 
 LOGGER = logging.getLogger(__name__)
+
 VALID_NUCLEOTIDES = set('ATCGN')
 RANDOM_BARCODE_REGEX = r'.*:rbc:([ATCGN]+).*'
+_RANDOM_BARCODE_RE = re.compile(RANDOM_BARCODE_REGEX)
+_VALID_NUCLEOTIDES_CHARS = ''.join(sorted(VALID_NUCLEOTIDES))
+NUCLEOTIDE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+# Translation of nucleotides to base-4 digits (as in NUCLEOTIDE_CODES):
+_NUCLEOTIDE_DIGITS = str.maketrans({nucleotide: str(code) for nucleotide, code in NUCLEOTIDE_CODES.items()})
+_NUCLEOTIDES_CHARS = ''.join(sorted(NUCLEOTIDE_CODES))
 
+REGION_REGEX = re.compile(r'^(.+):([0-9,]+)-([0-9,]+)$')
 
-def _iter_bed_dict(bed, val_index=None):
-    """Iterate through dict object."""
-    if val_index is not None:
-        for (chrome, strand), by_pos in bed.items():
-            for pos, val in by_pos.items():
-                val = val[val_index]
-                yield pybedtools.create_interval_from_list(
-                    [chrome, pos, pos + 1, '.', _f2s(val), strand]
-                )
-    else:
-        for (chrome, strand), by_pos in bed.items():
-            for pos, val in by_pos.items():
-                yield pybedtools.create_interval_from_list(
-                    [chrome, pos, pos + 1, '.', _f2s(val), strand]
-                )
+# Skipped reads are passed to background writer in batches of this size,
+# through a queue of limited size:
+SKIPPED_BATCH_SIZE = 1000
+SKIPPED_QUEUE_SIZE = 100
 
+# Pending reads are passed on for quantification each time the start of
+# reads advances for this many nucleotides:
+FLUSH_WINDOW = 10000
 
-def _save_dict(bed, out_fname, val_index=None):
-    """Save data from dict to BED file."""
-    sites = pybedtools.BedTool(
-        _iter_bed_dict(bed, val_index=val_index)
-    ).saveas()
-    sites1 = sites.sort().saveas(out_fname)
-    return sites1
+# Segment borders of the most recently loaded segmentation:
+_BORDERS_CACHE = {}
 
+SAMPLE_SHEET_COLUMNS = ['bam', 'sites_single', 'sites_multi', 'skipped']
 
-def _get_random_barcode(query_name, metrics):
-    """Extract random barcode from ``query_name``."""
-    match = re.match(RANDOM_BARCODE_REGEX, query_name)
-    if match:
-        barcode = match.group(1)
-    elif ':' in query_name:
-        barcode = query_name.rsplit(':', 1)[1]
-        if set(barcode) - VALID_NUCLEOTIDES:
-            # invalid barcode characters
-            barcode = ''
-            metrics.invalidrandomer_recs += 1
-    else:
-        barcode = ''
-        metrics.norandomer_recs += 1
 
-    return barcode
+class _SiteCounts:
+    """
+    Counts of cross-links on one chromosome, stored in compact arrays.
 
+    For each strand, positions and their cDNA and read counts are appended to
+    three parallel, growable ``array.array`` buffers. Same position can be
+    added multiple times: counts are summed when sites are retrieved (sort and
+    reduce with NumPy). This takes a fraction of memory needed for a dict of
+    lists per position.
+    """
 
-def _update(cur_vals, to_add):
+    def __init__(self):
+        """Initialize empty buffers."""
+        self.buffers = {}
+
+    def __len__(self):
+        """Return number of buffered entries."""
+        return sum(len(positions) for positions, _, _ in self.buffers.values())
+
+    @staticmethod
+    def _empty_buffers():
+        """Return empty buffers for positions, cDNA and read counts."""
+        return array.array('q'), array.array('d'), array.array('q')
+
+    def add(self, strand, counts):
+        """
+        Add ``counts`` on ``strand``.
+
+        Parameters
+        ----------
+        strand : str
+            Strand of positions.
+        counts : dict
+            Number of cDNA and reads for each position, as returned by ``_collapse``.
+
+        Returns
+        -------
+        None
+            None.
+
+        """
+        if strand not in self.buffers:
+            self.buffers[strand] = self._empty_buffers()
+        positions, cdna, reads = self.buffers[strand]
+        for pos, (pos_cdna, pos_reads) in counts.items():
+            positions.append(pos)
+            cdna.append(pos_cdna)
+            reads.append(pos_reads)
+
+    def reduce(self, strand):
+        """
+        Return sorted positions on ``strand`` with summed cDNA and read counts.
+
+        Parameters
+        ----------
+        strand : str
+            Strand of positions.
+
+        Returns
+        -------
+        tuple
+            Arrays of unique positions, cDNA and read counts.
+
+        """
+        positions, cdna, reads = (numpy.frombuffer(buff, dtype=buff.typecode)
+                                  for buff in self.buffers.get(strand, self._empty_buffers()))
+        if not positions.size:
+            return positions, cdna, reads
+
+        order = numpy.argsort(positions, kind='stable')
+        positions = positions[order]
+        firsts = numpy.flatnonzero(numpy.r_[True, positions[1:] != positions[:-1]])
+        return (positions[firsts], numpy.add.reduceat(cdna[order], firsts),
+                numpy.add.reduceat(reads[order], firsts))
+
+    def columns(self):
+        """
+        Return positions, strands, cDNA and read counts of all sites.
+
+        Sites are sorted by position and strand. Strands are given as 0 ('+')
+        and 1 ('-').
+
+        Returns
+        -------
+        tuple
+            Arrays of positions, strands, cDNA and read counts.
+
+        """
+        columns = [], [], [], []
+        for strand_code, strand in enumerate('+-'):
+            positions, cdna, reads = self.reduce(strand)
+            for column, values in zip(columns, [positions, numpy.full(positions.size, strand_code), cdna, reads]):
+                column.append(values)
+
+        positions, strands, cdna, reads = (numpy.concatenate(column) for column in columns)
+        order = numpy.lexsort((strands, positions))
+        return positions[order], strands[order], cdna[order], reads[order]
+
+    def sites(self, val_index):
+        """
+        Yield position, strand and value of all sites, sorted by position and strand.
+
+        Parameters
+        ----------
+        val_index : int
+            Index of value (cDNA or reads) to report.
+
+        Yields
+        ------
+        tuple
+            Position, strand and value.
+
+        """
+        positions, strands, cdna, reads = self.columns()
+        values = (cdna, reads)[val_index]
+        for pos, strand_code, val in zip(positions.tolist(), strands.tolist(), values.tolist()):
+            yield pos, '+-'[strand_code], val
+
+
+def _write_chrom_sites(handle, chrom, counts, val_index):
     """
-    Add the values from ``to_add`` to appropriate place in ``cur_vals``.
+    Write cross-linked sites of chromosome ``chrom`` to ``handle`` in BED6 format.
 
-    Note: cur_vals is updated in place!
+    Sites are written sorted by position (and strand).
 
     Parameters
     ----------
-    to_add : dict
-        Dict with update data.
+    handle : file
+        Opened file to write to.
+    chrom : str
+        Chromosome name.
+    counts : _SiteCounts
+        Counts on chromosome.
+    val_index : int
+        Index of value (cDNA or reads) to report in score column.
 
     Returns
     -------
@@ -149,9 +266,74 @@ def _update(cur_vals, to_add):
         None.
 
     """
-    for pos, vals_to_add in to_add.items():
-        prev_vals = cur_vals.get(pos, [0] * len(vals_to_add))
-        cur_vals[pos] = [p + n for p, n in zip(prev_vals, vals_to_add)]
+    for pos, strand, val in counts.sites(val_index):
+        handle.write('{}\t{}\t{}\t.\t{}\t{}\n'.format(chrom, pos, pos + 1, _f2s(val), strand))
+
+
+class _SitesWriter:
+    """
+    Write BED6 file with cross-linked sites, one chromosome at a time.
+
+    Sites of each chromosome are sorted and written to a temporary file as
+    soon as the chromosome is processed, so counts of only one chromosome need
+    to be kept in memory. When writer is closed, temporary files are joined
+    in lexicographical order of chromosome names. This is the same order as
+    produced by ``bedtools sort``.
+    """
+
+    def __init__(self, fname, val_index):
+        """Prepare writer for output file ``fname``."""
+        self.fname = fname
+        self.val_index = val_index
+        self.parts = {}
+
+    def write(self, chrom, counts):
+        """Write sites on chromosome ``chrom``."""
+        assert chrom not in self.parts
+        part = iCount.files.get_temp_file_name(extension='bed')
+        with open(part, 'wt') as handle:
+            _write_chrom_sites(handle, chrom, counts, self.val_index)
+        self.parts[chrom] = part
+
+    def close(self):
+        """Join the sites of all chromosomes into output file."""
+        with iCount.files.gz_open(self.fname, 'wt') as out:
+            for chrom in sorted(self.parts):
+                with open(self.parts[chrom], 'rt') as handle:
+                    shutil.copyfileobj(handle, out)
+                os.remove(self.parts[chrom])
+        self.parts = {}
+
+
+def _get_random_barcode(query_name, metrics):
+    """
+    Extract random barcode from ``query_name``.
+
+    Fast path handles names that end with ``:rbc:<randomer>`` (as written by
+    ``iCount.demultiplex.add_randomer_to_header``) without regular
+    expressions. Barcodes are interned, so that all reads with the same
+    barcode share a single string object.
+    """
+    _, rbc_key, barcode = query_name.rpartition(':rbc:')
+    if rbc_key:
+        if barcode and not barcode.strip(_VALID_NUCLEOTIDES_CHARS):
+            return sys.intern(barcode)
+
+        match = _RANDOM_BARCODE_RE.match(query_name)
+        if match:
+            return sys.intern(match.group(1))
+
+    if ':' in query_name:
+        barcode = query_name.rsplit(':', 1)[1]
+        if barcode.strip(_VALID_NUCLEOTIDES_CHARS):
+            # invalid barcode characters
+            barcode = ''
+            metrics.invalidrandomer_recs += 1
+    else:
+        barcode = ''
+        metrics.norandomer_recs += 1
+
+    return sys.intern(barcode)
 
 
 def _collapse(xlink_pos, by_bc, group_by, multimax=1):
@@ -224,9 +406,37 @@ def _collapse(xlink_pos, by_bc, group_by, multimax=1):
 
     """
     group_by_index = ['start', 'middle', 'end'].index(group_by)
+    return _collapse_single_multi(xlink_pos, by_bc, group_by_index, multimax)[1]
+
 
-    # Container for cDNA and read counts:
-    counts = {}
+def _collapse_single_multi(xlink_pos, by_bc, group_by_index, multimax):
+    """
+    Report number of cDNAs and reads in cross-link site, for single and multi-mapped reads.
+
+    This gives the same result as calling ``_collapse`` twice, with
+    ``multimax=1`` (single mapped reads) and with ``multimax=multimax``, but
+    reads are grouped by barcode and second-start only once.
+
+    Parameters
+    ----------
+    xlink_pos : int
+        Cross link position (genomic coordinate).
+    by_bc : dict
+        Dict with hits for each barcode.
+    group_by_index : int
+        Report by start (0), middle (1) or end (2) position.
+    multimax : int
+        Ignore reads, mapped to more than ``multimax`` places.
+
+    Returns
+    -------
+    tuple
+        Number of cDNA and reads for each position, for single and for
+        multi-mapped reads.
+
+    """
+    single_cdna, single_reads, multi_cdna, multi_reads = 0, 0, 0, 0
+    single, multi = {}, {}
 
     for hits in by_bc.values():
 
@@ -238,43 +448,146 @@ def _collapse(xlink_pos, by_bc, group_by, multimax=1):
         for ss_group in ss_groups.values():
 
             # Sum of all read lengths per ss_group:
-            sum_len_per_barcode = sum([i[2] for i in ss_group if i[3] <= multimax])
+            sum_len_single, sum_len_multi = 0, 0
+            for read in ss_group:
+                if read[3] <= 1:
+                    sum_len_single += read[2]
+                if read[3] <= multimax:
+                    sum_len_multi += read[2]
 
             for middle_pos, end_pos, read_len, num_mapped, _ in ss_group:
-                if num_mapped > multimax:
+                if group_by_index == 0:
+                    # All reads are reported on cross-link position:
+                    if num_mapped <= multimax:
+                        multi_cdna += read_len / (num_mapped * sum_len_multi)
+                        multi_reads += 1
+                    if num_mapped <= 1:
+                        single_cdna += read_len / (num_mapped * sum_len_single)
+                        single_reads += 1
                     continue
-                grp_pos = (xlink_pos, middle_pos, end_pos)[group_by_index]
-                weight = read_len / (num_mapped * sum_len_per_barcode)
 
-                current_values = counts.get(grp_pos, (0, 0))
-                upadated_values = (current_values[0] + weight, current_values[1] + 1)
-                counts[grp_pos] = upadated_values
+                grp_pos = middle_pos if group_by_index == 1 else end_pos
+                if num_mapped <= multimax:
+                    cdna, reads = multi.get(grp_pos, (0, 0))
+                    multi[grp_pos] = (cdna + read_len / (num_mapped * sum_len_multi), reads + 1)
+                if num_mapped <= 1:
+                    cdna, reads = single.get(grp_pos, (0, 0))
+                    single[grp_pos] = (cdna + read_len / (num_mapped * sum_len_single), reads + 1)
+
+    if single_reads:
+        single[xlink_pos] = (single_cdna, single_reads)
+    if multi_reads:
+        multi[xlink_pos] = (multi_cdna, multi_reads)
+    return single, multi
+
+
+def _load_segmentation(seg_file):
+    """
+    Read segment borders of all chromosomes from segmentation in a single pass.
+
+    Second-start of a read on "+" strand is compared to segment starts and
+    second-start on "-" strand to segment stops. Borders of all segments
+    (except segments of type gene) are therefore collected into two hash sets
+    for each chromosome, one for each read strand::
+
+        borders = {
+            (chrom1, '+'): frozenset([start1, start2, ...]),
+            (chrom1, '-'): frozenset([stop1, stop2, ...]),
+            (chrom2, '+'): ...
+        }
+
+    Chromosomes that have only gene segments still get (empty) entries, so
+    that reads on them are compared to segmentation.
 
-    return counts
+    If segmentation has a binary index (``iCount.files.icidx``), borders are
+    read from it instead.
 
+    Parameters
+    ----------
+    seg_file : str
+        Path to GTF file, produced by ``iCount segment``.
+
+    Returns
+    -------
+    dict
+        Segment borders for each (chrom, strand).
+
+    """
+    index = iCount.files.icidx.load_index(seg_file)
+    if index is not None:
+        return _index_borders(index)
+
+    borders = {}
+    for segment in pybedtools.BedTool(seg_file):
+        starts = borders.setdefault((segment.chrom, '+'), set())
+        stops = borders.setdefault((segment.chrom, '-'), set())
+        if segment[2] == 'gene':
+            continue
+        starts.add(segment.start)
+        stops.add(segment.stop)
+
+    return {key: frozenset(values) for key, values in borders.items()}
+
+
+def _index_borders(index):
+    """Return segment borders (as in ``_load_segmentation``) from binary index of segmentation."""
+    gene_type = index['types'].index('gene') if 'gene' in index['types'] else -1
+    starts, stops = {}, {}
+    for (chrom, _), group in index['groups'].items():
+        not_gene = numpy.asarray(group['type']) != gene_type
+        starts.setdefault(chrom, []).append(numpy.asarray(group['start'])[not_gene])
+        stops.setdefault(chrom, []).append(numpy.asarray(group['stop'])[not_gene])
+
+    borders = {}
+    for chrom in starts:
+        borders[(chrom, '+')] = frozenset(numpy.concatenate(starts[chrom]).tolist())
+        borders[(chrom, '-')] = frozenset(numpy.concatenate(stops[chrom]).tolist())
+    return borders
+
+
+def _get_borders(seg_file):
+    """
+    Return segment borders from ``seg_file``, loading it only if needed.
+
+    Borders of the most recently used segmentation are kept in module level
+    cache (keyed by file path and modification time). Processes forked after
+    segmentation is loaded (as in ``xlsites_batch``) share it copy-on-write
+    instead of parsing it again.
+    """
+    key = (os.path.abspath(seg_file), os.path.getmtime(seg_file))
+    if key not in _BORDERS_CACHE:
+        _BORDERS_CACHE.clear()
+        _BORDERS_CACHE[key] = _load_segmentation(seg_file)
+    return _BORDERS_CACHE[key]
+
+
+def _chrom_borders(borders, chrom):
+    """Return the part of ``borders`` that belongs to chromosome ``chrom``."""
+    return {key: borders[key] for key in [(chrom, '+'), (chrom, '-')] if key in borders}
 
-def _intersects_with_annotaton(second_start, segmentation, chrom, strand):
+
+def _intersects_with_annotaton(second_start, borders, chrom, strand):
     """
     Test if second_start corresopnds to any entry in segmentation.
 
+    Parameters
+    ----------
+    second_start : int
+        Second start of the read.
+    borders : dict
+        Segment borders, as returned by ``_load_segmentation``.
+    chrom : str
+        Chromosome name.
+    strand : str
+        Strand of the read.
+
     Returns
     -------
         bool
     Does the read's second_start corresopnd to any known segment in segmentation
 
     """
-    for gene_content in segmentation.values():
-        for transcript_id, transcript_content in gene_content.items():
-            if transcript_id == 'gene_segment':
-                continue
-            for segment in transcript_content:
-                if strand == '+':
-                    if second_start == segment.start:
-                        return True
-                else:
-                    if second_start == segment.stop:
-                        return True
-    return False
+    return second_start in borders.get((chrom, strand), ())
 
 
 def _second_start(read, poss, strand, chrom, segmentation, holesize_th):
@@ -282,7 +595,9 @@ def _second_start(read, poss, strand, chrom, segmentation, holesize_th):
     Return the coordinate of second start.
 
     If read is not split or we wish algorithm
-    to think of read as linear, second_start equals to 0.
+    to think of read as linear, second_start equals to 0. Parameter
+    ``segmentation`` is the index of segment borders, as returned by
+    ``_load_segmentation``.
     """
     holes = [j - i - 1 for i, j in zip(poss, poss[1:])]
     # Get the size of the biggest hole:
@@ -314,8 +629,68 @@ def _second_start(read, poss, strand, chrom, segmentation, holesize_th):
     return second_start, is_strange
 
 
-def _get_read_data(read, metrics, mapq_th, segmentation=None, gap_th=4):
-    """Extract neccessary data from read."""
+def _second_start_blocks(blocks, strand, chrom, segmentation, holesize_th):
+    """
+    Return the coordinate of second start, computed from aligned blocks of read.
+
+    This gives the same result as ``_second_start``, but hole sizes are
+    computed only between aligned blocks (as given by
+    ``pysam.AlignedSegment.get_blocks``) instead of between each pair of
+    aligned positions. Read should have at least two aligned positions.
+    """
+    # Holes between aligned positions inside of blocks are 0, so only the first
+    # hole is needed if all holes between blocks are also 0.
+    biggest_hole_size, biggest_hole_index = 0, 0
+    for i in range(1, len(blocks)):
+        hole = blocks[i][0] - blocks[i - 1][1]
+        if hole > biggest_hole_size:
+            biggest_hole_size, biggest_hole_index = hole, i
+
+    second_start = 0
+    is_strange = False
+    if not segmentation:
+        # Effectively this means, that read is considered as it has no holes.
+        if biggest_hole_size > holesize_th:
+            # Still, read is not treated as on with distinct second_start.
+            # However, it is reported as starnge:
+            is_strange = True
+    else:
+        if biggest_hole_size == 0:
+            # Second (on "+") or first (on "-") aligned position of the read:
+            second_start = blocks[0][0] + 1 if strand == '+' else blocks[0][0]
+        elif strand == '+':
+            # Right border of hole on "+" and left border on "-" strand:
+            second_start = blocks[biggest_hole_index][0]
+        else:
+            second_start = blocks[biggest_hole_index - 1][1] - 1
+
+        if biggest_hole_size != 0 and \
+                not _intersects_with_annotaton(second_start, segmentation, chrom, strand):
+            is_strange = True
+
+    return second_start, is_strange
+
+
+def _nth_aligned_position(blocks, idx):
+    """Return reference position of ``idx``-th aligned base in ``blocks``."""
+    for start, stop in blocks:
+        if idx < stop - start:
+            return start + idx
+        idx -= stop - start
+    raise IndexError('list index out of range')
+
+
+def _get_read_data(read, metrics, mapq_th, segmentation=None, gap_th=4, blocks=None):
+    """
+    Extract neccessary data from read.
+
+    Positions are computed from aligned blocks of read (by walking its CIGAR),
+    which avoids building a list of all aligned positions for each read. In
+    the rare cases where this is not possible (no or one aligned position,
+    empty blocks, middle position outside of aligned part) a list of aligned
+    positions is used, as before. Blocks can be given, if they are already
+    known (see ``_fetch``).
+    """
     # NH (number of reported alignments) tag is required:
     if not read.has_tag('NH'):
         raise ValueError('"NH" tag not set for record: {}'.format(read.query_name))
@@ -323,37 +698,350 @@ def _get_read_data(read, metrics, mapq_th, segmentation=None, gap_th=4):
 
     # Extract randomer sequence (barcode) from querry name (= read name)
     barcode = _get_random_barcode(read.query_name, metrics)
-    metrics.bc_cn[barcode] = metrics.bc_cn.get(barcode, 0) + 1
-
-    # position of cross-link is one nucleotide before start of read
-    poss = read.get_reference_positions()
-    if read.is_reverse:
-        strand = '-'
-        xlink_pos = poss[-1] + 1
-        end_pos = poss[0]
-    else:
-        strand = '+'
-        xlink_pos = poss[0] - 1
-        xlink_pos = 1 if xlink_pos < 1 else xlink_pos  # Case of neg. pos on circular MT
-        end_pos = poss[-1]
+    metrics.bc_cn[barcode] += 1
 
+    strand = '-' if read.is_reverse else '+'
     chrom = read.reference_name
-    second_start, is_strange = _second_start(read, poss, strand, chrom, segmentation, gap_th)
-    if is_strange:
-        metrics.strange_recs += 1
-
     # Position of middle nucleotide. Because we can have spliced reads, middle position is
     # not necessarily the middle of region the read maps to. Take one nucleotide upstream
     # of center in case length is even, happens by default on + strand
     idx = read.query_length // 2 - 1 if (strand == '-' and read.query_length % 2 == 0) \
         else read.query_length // 2
-    middle_pos = poss[idx]
+
+    if blocks is None:
+        blocks = read.get_blocks()
+    num_aligned = sum(stop - start for start, stop in blocks)
+    if 0 <= idx < num_aligned and (num_aligned > 1 or not segmentation) and \
+            all(start < stop for start, stop in blocks):
+        first_pos, last_pos = blocks[0][0], blocks[-1][1] - 1
+        second_start, is_strange = _second_start_blocks(blocks, strand, chrom, segmentation, gap_th)
+        middle_pos = _nth_aligned_position(blocks, idx)
+    else:
+        poss = read.get_reference_positions()
+        first_pos, last_pos = poss[0], poss[-1]
+        second_start, is_strange = _second_start(read, poss, strand, chrom, segmentation, gap_th)
+        middle_pos = poss[idx]
+
+    # position of cross-link is one nucleotide before start of read
+    if strand == '-':
+        xlink_pos = last_pos + 1
+        end_pos = first_pos
+    else:
+        xlink_pos = first_pos - 1
+        xlink_pos = 1 if xlink_pos < 1 else xlink_pos  # Case of neg. pos on circular MT
+        end_pos = last_pos
+
+    if is_strange:
+        metrics.strange_recs += 1
 
     return (xlink_pos, barcode, is_strange, strand, middle_pos, end_pos, read.query_length,
             num_mapped, second_start)
 
 
-def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None, gap_th=1000000):
+def _parse_regions(regions, chrom_lengths):
+    """
+    Parse ``regions`` into sorted, non-overlapping intervals on each chromosome.
+
+    Each item in ``regions`` is either:
+
+        * chromosome name (whole chromosome),
+        * region in form ``chrom:start-end`` (1-based, inclusive, as in
+          ``samtools view``) or
+        * BED file with target intervals.
+
+    Parameters
+    ----------
+    regions : list_str
+        List of regions.
+    chrom_lengths : dict
+        Length of each chromosome in BAM file.
+
+    Returns
+    -------
+    dict
+        Chromosome -> list of (start, end) intervals (0-based, end excluded).
+
+    """
+    intervals = {}
+    for region in regions:
+        if region in chrom_lengths:
+            intervals.setdefault(region, []).append((0, chrom_lengths[region]))
+        elif os.path.isfile(region):
+            for interval in pybedtools.BedTool(region):
+                if interval.chrom not in chrom_lengths:
+                    LOGGER.warning('Chromosome "%s" from %s is not in BAM file.', interval.chrom, region)
+                    continue
+                intervals.setdefault(interval.chrom, []).append((interval.start, interval.stop))
+        else:
+            match = REGION_REGEX.match(region)
+            if not match:
+                raise ValueError('Invalid region: "{}"'.format(region))
+            chrom, start, end = match.group(1), match.group(2), match.group(3)
+            if chrom not in chrom_lengths:
+                raise ValueError('Chromosome "{}" from region "{}" is not in BAM file.'.format(chrom, region))
+            intervals.setdefault(chrom, []).append(
+                (int(start.replace(',', '')) - 1, int(end.replace(',', ''))))
+
+    merged = {}
+    for chrom, chrom_intervals in intervals.items():
+        for start, end in sorted(chrom_intervals):
+            start, end = max(start, 0), min(end, chrom_lengths[chrom])
+            if start >= end:
+                continue
+            chrom_merged = merged.setdefault(chrom, [])
+            if chrom_merged and start <= chrom_merged[-1][1]:
+                chrom_merged[-1] = (chrom_merged[-1][0], max(end, chrom_merged[-1][1]))
+            else:
+                chrom_merged.append((start, end))
+    return merged
+
+
+def _shard_regions(regions, chroms, chrom_lengths, mapped, shard):
+    """
+    Return part ``shard`` of ``regions``.
+
+    Regions are split into ``n`` parts with approximately equal number of
+    mapped reads. Reads are assumed to be uniformly distributed along each
+    chromosome, with ``mapped`` reads on it (as reported in BAM index). Split is
+    deterministic and parts do not overlap, so all ``n`` parts together
+    cover exactly the given regions.
+
+    Parameters
+    ----------
+    regions : dict
+        Chromosome -> list of (start, end) intervals.
+    chroms : list
+        Chromosomes in order of BAM file references.
+    chrom_lengths : dict
+        Length of each chromosome.
+    mapped : dict
+        Number of mapped reads on each chromosome.
+    shard : str
+        Part to return, given as "k/n" (1 <= k <= n).
+
+    Returns
+    -------
+    dict
+        Chromosome -> list of (start, end) intervals in part ``shard``.
+
+    """
+    match = re.match(r'^([0-9]+)/([0-9]+)$', shard)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError('Invalid shard: "{}". Use "k/n", where 1 <= k <= n.'.format(shard))
+    k, n = int(match.group(1)), int(match.group(2))
+
+    # If there are no mapped reads, split by length:
+    use_length = sum(mapped.get(chrom, 0) for chrom in regions) == 0
+    flat = []
+    total = 0
+    for chrom in chroms:
+        density = 1 if use_length else mapped.get(chrom, 0) / chrom_lengths[chrom]
+        for start, end in regions.get(chrom, []):
+            flat.append((chrom, start, end, total, density))
+            total += density * (end - start)
+
+    def cut(target):
+        """Return (interval index, position) where cumulative weight reaches ``target``."""
+        for i, (_, start, end, cumulative, density) in enumerate(flat):
+            if target < cumulative + density * (end - start):
+                return i, start + int(round((target - cumulative) / density))
+        return len(flat), 0
+
+    (first, first_pos), (last, last_pos) = cut(total * (k - 1) / n), cut(total * k / n)
+    if k == n:
+        last, last_pos = len(flat), 0
+
+    part = {}
+    for i in range(first, min(last, len(flat) - 1) + 1):
+        chrom, start, end, _, _ = flat[i]
+        start = first_pos if i == first else start
+        end = last_pos if i == last else end
+        if start < end:
+            part.setdefault(chrom, []).append((start, end))
+    return part
+
+
+def _get_regions(bam, regions=None, shard=None):
+    """
+    Return intervals on each chromosome to quantify, given ``regions`` and ``shard``.
+
+    Returns None if all reads in BAM file should be quantified.
+    """
+    if not regions and not shard:
+        return None
+
+    with AlignmentFile(bam, 'rb') as bamfile:
+        chroms = list(bamfile.references)
+        chrom_lengths = {chrom: bamfile.get_reference_length(chrom) for chrom in chroms}
+        mapped = {stat.contig: stat.mapped for stat in bamfile.get_index_statistics()}
+
+    if regions:
+        intervals = _parse_regions(regions, chrom_lengths)
+    else:
+        intervals = {chrom: [(0, chrom_lengths[chrom])] for chrom in chroms}
+    if shard:
+        intervals = _shard_regions(intervals, chroms, chrom_lengths, mapped, shard)
+
+    # Keep the order of BAM file references:
+    return {chrom: intervals[chrom] for chrom in chroms if chrom in intervals}
+
+
+def _xlink_position(read, blocks):
+    """
+    Return cross-link position of ``read`` with aligned ``blocks``, as determined in ``_get_read_data``.
+
+    For reads without aligned positions (also unmapped reads), start of read is returned.
+    """
+    if read.is_unmapped or not blocks:
+        return read.reference_start
+    if read.is_reverse:
+        return blocks[-1][1]
+    return max(blocks[0][0] - 1, 1)
+
+
+def _fetch(bamfile, chrom, intervals=None):
+    """
+    Return reads on chromosome ``chrom``, with their aligned blocks.
+
+    If ``intervals`` are given, only reads with cross-link position in one of
+    them are returned. Intervals should be sorted and non-overlapping, so each
+    read is returned once. Blocks of reads are needed to determine cross-link
+    position, so they are returned with each read and are not computed again
+    in ``_get_read_data``. Without ``intervals``, blocks are not computed
+    (None is returned instead).
+    """
+    if intervals is None:
+        return ((read, None) for read in bamfile.fetch(chrom))
+    return _fetch_intervals(bamfile, chrom, intervals)
+
+
+def _fetch_intervals(bamfile, chrom, intervals):
+    """Yield reads (and their aligned blocks) with cross-link position in one of ``intervals`` on ``chrom``."""
+    for start, end in intervals:
+        # Cross-link is one nucleotide before the start (or after the end) of read:
+        for read in bamfile.fetch(chrom, max(start - 1, 0), end + 1):
+            blocks = read.get_blocks()
+            if start <= _xlink_position(read, blocks) < end:
+                yield read, blocks
+
+
+def _init_bam_metrics(metrics):
+    """Set all counters, reported by ``_processs_bam_file`` to zero."""
+    metrics.all_recs = 0  # All records
+    metrics.notmapped_recs = 0  # Not mapped records
+    metrics.mapped_recs = 0  # Mapped records
+    metrics.lowmapq_recs = 0  # Records with insufficient quality
+    metrics.used_recs = 0  # Records used in analysis (all - unmapped - lowmapq)
+    metrics.invalidrandomer_recs = 0  # Records with invalid randomer
+    metrics.norandomer_recs = 0  # Records with no randomer
+    metrics.bc_cn = collections.Counter()  # Barcode counter
+    metrics.strange_recs = 0  # Strange records (not expected by segmentation)
+
+
+class _SkippedWriter:
+    """
+    Write skipped (strange) reads.
+
+    Depending on extension of ``fname``, reads are written to BAM file
+    (``.bam``) or to BED file with spans of reads (``.bed`` or ``.bed.gz``). If
+    ``fname`` is None (or empty), reads are not written at all (only counted).
+
+    If ``background`` is set, reads are passed through a bounded queue to a
+    separate thread that writes (and compresses) them, so that quantification
+    does not wait for the compression of output.
+
+    Writer can be used as context manager, so that the thread is stopped and
+    output file closed even if quantification fails.
+    """
+
+    def __init__(self, fname, header, background=False):
+        """Open output file ``fname``."""
+        self.handle = None
+        self.is_bam = False
+        if fname and fname.endswith('.bam'):
+            self.is_bam = True
+            self.handle = AlignmentFile(fname, 'wb', header=header)
+        elif fname:
+            self.handle = iCount.files.gz_open(fname, 'wt')
+
+        self.batch = []
+        self.queue = None
+        self.thread = None
+        self.error = None
+        if self.handle is not None and background:
+            self.queue = Queue(maxsize=SKIPPED_QUEUE_SIZE)
+            self.thread = Thread(target=self._consume, daemon=True)
+            self.thread.start()
+
+    def _write_reads(self, reads):
+        """Write ``reads`` to output file."""
+        if self.is_bam:
+            for read in reads:
+                self.handle.write(read)
+        else:
+            for read in reads:
+                self.handle.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                    read.reference_name, read.reference_start, read.reference_end, read.query_name,
+                    read.mapping_quality, '-' if read.is_reverse else '+'))
+
+    def _consume(self):
+        """Write batches of reads from queue, until None is received."""
+        while True:
+            reads = self.queue.get()
+            if reads is None:
+                break
+            if self.error is None:
+                try:
+                    self._write_reads(reads)
+                except Exception as error:  # pylint: disable=broad-except
+                    self.error = error
+
+    def write(self, read):
+        """Write (or queue for writing) skipped ``read``."""
+        if self.handle is None:
+            return
+        if self.queue is None:
+            self._write_reads([read])
+            return
+        self.batch.append(read)
+        if len(self.batch) >= SKIPPED_BATCH_SIZE:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def close(self):
+        """Write remaining reads and close output file."""
+        if self.handle is None:
+            return
+        try:
+            if self.queue is not None:
+                if self.batch:
+                    self.queue.put(self.batch)
+                    self.batch = []
+                self.queue.put(None)
+                self.thread.join()
+        finally:
+            self.handle.close()
+            self.handle = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        """Return writer."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close writer."""
+        try:
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            # Do not hide the exception that stopped quantification:
+            if exc_type is None:
+                raise
+            LOGGER.exception('Failed to write skipped reads.')
+
+
+def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None, gap_th=1000000,
+                       regions=None, skipped_background=False):
     """
     Extract data from BAM file into chunks of genome.
 
@@ -370,11 +1058,19 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
         reference genome sequence. If read's second start does not fall on any of
         segmentation borders, it is considered problematic. If segmentation is not provided,
         every read in two parts with gap longer than gap_th is not used (skipped).
-        All such reads are reported to the user for further exploration.
-    segmentation : str
-        File with segmentation (obtained by ``iCount segment``).
+        All such reads are reported to the user for further exploration. See
+        ``_SkippedWriter`` for supported formats.
+    segmentation : dict
+        Segment borders of all chromosomes, as returned by ``_load_segmentation``.
     gap_th : int
         Reads with gaps less than gap_th are treated as if they have no gap.
+    regions : dict
+        Process only reads on these chromosomes: chromosome -> list of
+        (start, end) intervals, as returned by ``_get_regions``. If intervals
+        of chromosome are None, all of its reads are processed. If None, all
+        chromosomes in BAM file are processed.
+    skipped_background : bool
+        Write skipped reads in a background thread.
 
     Returns
     -------
@@ -384,15 +1080,7 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
         BAM file with
 
     """
-    metrics.all_recs = 0  # All records
-    metrics.notmapped_recs = 0  # Not mapped records
-    metrics.mapped_recs = 0  # Mapped records
-    metrics.lowmapq_recs = 0  # Records with insufficient quality
-    metrics.used_recs = 0  # Records used in analysis (all - unmapped - lowmapq)
-    metrics.invalidrandomer_recs = 0  # Records with invalid randomer
-    metrics.norandomer_recs = 0  # Records with no randomer
-    metrics.bc_cn = {}  # Barcode counter
-    metrics.strange_recs = 0  # Strange records (not expected by segmentation)
+    _init_bam_metrics(metrics)
 
     def finalize(reads_pending_fwd, reads_pending_rev, start, chrom, progress):
         """Yield appropriate data."""
@@ -412,20 +1100,21 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
 
     genome_done = 0
     ann_data = None
-    LOGGER.info('Detecting cross-links...')
-    with AlignmentFile(bam_fname, 'rb') as bamfile:
-        strange_bam = AlignmentFile(skipped, 'wb', header=bamfile.header)
+    with AlignmentFile(bam_fname, 'rb') as bamfile, \
+            _SkippedWriter(skipped, bamfile.header, background=skipped_background) as strange_writer:
         genome_size = sum([contig['LN'] for contig in bamfile.header['SQ']])
-        for chrom in bamfile.references:
+        if regions is None:
+            regions = {chrom: None for chrom in bamfile.references}
+        for chrom, intervals in regions.items():
             chrom_len = bamfile.header['SQ'][bamfile.get_tid(chrom)]['LN']
             if segmentation:
-                # pylint: disable=protected-access
-                ann_data = iCount.genomes.segment._prepare_segmentation(segmentation, chrom)
+                ann_data = _chrom_borders(segmentation, chrom)
 
             reads_pending_fwd = {}
             reads_pending_rev = {}
+            flushed_start = 0
             read = None
-            for read in bamfile.fetch(chrom):
+            for read, blocks in _fetch(bamfile, chrom, intervals):
                 metrics.all_recs += 1
                 if read.is_unmapped:
                     metrics.notmapped_recs += 1
@@ -437,11 +1126,11 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
                 metrics.used_recs += 1
 
                 rdata = _get_read_data(
-                    read, metrics, mapq_th, segmentation=ann_data, gap_th=gap_th)
+                    read, metrics, mapq_th, segmentation=ann_data, gap_th=gap_th, blocks=blocks)
                 (xlink_pos, barcode, is_strange, strand), read_data = rdata[0:4], rdata[4:]
 
                 if is_strange:
-                    strange_bam.write(read)
+                    strange_writer.write(read)
                 else:
                     if strand == '+':
                         reads_pending_fwd.setdefault(
@@ -450,6 +1139,16 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
                         reads_pending_rev.setdefault(
                             xlink_pos, {}).setdefault(barcode, []).append(read_data)
 
+                # Reads are sorted by start and cross-link position of a read is never
+                # smaller than (read start - 1). Positions before that are final and
+                # can be passed on, so that only a window of reads is kept in memory.
+                if read.reference_start - flushed_start >= FLUSH_WINDOW:
+                    flushed_start = read.reference_start
+                    progress = round(min((genome_done + flushed_start) / genome_size, 1.0), 4)
+                    for data in finalize(
+                            reads_pending_fwd, reads_pending_rev, flushed_start - 1, chrom, progress):
+                        yield data
+
             # Sliding window start (smaller coordinate)
             start = 0 if read is None else (0 if not read.positions else read.positions[0])
             progress = round(min((genome_done + start) / genome_size, 1.0), 4)
@@ -464,7 +1163,9 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
 
             genome_done += chrom_len
 
-    # Report:
+
+def _log_bam_metrics(metrics, skipped):
+    """Report statistics collected while processing BAM file."""
     LOGGER.info('All records in BAM file: %d', metrics.all_recs)
     LOGGER.info('Reads not mapped: %d', metrics.notmapped_recs)
     LOGGER.info('Mapped reads records (hits): %d', metrics.mapped_recs)
@@ -477,12 +1178,269 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
         [(count, barcode) for barcode, count in metrics.bc_cn.items()], reverse=True)[:10]
     for count, barcode in top10:
         LOGGER.info('    %s: %d', barcode, count)
-    LOGGER.info('There are %d reads with second-start not falling on segmentation. They are '
-                'reported in file: %s', metrics.strange_recs, skipped)
+    if skipped:
+        LOGGER.info('There are %d reads with second-start not falling on segmentation. They are '
+                    'reported in file: %s', metrics.strange_recs, skipped)
+    else:
+        LOGGER.info('There are %d reads with second-start not falling on segmentation.',
+                    metrics.strange_recs)
 
 
-def run(bam, sites_single, sites_multi, skipped, group_by='start', quant='cDNA',
-        segmentation=None, mapq_th=0, multimax=50, gap_th=4,
+def _merge_metrics(metrics, other):
+    """
+    Add statistics from ``other`` to ``metrics``.
+
+    Counters are summed and barcode counts (``bc_cn``) are merged. Note:
+    ``metrics`` is updated in place!
+    """
+    for name, value in other.__dict__.items():
+        if name == 'context':
+            continue
+        if isinstance(value, dict):
+            merged = getattr(metrics, name, {})
+            for key, count in value.items():
+                merged[key] = merged.get(key, 0) + count
+            setattr(metrics, name, merged)
+        else:
+            setattr(metrics, name, getattr(metrics, name, 0) + value)
+
+
+def _encode_barcode(barcode):
+    """
+    Encode ``barcode`` as integer, with 2 bits per nucleotide.
+
+    Leading 1 bit marks the length of barcode, so that barcodes of different
+    lengths have different codes. Barcodes that are empty or contain other
+    nucleotides than A, C, G and T can not be encoded and None is returned.
+    """
+    if not barcode or barcode.strip(_NUCLEOTIDES_CHARS):
+        return None
+    return int('1' + barcode.translate(_NUCLEOTIDE_DIGITS), 4)
+
+
+@functools.lru_cache(maxsize=None)
+def _neighbour_masks(length):
+    """
+    Return XOR masks that change a single nucleotide of encoded barcode of ``length``.
+
+    ``code ^ mask`` gives codes of all barcodes at Hamming distance 1.
+    """
+    return tuple(change << (2 * i) for i in range(length) for change in (1, 2, 3))
+
+
+def _cluster_barcodes(by_bc, method):
+    """
+    Merge barcodes (randomers) that are likely sequencing errors of other barcodes.
+
+    Barcodes are considered similar if they have the same length and differ in
+    a single nucleotide (Hamming distance 1). Barcodes are processed from the
+    most to the least frequent (by number of hits). Two methods are supported
+    (as in UMI-tools):
+
+        * ``adjacency``: barcode that is not merged yet, absorbs all of its
+          similar barcodes that are not merged yet.
+        * ``directional``: barcode absorbs similar barcode with count ``c``, if
+          its own count is at least ``2 * c - 1``. Absorbed barcodes can
+          further absorb their similar barcodes by the same rule.
+
+    Barcodes that can not be encoded (see ``_encode_barcode``) are never
+    merged.
+
+    Parameters
+    ----------
+    by_bc : dict
+        Dict with hits for each barcode.
+    method : str
+        Clustering method: 'directional' or 'adjacency'.
+
+    Returns
+    -------
+    dict
+        Dict with hits for each remaining barcode.
+    int
+        Number of merged barcodes.
+
+    """
+    if len(by_bc) < 2:
+        return by_bc, 0
+
+    barcodes = {}
+    for barcode in by_bc:
+        code = _encode_barcode(barcode)
+        if code is not None:
+            barcodes[code] = barcode
+
+    def similar(barcode):
+        """Return barcodes that differ from ``barcode`` in one nucleotide."""
+        code = _encode_barcode(barcode)
+        if code is None:
+            return []
+        return [barcodes[code ^ mask] for mask in _neighbour_masks(len(barcode)) if code ^ mask in barcodes]
+
+    counts = {barcode: len(hits) for barcode, hits in by_bc.items()}
+    clusters = {}
+    assigned = set()
+    for barcode in sorted(by_bc, key=lambda barcode: (-counts[barcode], barcode)):
+        if barcode in assigned:
+            continue
+        assigned.add(barcode)
+        cluster = clusters[barcode] = [barcode]
+        if method == 'adjacency':
+            for other in similar(barcode):
+                if other not in assigned:
+                    assigned.add(other)
+                    cluster.append(other)
+        else:
+            stack = [barcode]
+            while stack:
+                node = stack.pop()
+                for other in similar(node):
+                    if other not in assigned and counts[node] >= 2 * counts[other] - 1:
+                        assigned.add(other)
+                        cluster.append(other)
+                        stack.append(other)
+
+    if len(clusters) == len(by_bc):
+        return by_bc, 0
+    merged = {
+        barcode: [hit for member in cluster for hit in by_bc[member]] for barcode, cluster in clusters.items()
+    }
+    return merged, len(by_bc) - len(merged)
+
+
+def _quantify(chunks, group_by, multimax, umi_method=None, metrics=None, report_progress=False):
+    """
+    Compute cDNA and read counts for chunks of reads given by ``_processs_bam_file``.
+
+    Counts are yielded for each chromosome, as soon as all of its chunks are
+    processed. If ``umi_method`` is given, similar barcodes on each position
+    are merged before counting (see ``_cluster_barcodes``) and the number of
+    merged barcodes is stored to ``metrics``.
+
+    Yields
+    ------
+    tuple
+        Chromosome name, single and multi-mapped counts on chromosome
+        (``_SiteCounts``).
+
+    """
+    group_by_index = ['start', 'middle', 'end'].index(group_by)
+    umi_merged_barcodes = 0
+    progress = 0
+    current_chrom, single, multi = None, None, None
+    for (chrom, strand), new_progress, by_pos in chunks:
+        if report_progress:
+            # pylint: disable=protected-access
+            progress = iCount._log_progress(new_progress, progress, LOGGER)
+
+        if chrom != current_chrom:
+            if current_chrom is not None:
+                yield current_chrom, single, multi
+            current_chrom, single, multi = chrom, _SiteCounts(), _SiteCounts()
+
+        # Counts are added (not overwritten): when grouping by middle or end,
+        # reads from different chunks can contribute to the same position.
+        for xlink_pos, by_bc in by_pos.items():
+            if umi_method:
+                by_bc, merged = _cluster_barcodes(by_bc, umi_method)
+                umi_merged_barcodes += merged
+            # count single mapped reads and all reads mapped les than multimax times
+            single_counts, multi_counts = _collapse_single_multi(xlink_pos, by_bc, group_by_index, multimax)
+            single.add(strand, single_counts)
+            multi.add(strand, multi_counts)
+
+    if umi_method and metrics is not None:
+        metrics.umi_merged_barcodes = umi_merged_barcodes
+    if current_chrom is not None:
+        yield current_chrom, single, multi
+
+
+def _quantify_chromosome(task):
+    """
+    Quantify cross-links on one chromosome.
+
+    This is the unit of work for the process pool in ``_quantify_parallel``. Each
+    worker opens its own BAM file handle and writes skipped reads to its own
+    (temporary) BAM file.
+    """
+    (bam, chrom, intervals, skipped_part, borders, mapq_th, gap_th, group_by, multimax, umi_method,
+     skipped_background) = task
+    metrics = iCount.Metrics()
+    chunks = _processs_bam_file(bam, metrics, mapq_th, skipped_part, borders, gap_th,
+                                regions={chrom: intervals}, skipped_background=skipped_background)
+    single, multi = _SiteCounts(), _SiteCounts()
+    for _, single, multi in _quantify(chunks, group_by, multimax, umi_method=umi_method, metrics=metrics):
+        pass
+    return chrom, single, multi, metrics
+
+
+def _quantify_parallel(bam, metrics, mapq_th, skipped, borders, gap_th, group_by, multimax, threads,
+                       regions=None, umi_method=None, skipped_background=False, report_progress=False):
+    """
+    Quantify cross-links with a pool of ``threads`` processes, one chromosome per task.
+
+    Positions on different chromosomes never interact, so the chromosomes can be
+    processed independently. Counts are yielded in the order of references in BAM
+    file (same as ``_quantify``), so the output is the same as in the single process
+    mode. Skipped reads are also concatenated in the order of references.
+    """
+    with AlignmentFile(bam, 'rb') as bamfile:
+        header = bamfile.header
+        if regions is None:
+            regions = {chrom: None for chrom in bamfile.references}
+        chroms = list(regions)
+        chrom_lens = [bamfile.get_reference_length(chrom) for chrom in chroms]
+    genome_size = sum(chrom_lens)
+
+    if skipped:
+        extension = 'bam' if skipped.endswith('.bam') else 'bed'
+        skipped_parts = [iCount.files.get_temp_file_name(extension=extension) for _ in chroms]
+    else:
+        skipped_parts = [None for _ in chroms]
+    tasks = [
+        (bam, chrom, regions[chrom], skipped_part, _chrom_borders(borders, chrom) if borders else None,
+         mapq_th, gap_th, group_by, multimax, umi_method, skipped_background)
+        for chrom, skipped_part in zip(chroms, skipped_parts)
+    ]
+
+    _init_bam_metrics(metrics)
+    if umi_method:
+        metrics.umi_merged_barcodes = 0
+    progress, genome_done = 0, 0
+    try:
+        with multiprocessing.Pool(threads) as pool:
+            results = pool.imap(_quantify_chromosome, tasks)
+            for chrom_len, (chrom, single, multi, chrom_metrics) in zip(chrom_lens, results):
+                _merge_metrics(metrics, chrom_metrics)
+                if single or multi:
+                    yield chrom, single, multi
+
+                genome_done += chrom_len
+                if report_progress and genome_size:
+                    # pylint: disable=protected-access
+                    progress = iCount._log_progress(genome_done / genome_size, progress, LOGGER)
+
+        if not skipped:
+            return
+        if not skipped.endswith('.bam'):
+            with iCount.files.gz_open(skipped, 'wt') as out:
+                for skipped_part in skipped_parts:
+                    with open(skipped_part, 'rt') as handle:
+                        shutil.copyfileobj(handle, out)
+        elif skipped_parts:
+            pysam.cat('-o', skipped, *skipped_parts)  # pylint: disable=no-member
+        else:
+            AlignmentFile(skipped, 'wb', header=header).close()
+    finally:
+        # Parts are also removed if quantification failed (some of them may not exist):
+        for skipped_part in skipped_parts:
+            if skipped_part is not None and os.path.exists(skipped_part):
+                os.remove(skipped_part)
+
+
+def run(bam, sites_single, sites_multi, skipped=None, group_by='start', quant='cDNA',
+        segmentation=None, mapq_th=0, multimax=50, gap_th=4, threads=1,
+        regions=None, shard=None, sites_npz=None, skipped_background=False, umi_method=None,
         report_progress=False):
     """
     Identify and quantify cross-linked sites.
@@ -509,7 +1467,9 @@ def run(bam, sites_single, sites_multi, skipped, group_by='start', quant='cDNA',
         reference genome sequence. If read's second start does not fall on any of
         segmentation borders, it is considered problematic. If segmentation is not provided,
         every read in two parts with gap longer than gap_th is not used (skipped).
-        All such reads are reported to the user for further exploration.
+        All such reads are reported to the user for further exploration. If file
+        name ends with .bed or .bed.gz, only spans of reads are stored in BED6
+        format. If not given, skipped reads are only counted.
     group_by : str
         Assign score of a read to either 'start', 'middle' or 'end' nucleotide.
     quant : str
@@ -520,10 +1480,33 @@ def run(bam, sites_single, sites_multi, skipped, group_by='start', quant='cDNA',
         Ignore hits with MAPQ < mapq_th.
     multimax : int
         Ignore reads, mapped to more than ``multimax`` places.
-    report_progress : bool
-        Switch to report progress.
     gap_th : int
         Reads with gaps less than gap_th are treated as if they have no gap.
+    threads : int
+        Number of processes used for quantification. Chromosomes are
+        distributed among them.
+    regions : list_str
+        Quantify only reads with cross-link in these regions. Each region is
+        either chromosome name, region in form chrom:start-end (1-based,
+        inclusive) or BED file with target intervals.
+    shard : str
+        Quantify only k-th of n parts of genome (or of regions), given as "k/n".
+        Parts have approximately equal number of mapped reads (from BAM
+        index). Results of all parts can be merged with ``iCount group``.
+    sites_npz : str
+        Output NPZ file to also store data from single ('single') and
+        multi-mapped ('multi') reads in binary, columnar format. It can be
+        loaded with ``iCount.files.npz.load_sites``.
+    skipped_background : bool
+        Write skipped reads in a background thread, so that compression of
+        output does not slow down quantification.
+    umi_method : str
+        Merge randomers on the same position that differ in one nucleotide and
+        are therefore likely a result of sequencing errors. Use 'directional'
+        or 'adjacency' method (as in UMI-tools). By default, each distinct
+        randomer is counted as a separate cDNA.
+    report_progress : bool
+        Switch to report progress.
 
     Returns
     -------
@@ -535,37 +1518,218 @@ def run(bam, sites_single, sites_multi, skipped, group_by='start', quant='cDNA',
 
     assert sites_single.endswith(('.bed', '.bed.gz'))
     assert sites_multi.endswith(('.bed', '.bed.gz'))
-    assert skipped.endswith(('.bam'))
+    assert not skipped or skipped.endswith(('.bam', '.bed', '.bed.gz'))
     assert quant in ['cDNA', 'reads']
     assert group_by in ['start', 'middle', 'end']
+    assert threads >= 1
+    assert sites_npz is None or sites_npz.endswith('.npz')
+    assert umi_method in [None, '', 'directional', 'adjacency']
 
     metrics = iCount.Metrics()
 
-    single, multi = {}, {}
-    progress = 0
-    for (chrom, strand), new_progress, by_pos in _processs_bam_file(
-            bam, metrics, mapq_th, skipped, segmentation, gap_th):
-        if report_progress:
-            # pylint: disable=protected-access
-            progress = iCount._log_progress(new_progress, progress, LOGGER)
-
-        single_by_pos = {}
-        multi_by_pos = {}
-        for xlink_pos, by_bc in by_pos.items():
+    borders = None
+    if segmentation:
+        LOGGER.info('Loading segmentation...')
+        load_start = time.time()
+        borders = _get_borders(segmentation)
+        metrics.segmentation_load_time = round(time.time() - load_start, 3)
+        LOGGER.info('Segmentation loaded in %.3f s.', metrics.segmentation_load_time)
 
-            # count single mapped reads only
-            _update(single_by_pos, _collapse(xlink_pos, by_bc, group_by, multimax=1))
-            # count all reads mapped les than multimax times
-            _update(multi_by_pos, _collapse(xlink_pos, by_bc, group_by, multimax=multimax))
+    targets = _get_regions(bam, regions=regions, shard=shard)
+    if targets is not None:
+        intervals = [interval for chrom_intervals in targets.values() for interval in chrom_intervals]
+        LOGGER.info('Quantifying %d regions (%d bp).', len(intervals),
+                    sum(end - start for start, end in intervals))
 
-        single.setdefault((chrom, strand), {}).update(single_by_pos)
-        multi.setdefault((chrom, strand), {}).update(multi_by_pos)
+    LOGGER.info('Detecting cross-links...')
+    if threads > 1:
+        counts = _quantify_parallel(
+            bam, metrics, mapq_th, skipped, borders, gap_th, group_by, multimax, threads,
+            regions=targets, umi_method=umi_method, skipped_background=skipped_background,
+            report_progress=report_progress)
+    else:
+        chunks = _processs_bam_file(bam, metrics, mapq_th, skipped, borders, gap_th, regions=targets,
+                                    skipped_background=skipped_background)
+        counts = _quantify(chunks, group_by, multimax, umi_method=umi_method, metrics=metrics,
+                           report_progress=report_progress)
 
-    # Write output
+    # Write output as soon as each chromosome is quantified:
     val_index = ['cDNA', 'reads'].index(quant)
-    _save_dict(single, sites_single, val_index=val_index)
+    single_writer = _SitesWriter(sites_single, val_index)
+    multi_writer = _SitesWriter(sites_multi, val_index)
+    npz_writer = iCount.files.npz.SitesWriter(sites_npz, ['single', 'multi']) if sites_npz else None
+    for chrom, single, multi in counts:
+        single_writer.write(chrom, single)
+        multi_writer.write(chrom, multi)
+        if npz_writer is not None:
+            npz_writer.write('single', chrom, single.columns())
+            npz_writer.write('multi', chrom, multi.columns())
+    _log_bam_metrics(metrics, skipped)
+    if umi_method:
+        LOGGER.info('Randomers merged with similar randomers: %d', metrics.umi_merged_barcodes)
+
+    single_writer.close()
     LOGGER.info('Saved to BED file (single mapped reads): %s', sites_single)
-    _save_dict(multi, sites_multi, val_index=val_index)
+    multi_writer.close()
     LOGGER.info('Saved to BED file (multi-mapped reads): %s', sites_multi)
+    if npz_writer is not None:
+        npz_writer.close()
+
+    return metrics
+
+
+def _read_sample_sheet(sample_sheet):
+    """
+    Read samples from tab-separated ``sample_sheet``.
+
+    Each line holds paths to input BAM file and output files of one sample,
+    in order given by ``SAMPLE_SHEET_COLUMNS``. Column ``skipped`` is
+    optional. Empty lines, lines starting with ``#`` and header line (starting
+    with ``bam``) are ignored.
+    """
+    samples = []
+    with iCount.files.gz_open(sample_sheet, 'rt') as handle:
+        for line_no, line in enumerate(handle, start=1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split('\t')]
+            if fields[0] == SAMPLE_SHEET_COLUMNS[0]:
+                continue
+            if not 3 <= len(fields) <= len(SAMPLE_SHEET_COLUMNS):
+                raise ValueError('Line {} of sample sheet {} should have 3 or 4 columns: {}'.format(
+                    line_no, sample_sheet, line))
+            fields += [''] * (len(SAMPLE_SHEET_COLUMNS) - len(fields))
+            samples.append(dict(zip(SAMPLE_SHEET_COLUMNS, fields)))
+
+    if not samples:
+        raise ValueError('No samples in sample sheet: {}'.format(sample_sheet))
+    return samples
+
+
+def _run_sample(task):
+    """
+    Run ``run`` on one sample of ``xlsites_batch``.
+
+    Return metrics of the sample as dict of plain values (without barcode
+    counter), so that only a small object is passed back from worker process.
+    """
+    sample, kwargs = task
+    metrics = run(sample['bam'], sample['sites_single'], sample['sites_multi'], sample['skipped'] or None,
+                  **kwargs)
+    return {name: value for name, value in vars(metrics).items()
+            if name != 'context' and not isinstance(value, dict)}
+
+
+def _write_metrics_table(fname, samples, sample_metrics):
+    """Write metrics of each sample to tab-separated file ``fname``, one sample per line."""
+    names = []
+    for values in sample_metrics:
+        names.extend(name for name in values if name not in names)
+
+    with iCount.files.gz_open(fname, 'wt') as handle:
+        handle.write('\t'.join(['bam'] + names) + '\n')
+        for sample, values in zip(samples, sample_metrics):
+            row = [sample['bam']] + [str(values.get(name, '')) for name in names]
+            handle.write('\t'.join(row) + '\n')
+    LOGGER.info('Saved metrics of all samples to: %s', fname)
+
+
+def xlsites_batch(sample_sheet, metrics_table, group_by='start', quant='cDNA', segmentation=None,
+                  mapq_th=0, multimax=50, gap_th=4, processes=1, umi_method=None,
+                  report_progress=False):
+    """
+    Identify and quantify cross-linked sites in multiple BAM files.
+
+    Each sample is processed as with ``iCount xlsites``, but segmentation is
+    read only once and samples are processed concurrently in a pool of
+    processes. On platforms that support it, worker processes are forked and
+    share segmentation borders (read-only) with the main process.
+
+    Parameters
+    ----------
+    sample_sheet : str
+        Tab-separated file with one sample per line and columns: input BAM
+        file, output BED6 file for single mapped reads, output BED6 file for
+        single and multi-mapped reads and (optional) output file for skipped
+        reads (as in ``iCount xlsites``).
+    metrics_table : str
+        Output tab-separated file with metrics of each sample (one per line).
+    group_by : str
+        Assign score of a read to either 'start', 'middle' or 'end' nucleotide.
+    quant : str
+        Report number of 'cDNA' or number of 'reads'.
+    segmentation : str
+        File with custon segmentation format (obtained by ``iCount segment``).
+    mapq_th : int
+        Ignore hits with MAPQ < mapq_th.
+    multimax : int
+        Ignore reads, mapped to more than ``multimax`` places.
+    gap_th : int
+        Reads with gaps less than gap_th are treated as if they have no gap.
+    processes : int
+        Number of samples processed at the same time.
+    umi_method : str
+        Merge randomers on the same position that differ in one nucleotide,
+        with 'directional' or 'adjacency' method.
+    report_progress : bool
+        Switch to report progress.
+
+    Returns
+    -------
+    iCount.Metrics
+        Metrics object, storing analysis metadata.
+
+    """
+    iCount.log_inputs(LOGGER, level=logging.INFO)  # pylint: disable=protected-access
+    assert processes >= 1
 
+    metrics = iCount.Metrics()
+    samples = _read_sample_sheet(sample_sheet)
+    metrics.samples = len(samples)
+    LOGGER.info('Samples in sample sheet: %d', metrics.samples)
+
+    if segmentation:
+        LOGGER.info('Loading segmentation...')
+        load_start = time.time()
+        _get_borders(segmentation)
+        metrics.segmentation_load_time = round(time.time() - load_start, 3)
+        LOGGER.info('Segmentation loaded in %.3f s.', metrics.segmentation_load_time)
+
+    kwargs = {
+        'group_by': group_by,
+        'quant': quant,
+        'segmentation': segmentation,
+        'mapq_th': mapq_th,
+        'multimax': multimax,
+        'gap_th': gap_th,
+        'umi_method': umi_method,
+    }
+    tasks = [(sample, kwargs) for sample in samples]
+
+    pool = None
+    results = map(_run_sample, tasks)
+    if processes > 1 and len(tasks) > 1:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Forked workers inherit already loaded segmentation borders.
+            pool = multiprocessing.get_context('fork').Pool(min(processes, len(tasks)))
+        else:
+            pool = multiprocessing.Pool(min(processes, len(tasks)))
+        results = pool.imap(_run_sample, tasks)
+
+    sample_metrics = []
+    progress = 0
+    try:
+        for values in results:
+            sample_metrics.append(values)
+            if report_progress:
+                # pylint: disable=protected-access
+                progress = iCount._log_progress(len(sample_metrics) / len(tasks), progress, LOGGER)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    _write_metrics_table(metrics_table, samples, sample_metrics)
+    metrics.used_recs = sum(values.get('used_recs', 0) for values in sample_metrics)
     return metrics
@@ -0,0 +1,73 @@
+"""
+Benchmark iCount.files.intervals.intersect.
+
+This script intersects cross-linked sites with a segmentation-like annotation
+(adjacent regions on both strands, with overlapping genes) in the same way as
+``iCount summary`` (``-s -wb``). If bedtools is installed, it also checks that
+output is the same as output of ``bedtools intersect`` and compares the speed
+of both.
+"""
+# pylint: disable=missing-docstring
+
+import random
+import shutil
+import timeit
+import unittest
+
+import pybedtools
+
+from iCount.files import intervals
+from iCount.tests.utils import get_temp_file_name
+
+
+class TestIntersectBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.annotation = get_temp_file_name(extension='gtf')
+        self.sites = get_temp_file_name(extension='bed')
+
+        features = []
+        for strand in '+-':
+            start = 1
+            while start < 10**7:
+                end = start + rnd.randint(50, 5000)
+                type_ = rnd.choice(['CDS', 'UTR3', 'UTR5', 'intron', 'ncRNA', 'intergenic'])
+                features.append(['1', '.', type_, start, end, '.', strand, '.', 'gene_id "G{}";'.format(start)])
+                if rnd.random() < 0.05:
+                    features.append(['1', '.', 'gene', start, start + 10**5, '.', strand, '.', 'gene_id "L";'])
+                start = end + 1
+        with open(self.annotation, 'wt') as handle:
+            for feature in sorted(features, key=lambda x: (x[0], x[3])):
+                handle.write('\t'.join(map(str, feature)) + '\n')
+
+        with open(self.sites, 'wt') as handle:
+            for pos in sorted(rnd.sample(range(10**7), 10**6)):
+                handle.write('1\t{}\t{}\t.\t{}\t{}\n'.format(pos, pos + 1, rnd.randint(1, 9), rnd.choice('+-')))
+
+    def native(self):
+        return list(intervals.intersect(self.sites, self.annotation, s=True, wb=True))
+
+    def bedtools(self):
+        # pylint: disable=too-many-function-args,unexpected-keyword-arg
+        overlaps = pybedtools.BedTool(self.sites).intersect(
+            pybedtools.BedTool(self.annotation), sorted=True, s=True, wb=True, nonamecheck=True).saveas()
+        # pylint: enable=too-many-function-args,unexpected-keyword-arg
+        return [tuple(interval.fields) for interval in overlaps]
+
+    def test_benchmark(self):
+        overlaps = self.native()
+        new = min(timeit.repeat(self.native, number=1, repeat=3))
+        if shutil.which('bedtools') is None:
+            print('\nIntersecting 1000000 sites: native {:.3f} s ({} overlaps, bedtools not installed)'.format(
+                new, len(overlaps)))
+            return
+
+        self.assertEqual(overlaps, self.bedtools())
+        old = min(timeit.repeat(self.bedtools, number=1, repeat=3))
+        print('\nIntersecting 1000000 sites: bedtools {:.3f} s, native {:.3f} s ({:.1f}x)'.format(
+            old, new, old / new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Benchmark null models in iCount.analysis.sigxls.
+
+This script computes FDR values for a set of random groups (genes) with each
+null model and reports running time, number of computed random distributions
+and number of positions, where FDR value differs from the one computed with
+permutations.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import time
+import unittest
+
+import numpy
+
+from iCount.analysis import sigxls
+
+
+class TestNullModelsBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        rnd = numpy.random.RandomState(42)
+        self.groups, self.group_sizes = {}, {}
+        for i in range(2000):
+            key = ('chr1', '+', 'G{}'.format(i), 'gene')
+            size = int(10 ** rnd.uniform(2.5, 5))
+            hits = min(size, int(rnd.lognormal(3, 1.5)) + 1)
+            positions = rnd.choice(size, size=hits, replace=False) + 10 ** 5 * i
+            self.groups[key] = [(int(pos), float(rnd.randint(1, 10))) for pos in positions]
+            self.group_sizes[key] = size
+
+    def process(self, null_model):
+        sigxls.PS_CACHE.clear()
+        start = time.time()
+        results = sigxls._process_groups(self.groups, self.group_sizes, 3, 100, 42, null_model=null_model)
+        return results, time.time() - start, len(sigxls.PS_CACHE)
+
+    def test_benchmark(self):
+        expected, _, _ = self.process('permutation')
+        for null_model in sigxls.NULL_MODELS:
+            results, duration, distributions = self.process(null_model)
+            significant = sum(min(annot)[0] < 0.05 for annot in results.values())
+            different = sum(
+                (min(results[key])[0] < 0.05) != (min(expected[key])[0] < 0.05) for key in expected)
+            print('\n{}: {:.2f} s, {} random distributions, {} significant positions '
+                  '({} differ from permutation)'.format(null_model, duration, distributions, significant, different))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Benchmark iCount.analysis.sigxls._group_overlaps.
+
+This script compares the speed of grouping ``bedtools intersect -wo`` output
+by parsing lines directly with the previous implementation (iteration through
+``pybedtools.Interval`` objects). It also checks that both implementations
+return the same groups.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import random
+import timeit
+import unittest
+
+import pybedtools
+
+from iCount.analysis import sigxls
+from iCount.tests.utils import get_temp_file_name
+
+
+def group_overlaps_intervals(fname, group_by, multi_mode):
+    """Group overlaps (previous implementation)."""
+    groups, group_sizes = {}, {}
+    for feature in pybedtools.BedTool(fname):
+        group_id = feature.attrs[group_by]
+        if multi_mode:
+            group_id = feature[2] + '_' + group_id
+        key = (feature.chrom, feature.strand, group_id, feature.name)
+        groups.setdefault(key, []).append((int(feature.fields[10]), float(feature.fields[13])))
+        group_sizes.setdefault(key, set()).add((feature.start, feature.stop))
+    return groups, group_sizes
+
+
+class TestGroupOverlapsBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.fname = get_temp_file_name(extension='tsv')
+        with open(self.fname, 'wt') as handle:
+            for i in range(5000):
+                start = i * 10000 + 1
+                attrs = 'gene_id "ENSG{0:011d}"; gene_name "GENE{0}"; transcript_id "."; biotype "lncRNA";'.format(i)
+                feature = ['1', '.', 'gene', str(start), str(start + 9000), '.', '+', '.', attrs]
+                for pos in sorted(rnd.sample(range(start - 1, start + 9000), 100)):
+                    site = ['1', str(pos), str(pos + 1), '.', str(rnd.randint(1, 9)), '+', '1']
+                    handle.write('\t'.join(feature + site) + '\n')
+
+    def group_overlaps(self):
+        with open(self.fname) as handle:
+            return sigxls._group_overlaps(sigxls._split_lines(handle), 'gene_id', False)
+
+    def test_benchmark(self):
+        self.assertEqual(self.group_overlaps(), group_overlaps_intervals(self.fname, 'gene_id', False))
+
+        old = min(timeit.repeat(
+            lambda: group_overlaps_intervals(self.fname, 'gene_id', False), number=1, repeat=3))
+        new = min(timeit.repeat(
+            self.group_overlaps, number=1, repeat=3))
+        print('\nGrouping 500000 overlaps: Interval {:.3f} s, current {:.3f} s ({:.1f}x)'.format(
+            old, new, old / new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Benchmark iCount.analysis.sigxls.get_avg_rnd_distrib.
+
+This script compares the speed of batched permutations with the previous
+implementation (one permutation at a time) for small and large groups. It
+also checks that both implementations return the same background
+distribution, given the same random seed.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import timeit
+import unittest
+from collections import Counter
+
+import numpy
+
+from iCount.analysis import sigxls
+
+
+def get_avg_rnd_distrib_loop(size, total_hits, half_window, perms=10000):
+    """Return background distribution (previous implementation)."""
+    rnd_ps = numpy.zeros((perms, total_hits + 1))
+    for i in range(perms):
+        rnd_hits = Counter(numpy.random.randint(size, size=total_hits))
+        scores_cww = sigxls._sum_within_window_nopos(rnd_hits.items(), half_window=half_window)
+        rnd_ps[i, :] = sigxls.cumulative_prob(scores_cww, total_hits)
+
+    rnd_dist = numpy.mean(rnd_ps, axis=0) + numpy.std(rnd_ps, axis=0)
+    return [min(1.0, prob) for prob in rnd_dist]
+
+
+class TestRndDistribBenchmark(unittest.TestCase):
+
+    def compare(self, size, total_hits, perms):
+        numpy.random.seed(42)
+        expected = get_avg_rnd_distrib_loop(size, total_hits, 3, perms)
+        sigxls.PS_CACHE.clear()
+        numpy.random.seed(42)
+        self.assertEqual(sigxls.get_avg_rnd_distrib(size, total_hits, 3, perms), expected)
+
+        def batched():
+            sigxls.PS_CACHE.clear()
+            sigxls.get_avg_rnd_distrib(size, total_hits, 3, perms)
+
+        old = min(timeit.repeat(lambda: get_avg_rnd_distrib_loop(size, total_hits, 3, perms),
+                                number=1, repeat=3))
+        new = min(timeit.repeat(batched, number=1, repeat=3))
+        print('\nGroup size {}, {} hits, {} permutations: loop {:.3f} s, batched {:.3f} s ({:.1f}x)'.format(
+            size, total_hits, perms, old, new, old / new))
+
+    def test_benchmark(self):
+        self.compare(1000, 20, 10000)
+        self.compare(300, 3000, 1000)
+        self.compare(10 ** 5, 3000, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
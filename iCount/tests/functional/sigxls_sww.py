@@ -0,0 +1,83 @@
+"""
+Benchmark sliding-window sums in iCount.analysis.sigxls.
+
+This script compares the speed of ``_sum_within_window`` and
+``_sum_within_window_nopos`` with the previous (``bisect`` based)
+implementation on groups with 10^5 and 10^6 positions, as found in large
+lncRNAs and intergenic bins. It also checks that both implementations return
+exactly the same values.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import bisect
+import random
+import timeit
+import unittest
+
+from iCount.analysis import sigxls
+
+
+def sum_within_window_bisect(pos_val, half_window=3):
+    """Sum counts in windows (previous implementation)."""
+    if not pos_val:
+        return []
+    pos_val_ind = sorted((pos, val, i) for i, (pos, val) in enumerate(pos_val))
+    poss, vals, inds = zip(*pos_val_ind)
+
+    ret_list = [None] * len(pos_val)
+    max_i = len(poss)
+    for i, pos in enumerate(poss):
+        i_start = bisect.bisect_left(
+            poss, pos - half_window, lo=max(0, i - half_window), hi=i)
+        i_stop = bisect.bisect_left(
+            poss, pos + 1 + half_window, lo=i_start, hi=min(i + half_window + 1, max_i))
+        ret_list[inds[i]] = (pos, sum(vals[i_start:i_stop]))
+    return ret_list
+
+
+def sum_within_window_nopos_bisect(pos_val, half_window=3):
+    """Sum counts in windows, without positions (previous implementation)."""
+    if not pos_val:
+        return []
+    pos_val = sorted(pos_val)
+    poss, vals = zip(*pos_val)
+
+    ret_list = []
+    max_i = len(poss)
+    for i, pos in enumerate(poss):
+        i_start = bisect.bisect_left(
+            poss, pos - half_window, lo=max(0, i - half_window), hi=i)
+        i_stop = bisect.bisect_left(
+            poss, pos + 1 + half_window, lo=i_start, hi=min(i + half_window + 1, max_i))
+        ret_list.append(sum(vals[i_start:i_stop]))
+    return ret_list
+
+
+class TestSumWithinWindowBenchmark(unittest.TestCase):
+
+    @staticmethod
+    def make_group(size, rnd):
+        # Group spans approximately 3 times as many nucleotides as it has positions:
+        positions = rnd.sample(range(3 * size), size)
+        return [(pos, rnd.choice([1.0, 0.5, 1 / 3, 2.25])) for pos in positions], \
+            [(pos, rnd.randint(1, 5)) for pos in positions]
+
+    def compare(self, name, old_function, new_function, pos_val):
+        self.assertEqual(old_function(pos_val), new_function(pos_val))
+        old = min(timeit.repeat(lambda: old_function(pos_val), number=1, repeat=3))
+        new = min(timeit.repeat(lambda: new_function(pos_val), number=1, repeat=3))
+        print('\n{} for {} positions: bisect {:.3f} s, current {:.3f} s ({:.1f}x)'.format(
+            name, len(pos_val), old, new, old / new))
+
+    def test_benchmark(self):
+        rnd = random.Random(42)
+        for size in [10 ** 5, 10 ** 6]:
+            float_group, int_group = self.make_group(size, rnd)
+            self.compare('_sum_within_window (float)', sum_within_window_bisect,
+                         sigxls._sum_within_window, float_group)
+            self.compare('_sum_within_window_nopos (int)', sum_within_window_nopos_bisect,
+                         sigxls._sum_within_window_nopos, int_group)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Benchmark iCount.mapping.xlsites._get_random_barcode.
+
+This script compares the speed of random barcode extraction with the previous
+(regular expression based) implementation on a set of typical read names. It
+also checks that both implementations return the same barcodes and count the
+same number of invalid and missing randomers.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import re
+import random
+import timeit
+import unittest
+from unittest import mock
+
+from iCount.mapping import xlsites
+
+
+def get_random_barcode_regex(query_name, metrics):
+    """Extract random barcode from ``query_name`` (previous implementation)."""
+    match = re.match(xlsites.RANDOM_BARCODE_REGEX, query_name)
+    if match:
+        barcode = match.group(1)
+    elif ':' in query_name:
+        barcode = query_name.rsplit(':', 1)[1]
+        if set(barcode) - xlsites.VALID_NUCLEOTIDES:
+            # invalid barcode characters
+            barcode = ''
+            metrics.invalidrandomer_recs += 1
+    else:
+        barcode = ''
+        metrics.norandomer_recs += 1
+
+    return barcode
+
+
+class TestBarcodeBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.names = []
+        for i in range(100000):
+            randomer = ''.join(rnd.choice('ACGTN') for _ in range(rnd.choice([5, 9])))
+            name = 'NB501240:60:HGTFKBGX3:1:11101:{}:{}'.format(rnd.randrange(30000), i)
+            kind = rnd.random()
+            if kind < 0.9:
+                name = '{}:rbc:{}'.format(name, randomer)
+            elif kind < 0.95:
+                name = '{}:rbc:{}/1'.format(name, randomer)
+            elif kind < 0.98:
+                name = '{}:{}'.format(name, randomer)
+            else:
+                name = 'read{}'.format(i)
+            self.names.append(name)
+
+    @staticmethod
+    def extract(function, names):
+        metrics = mock.MagicMock()
+        metrics.invalidrandomer_recs = 0
+        metrics.norandomer_recs = 0
+        barcodes = [function(name, metrics) for name in names]
+        return barcodes, metrics.invalidrandomer_recs, metrics.norandomer_recs
+
+    def test_benchmark(self):
+        self.assertEqual(
+            self.extract(xlsites._get_random_barcode, self.names),
+            self.extract(get_random_barcode_regex, self.names),
+        )
+
+        old = min(timeit.repeat(
+            lambda: self.extract(get_random_barcode_regex, self.names), number=1, repeat=3))
+        new = min(timeit.repeat(
+            lambda: self.extract(xlsites._get_random_barcode, self.names), number=1, repeat=3))
+        print('\nBarcode extraction for {} names: regex {:.3f} s, current {:.3f} s ({:.1f}x)'.format(
+            len(self.names), old, new, old / new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,18 @@
 # pylint: disable=missing-docstring, protected-access
 
+import random
+import shutil
 import unittest
 import warnings
+import functools
+from unittest import mock
 
 from iCount.analysis import annotate
 from iCount.tests.utils import make_file_from_list, make_list_from_file, get_temp_file_name
 
 
 def template(cross_links, annotation, subtype='biotype',
-             excluded_types=None):
+             excluded_types=None, native=False):
     """
     Utility function for testing iCount.analysis.annotate
 
@@ -25,6 +29,8 @@ def template(cross_links, annotation, subtype='biotype',
         List representation of cross-links file.
     annotation : list
         List representation of annotation file.
+    native : bool
+        Intersect with ``iCount.files.intervals`` instead of bedtools.
 
     Returns
     -------
@@ -36,7 +42,7 @@ def template(cross_links, annotation, subtype='biotype',
     annotation_file = make_file_from_list(annotation, extension='gtf.gz')
     out_file = get_temp_file_name(extension='bed.gz')
     annotate.annotate_cross_links(annotation_file, cross_links_file, out_file, subtype=subtype,
-                                  excluded_types=excluded_types)
+                                  excluded_types=excluded_types, native=native)
     return make_list_from_file(out_file, fields_separator='\t')
 
 
@@ -192,5 +198,43 @@ class TestAnnotateCrossLinks(unittest.TestCase):
             cross_links, annotation, excluded_types=['intron']), expected)
 
 
+class TestAnnotateCrossLinksNative(TestAnnotateCrossLinks):
+    """Run the same tests with ``iCount.files.intervals`` instead of bedtools."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(__name__ + '.template', functools.partial(template, native=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipIf(shutil.which('bedtools') is None, 'bedtools is not installed')
+class TestAnnotateEngines(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_same_as_bedtools(self):
+        rnd = random.Random(3)
+        cross_links = []
+        for pos in rnd.sample(range(1000), 300):
+            cross_links.append([rnd.choice(['1', '2']), pos, pos + 1, '.', rnd.randint(1, 5), rnd.choice('+-')])
+        annotation = []
+        for i in range(100):
+            start = rnd.randrange(1, 1000)
+            annotation.append([rnd.choice(['1', '2']), '.', rnd.choice(['CDS', 'intron', 'UTR3']), start,
+                               start + rnd.randint(0, 200), '.', rnd.choice('+-'), '.',
+                               'biotype "B{}";'.format(i % 7)])
+        cross_links_file = make_file_from_list(cross_links, extension='bed')
+        annotation_file = make_file_from_list(annotation, extension='gtf')
+
+        results = []
+        for native in [False, True]:
+            out_file = get_temp_file_name(extension='bed')
+            annotate.annotate_cross_links(annotation_file, cross_links_file, out_file, native=native)
+            results.append(make_list_from_file(out_file, fields_separator='\t'))
+        self.assertEqual(results[0], results[1])
+
+
 if __name__ == '__main__':
     unittest.main()
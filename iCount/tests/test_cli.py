@@ -289,11 +289,12 @@ class TestCLI(unittest.TestCase):
         strange = get_temp_file_name(extension='.bam')
 
         command_basic = [
-            'iCount', 'xlsites', self.bam, unique, multi, strange,
+            'iCount', 'xlsites', self.bam, unique, multi,
             '-S', '40',  # Supress lower than ERROR messages.
         ]
         command_full = [
-            'iCount', 'xlsites', self.bam, unique, multi, strange,
+            'iCount', 'xlsites', self.bam, unique, multi,
+            '--skipped', strange,
             '--group_by', 'start',
             '--quant', 'cDNA',
             '--mapq_th', '0',
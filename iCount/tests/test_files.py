@@ -2,9 +2,15 @@
 
 import os
 import gzip
+import random
+import shutil
 import unittest
 import tempfile
 import warnings
+from unittest import mock
+
+import numpy
+import pybedtools
 
 import iCount
 from iCount.tests.utils import get_temp_file_name, make_file_from_list, make_list_from_file
@@ -236,5 +242,298 @@ class TestBedGraph(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+
+class TestNpz(unittest.TestCase):
+
+    def test_save_load(self):
+        fname = get_temp_file_name(extension='npz')
+        iCount.files.npz.save_sites(fname, {
+            'single': {
+                'chr2': ([5], [0], [1.0], [2]),
+                'chr10': ([20, 20, 100], [0, 1, 0], [1.5, 0.5, 3.0], [2, 1, 3]),
+            },
+            'multi': {},
+        })
+
+        sites = iCount.files.npz.load_sites(fname, 'single')
+        self.assertEqual(sites['chrom'].tolist(), ['chr10', 'chr10', 'chr10', 'chr2'])
+        self.assertEqual(sites['strand'].tolist(), ['+', '-', '+', '+'])
+        self.assertEqual(sites['pos'].tolist(), [20, 20, 100, 5])
+        self.assertEqual(sites['cdna'].tolist(), [1.5, 0.5, 3.0, 1.0])
+        self.assertEqual(sites['reads'].tolist(), [2, 1, 3, 2])
+        self.assertEqual(sites['pos'].dtype, 'int32')
+        self.assertEqual(sites['cdna'].dtype, 'float32')
+
+        sites = iCount.files.npz.load_sites(fname, 'multi')
+        self.assertEqual(sites['pos'].size, 0)
+
+        with self.assertRaisesRegex(ValueError, 'No sites named "other"'):
+            iCount.files.npz.load_sites(fname, 'other')
+
+    def test_writer(self):
+        fname = get_temp_file_name(extension='npz')
+        writer = iCount.files.npz.SitesWriter(fname, ['single', 'multi'])
+        writer.write('single', 'chr2', ([5], [0], [1.0], [2]))
+        writer.write('multi', 'chr2', ([5, 7], [0, 1], [1.0, 2.0], [2, 3]))
+        writer.write('single', 'chr10', ([20, 20], [0, 1], [1.5, 0.5], [2, 1]))
+        writer.write('single', 'chr1', ([], [], [], []))
+        writer.close()
+
+        sites = iCount.files.npz.load_sites(fname, 'single')
+        self.assertEqual(sites['chrom'].tolist(), ['chr10', 'chr10', 'chr2'])
+        self.assertEqual(sites['strand'].tolist(), ['+', '-', '+'])
+        self.assertEqual(sites['pos'].tolist(), [20, 20, 5])
+        self.assertEqual(sites['cdna'].tolist(), [1.5, 0.5, 1.0])
+        self.assertEqual(sites['reads'].tolist(), [2, 1, 2])
+        sites = iCount.files.npz.load_sites(fname, 'multi')
+        self.assertEqual(sites['chrom'].tolist(), ['chr2', 'chr2'])
+        self.assertEqual(sites['strand'].tolist(), ['+', '-'])
+        self.assertEqual(sites['reads'].tolist(), [2, 3])
+        with numpy.load(fname) as data:
+            self.assertEqual(data['chroms'].tolist(), ['chr1', 'chr10', 'chr2'])
+
+    def test_write_bed(self):
+        fname = get_temp_file_name(extension='npz')
+        iCount.files.npz.save_sites(fname, {
+            'single': {
+                'chr2': ([5], [0], [1.0], [2]),
+                'chr10': ([20, 20], [0, 1], [1.5, 1 / 3], [2, 1]),
+            },
+        })
+        bed = iCount.files.npz.write_bed(fname, 'single', get_temp_file_name(extension='bed.gz'))
+        self.assertEqual(make_list_from_file(bed, fields_separator='\t'), [
+            ['chr10', '20', '21', '.', '1.5', '+'],
+            ['chr10', '20', '21', '.', '0.3333', '-'],
+            ['chr2', '5', '6', '.', '1', '+'],
+        ])
+        bed = iCount.files.npz.write_bed(fname, 'single', get_temp_file_name(extension='bed'), value='reads')
+        self.assertEqual([line[4] for line in make_list_from_file(bed, fields_separator='\t')], ['2', '1', '2'])
+
+
+def intersect_brute_force(a, b, s=False, wa=False, wb=False, wo=False, v=False):
+    """Intersect lists of BED6 intervals by checking all pairs."""
+    results = []
+    for a_int in a:
+        hits = [b_int for b_int in b if a_int[0] == b_int[0] and a_int[1] < b_int[2] and b_int[1] < a_int[2] and
+                (not s or a_int[5] == b_int[5])]
+        if v:
+            if not hits:
+                results.append(tuple(map(str, a_int)))
+            continue
+        for b_int in hits:
+            start, end = max(a_int[1], b_int[1]), min(a_int[2], b_int[2])
+            record = list(a_int) if wa or wo else [a_int[0], start, end] + list(a_int[3:])
+            if wb or wo:
+                record += list(b_int)
+            if wo:
+                record.append(end - start)
+            results.append(tuple(map(str, record)))
+    return results
+
+
+class TestIntervals(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.a, self.b = [], []
+        for data, max_size in [(self.a, 5), (self.b, 300)]:
+            for _ in range(300):
+                start = rnd.randrange(1000)
+                data.append([rnd.choice(['1', '2']), start, start + rnd.randint(1, max_size), '.',
+                             str(rnd.randint(1, 5)), rnd.choice('+-')])
+            data.sort(key=lambda x: (x[0], x[1]))
+        self.a_file = make_file_from_list(self.a, bedtool=False)
+        self.b_file = make_file_from_list(self.b, bedtool=False)
+
+    def test_read_intervals(self):
+        intervals = iCount.files.intervals.read_intervals(self.a_file)
+        self.assertEqual(sorted(intervals), ['1', '2'])
+        columns = intervals['1']
+        a_1 = [item for item in self.a if item[0] == '1']
+        self.assertEqual(columns['start'].tolist(), [item[1] for item in a_1])
+        self.assertEqual(columns['end'].tolist(), [item[2] for item in a_1])
+        self.assertEqual(columns['strand'].tolist(), [item[5] for item in a_1])
+        self.assertEqual(columns['lines'][0], '\t'.join(map(str, a_1[0])))
+        self.assertEqual(columns['format'], 'bed')
+
+        fname = make_file_from_list([['1', '.', 'CDS', '11', '20', '.', '-', '.', 'gene_id "G1";']], bedtool=False)
+        columns = iCount.files.intervals.read_intervals(fname)['1']
+        self.assertEqual((columns['start'].tolist(), columns['end'].tolist()), ([10], [20]))
+        self.assertEqual(columns['format'], 'gtf')
+
+        fname = make_file_from_list([['1', 'a', 'b']], bedtool=False)
+        with self.assertRaisesRegex(ValueError, 'Unknown interval format'):
+            iCount.files.intervals.read_intervals(fname)
+
+    def test_sort_intervals(self):
+        fname = make_file_from_list([
+            ['2', 5, 6, '.', '1', '+'],
+            ['1', 30, 31, '.', '2', '-'],
+            ['1', 10, 11, '.', '3', '+'],
+            ['1', 10, 12, '.', '4', '-'],
+        ], bedtool=False)
+        intervals = iCount.files.intervals.sort_intervals(iCount.files.intervals.read_intervals(fname))
+        self.assertEqual(list(intervals), ['1', '2'])
+        self.assertEqual(intervals['1']['start'].tolist(), [10, 10, 30])
+        self.assertEqual(intervals['1']['end'].tolist(), [11, 12, 31])
+        self.assertEqual(intervals['1']['strand'].tolist(), ['+', '-', '-'])
+        self.assertEqual([line.split('\t')[4] for line in intervals['1']['lines']], ['3', '4', '2'])
+        self.assertEqual([line[:-2] for line in iCount.files.intervals.intersect(intervals, fname, s=True, wa=True)],
+                         [('1', '10', '11', '.'), ('1', '10', '12', '.'), ('1', '30', '31', '.'),
+                          ('2', '5', '6', '.')])
+
+    def test_same_as_brute_force(self):
+        b_intervals = iCount.files.intervals.read_intervals(self.b_file)
+        for options in [{}, {'wa': True}, {'wb': True}, {'wa': True, 'wb': True}, {'wo': True}, {'v': True}]:
+            for stranded in [False, True]:
+                self.assertEqual(
+                    list(iCount.files.intervals.intersect(self.a_file, b_intervals, s=stranded, **options)),
+                    intersect_brute_force(self.a, self.b, s=stranded, **options),
+                )
+
+    def test_chunks(self):
+        expected = list(iCount.files.intervals.intersect(self.b_file, self.a_file, wo=True))
+        with mock.patch('iCount.files.intervals.PAIRS_CHUNK_SIZE', 3):
+            self.assertEqual(list(iCount.files.intervals.intersect(self.b_file, self.a_file, wo=True)), expected)
+        self.assertEqual(expected, intersect_brute_force(self.b, self.a, wo=True))
+
+    def test_gtf(self):
+        gtf = make_file_from_list([
+            ['1', '.', 'CDS', '11', '20', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'UTR3', '21', '30', '.', '+', '.', 'gene_id "G1";'],
+        ], bedtool=False)
+        bed = make_file_from_list([
+            ['1', '9', '10', '.', '1', '+'],
+            ['1', '10', '11', '.', '2', '+'],
+            ['1', '15', '25', '.', '3', '+'],
+            ['1', '15', '16', '.', '4', '-'],
+        ], bedtool=False)
+        self.assertEqual(list(iCount.files.intervals.intersect(gtf, bed, s=True)), [
+            ('1', '.', 'CDS', '11', '11', '.', '+', '.', 'gene_id "G1";'),
+            ('1', '.', 'CDS', '16', '20', '.', '+', '.', 'gene_id "G1";'),
+            ('1', '.', 'UTR3', '21', '25', '.', '+', '.', 'gene_id "G1";'),
+        ])
+        self.assertEqual(list(iCount.files.intervals.intersect(bed, gtf, s=True, v=True)), [
+            ('1', '9', '10', '.', '1', '+'),
+            ('1', '15', '16', '.', '4', '-'),
+        ])
+        self.assertEqual(len(list(iCount.files.intervals.intersect(bed, gtf, v=True))), 1)
+        self.assertEqual(list(iCount.files.intervals.intersect(bed, gtf, s=True, wb=True, chroms=['2', '1']))[0],
+                         ('1', '10', '11', '.', '2', '+', '1', '.', 'CDS', '11', '20', '.', '+', '.', 'gene_id "G1";'))
+
+    def test_missing_chromosome(self):
+        other = make_file_from_list([['3', '1', '2', '.', '1', '+']], bedtool=False)
+        self.assertEqual(list(iCount.files.intervals.intersect(other, self.b_file)), [])
+        self.assertEqual(list(iCount.files.intervals.intersect(other, self.b_file, v=True)),
+                         [('3', '1', '2', '.', '1', '+')])
+
+
+
+@unittest.skipIf(shutil.which('bedtools') is None, 'bedtools is not installed')
+class TestIntervalsBedtools(unittest.TestCase):
+    """Compare records of ``iCount.files.intervals.intersect`` and ``bedtools intersect``."""
+
+    def setUp(self):
+        rnd = random.Random(7)
+        sites, annotation = [], []
+        for _ in range(500):
+            pos = rnd.randrange(2000)
+            sites.append([rnd.choice(['1', '2', '3']), pos, pos + 1, '.', str(rnd.randint(1, 5)),
+                          rnd.choice('+-.')])
+        for i in range(200):
+            start = rnd.randrange(1, 2000)
+            annotation.append([rnd.choice(['1', '2']), '.', rnd.choice(['CDS', 'intron', 'gene']), start,
+                               start + rnd.randint(0, 300), '.', rnd.choice('+-.'), '.',
+                               'gene_id "G{}";'.format(i)])
+        sites.sort(key=lambda x: (x[0], x[1]))
+        annotation.sort(key=lambda x: (x[0], x[3]))
+        self.sites = make_file_from_list(sites, bedtool=False)
+        self.annotation = make_file_from_list(annotation, bedtool=False)
+
+    def bedtools(self, a, b, **options):
+        overlaps = pybedtools.BedTool(a).intersect(pybedtools.BedTool(b), sorted=True, nonamecheck=True, **options)
+        return [tuple(interval.fields) for interval in overlaps.saveas()]
+
+    def test_same_as_bedtools(self):
+        for a, b in [(self.sites, self.annotation), (self.annotation, self.sites)]:
+            for options in [{'wb': True}, {'wa': True, 'wb': True}, {'wo': True}, {'v': True}]:
+                for stranded in [False, True]:
+                    options['s'] = stranded
+                    self.assertEqual(
+                        list(iCount.files.intervals.intersect(a, b, **options)), self.bedtools(a, b, **options),
+                        msg=str(options))
+
+
+class TestIcidx(unittest.TestCase):
+
+    def setUp(self):
+        self.gtf = get_temp_file_name(extension='gtf.gz')
+        with gzip.open(self.gtf, 'wt') as handle:
+            for line in [
+                    ['2', '.', 'CDS', '31', '40', '.', '+', '.', 'biotype "mRNA"; gene_name "DEF"; gene_id "G2";'],
+                    ['1', '.', 'UTR3', '21', '30', '.', '+', '.', 'biotype "mRNA";gene_name "ABC";gene_id "G1";'],
+                    ['1', '.', 'intron', '11', '20', '.', '+', '.', 'biotype "lncRNA";gene_name "ABD";gene_id "G1";'],
+                    ['1', '.', 'intergenic', '1', '100', '.', '-', '.', 'gene_id ".";'],
+            ]:
+                handle.write('\t'.join(line) + '\n')
+
+    def test_index_fname(self):
+        self.assertEqual(iCount.files.icidx.index_fname('/a/b/regions.gtf.gz'), '/a/b/regions.icidx')
+        self.assertEqual(iCount.files.icidx.index_fname('/a/b/segmentation.gtf'), '/a/b/segmentation.icidx')
+        self.assertEqual(iCount.files.icidx.index_fname('/a/b/annot'), '/a/b/annot.icidx')
+
+    def test_write_load(self):
+        self.assertIsNone(iCount.files.icidx.load_index(self.gtf))
+        fname = iCount.files.icidx.write_index(self.gtf)
+        self.assertEqual(fname, iCount.files.icidx.index_fname(self.gtf))
+
+        index = iCount.files.icidx.load_index(self.gtf)
+        self.assertEqual(index['types'], ['CDS', 'UTR3', 'intron', 'intergenic'])
+        self.assertEqual(index['biotypes'], ['mRNA', 'lncRNA', ''])
+        self.assertEqual(index['genes'], ['G2', 'G1', '.'])
+        self.assertEqual(index['gene_names'], ['DEF', 'ABD', ''])
+        self.assertEqual(sorted(index['groups']), [('1', '+'), ('1', '-'), ('2', '+')])
+
+        group = index['groups'][('1', '+')]
+        self.assertEqual(group['start'].tolist(), [10, 20])
+        self.assertEqual(group['stop'].tolist(), [20, 30])
+        self.assertEqual(group['type'].tolist(), [2, 1])
+        self.assertEqual(group['biotype'].tolist(), [1, 0])
+        self.assertEqual(group['gene'].tolist(), [1, 1])
+        self.assertEqual(group['line'].tolist(), [2, 1])
+        self.assertIsInstance(index['start'], numpy.memmap)
+        self.assertEqual(index['start'].tolist(), [10, 20, 0, 30])
+
+    def test_mismatch(self):
+        iCount.files.icidx.write_index(self.gtf)
+        with gzip.open(self.gtf, 'at') as handle:
+            handle.write('\t'.join(['3', '.', 'CDS', '1', '10', '.', '+', '.', 'gene_id "G3";']) + '\n')
+        self.assertIsNone(iCount.files.icidx.load_index(self.gtf))
+
+        with open(iCount.files.icidx.index_fname(self.gtf), 'wb') as handle:
+            handle.write(b'not an index')
+        self.assertIsNone(iCount.files.icidx.load_index(self.gtf))
+
+    def test_checksum_skipped(self):
+        iCount.files.icidx.write_index(self.gtf)
+        with mock.patch('iCount.files.icidx.checksum') as checksum_mock:
+            self.assertIsNotNone(iCount.files.icidx.load_index(self.gtf))
+            self.assertFalse(checksum_mock.called)
+
+        # Same content with different modification time:
+        stat = os.stat(self.gtf)
+        os.utime(self.gtf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with mock.patch('iCount.files.icidx.checksum', wraps=iCount.files.icidx.checksum) as checksum_mock:
+            self.assertIsNotNone(iCount.files.icidx.load_index(self.gtf))
+            self.assertTrue(checksum_mock.called)
+
+    def test_empty(self):
+        gtf = make_file_from_list([], bedtool=False, extension='gtf')
+        iCount.files.icidx.write_index(gtf)
+        index = iCount.files.icidx.load_index(gtf)
+        self.assertEqual(index['groups'], {})
+        self.assertEqual(index['start'].size, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -224,6 +224,27 @@ class TestSummaryTemplates(unittest.TestCase):
             ['G2', 'DEF', '20'],
         ])
 
+    def test_index(self):
+        segmentation = make_file_from_list([
+            ['1', '.', 'intergenic', '1', '10', '.', '+', '.', 'gene_id ".";'],
+            ['1', '.', 'UTR3', '11', '20', '.', '+', '.', 'biotype "mRNA";gene_name "ABC";gene_id "G1";'],
+            ['1', '.', 'intron', '21', '30', '.', '-', '.', 'biotype "lncRNA";gene_name "ABD";gene_id "G1";'],
+            ['2', '.', 'CDS', '31', '40', '.', '+', '.', 'biotype "mRNA";gene_name "DEF";gene_id "G2";'],
+            ['1', '.', 'intron', '41', '53', '.', '+', '.', 'biotype "sRNA,lncRNA,miRNA";gene_id "G2";'],
+            ['1', '.', 'ncRNA', '5', '7', '.', '+', '.', 'biotype "lncRNA";gene_name "X";gene_id "G3";'],
+        ], bedtool=False, extension='gtf')
+        out_dir, index_dir = get_temp_dir(), get_temp_dir()
+        segment.summary_templates(segmentation, out_dir)
+
+        iCount.files.icidx.write_index(segmentation)
+        with patch('iCount.genomes.segment._gtf_templates') as gtf_mock:
+            segment.summary_templates(segmentation, index_dir)
+            self.assertFalse(gtf_mock.called)
+
+        for template in [segment.TEMPLATE_TYPE, segment.TEMPLATE_SUBTYPE, segment.TEMPLATE_GENE]:
+            self.assertEqual(make_list_from_file(os.path.join(index_dir, template)),
+                             make_list_from_file(os.path.join(out_dir, template)))
+
 
 class TestMakeRegionsFile(unittest.TestCase):
 
@@ -281,6 +302,12 @@ class TestMakeRegionsFile(unittest.TestCase):
                 ';'.join(sorted(exp[8].split(';'))),
             )
 
+        # Regions are the same, if borders are intersected with segmentation without bedtools:
+        native_dir = get_temp_dir()
+        segment.make_regions(segmentation_file, native_dir, native=True)
+        self.assertEqual(
+            make_list_from_file(os.path.join(native_dir, segment.REGIONS_FILE), fields_separator='\t'), results)
+
 
 class TestOtherFunctions(unittest.TestCase):
 
@@ -937,6 +964,59 @@ class TestGetRegions(unittest.TestCase):
 
         self.assertEqual(expected, gtf_out_data)
 
+    def test_processes(self):
+        gtf_in_data = []
+        for i in range(7):
+            start = 1000 * i + 400
+            gtf_in_data.extend([
+                ['1', '.', 'gene', start, start + 100, '.', '+', '.', 'gene_id "G{}";'.format(i)],
+                ['1', '.', 'transcript', start, start + 100, '.', '+', '.',
+                 'gene_id "G{0}"; transcript_id "T{0}";'.format(i)],
+                ['1', '.', 'exon', start, start + 30, '.', '+', '.',
+                 'gene_id "G{0}"; transcript_id "T{0}"; exon_number "1";'.format(i)],
+                ['1', '.', 'CDS', start + 10, start + 30, '.', '+', '.',
+                 'gene_id "G{0}"; transcript_id "T{0}";'.format(i)],
+                ['1', '.', 'exon', start + 70, start + 100, '.', '+', '.',
+                 'gene_id "G{0}"; transcript_id "T{0}"; exon_number "2";'.format(i)],
+                ['1', '.', 'CDS', start + 70, start + 90, '.', '+', '.',
+                 'gene_id "G{0}"; transcript_id "T{0}";'.format(i)],
+            ])
+        gtf_in_file = make_file_from_list(gtf_in_data)
+        genome_file = make_file_from_list([['1', '10000']], bedtool=False)
+
+        gtf_out = get_temp_file_name(extension='gtf')
+        metrics = segment.get_segments(gtf_in_file, gtf_out, genome_file)
+        expected = make_list_from_file(gtf_out, fields_separator='\t')
+        self.assertEqual(metrics.genes, 7)
+
+        gtf_out = get_temp_file_name(extension='gtf')
+        with patch('iCount.genomes.segment.GENE_BATCH_SIZE', 2):
+            metrics = segment.get_segments(gtf_in_file, gtf_out, genome_file, processes=3)
+        self.assertEqual(make_list_from_file(gtf_out, fields_separator='\t'), expected)
+        self.assertEqual(metrics.genes, 7)
+
+
+class TestProcessGeneBatch(unittest.TestCase):
+
+    def test_batches(self):
+        self.assertEqual(list(segment._batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(segment._batches([], 2)), [])
+
+    def test_temp_files_removed(self):
+        temp_files = []
+
+        def process_gene(gene_content):
+            temp_files.append(BedTool([gene_content['gene']]).saveas().fn)
+            return [gene_content['gene'].fields]
+
+        gene = create_interval_from_list(['1', '.', 'gene', '1', '10', '.', '+', '.', 'gene_id "G1";'])
+        with patch('iCount.genomes.segment._process_gene', side_effect=process_gene):
+            self.assertEqual(segment._process_gene_batch([{'gene': gene}, {'gene': gene}]), [
+                [gene.fields], [gene.fields],
+            ])
+        self.assertEqual(len(temp_files), 2)
+        self.assertFalse(any(os.path.exists(fname) for fname in temp_files))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,502 @@
+# pylint: disable=missing-docstring, protected-access
+
+import time
+import random
+import shutil
+import unittest
+from collections import Counter
+from unittest import mock
+
+import numpy
+import pybedtools
+
+import iCount
+from iCount.analysis import sigxls
+from iCount.tests.utils import get_temp_file_name, make_file_from_list, make_list_from_file
+
+
+def rnd_cumulative_probs_loop(size, total_hits, half_window, perms):
+    """Compute cumulative probabilities one permutation at a time."""
+    rnd_ps = numpy.zeros((perms, total_hits + 1))
+    for i in range(perms):
+        rnd_hits = Counter(numpy.random.randint(size, size=total_hits))
+        scores_cww = sigxls._sum_within_window_nopos(rnd_hits.items(), half_window=half_window)
+        rnd_ps[i, :] = sigxls.cumulative_prob(scores_cww, total_hits)
+    return rnd_ps
+
+
+class TestSumWithinWindow(unittest.TestCase):
+
+    def test_sum_within_window(self):
+        sites1 = [
+            (10, 1), (11, 1), (12, 1), (20, 2),
+        ]
+        summed_sites_w1 = [
+            (10, 2), (11, 3), (12, 2), (20, 2),
+        ]
+        sites2 = [
+            (10, 1), (11, 1), (12, 1), (13, 1), (14, 1), (15, 1), (20, 2),
+        ]
+        summed_sites_w3 = [
+            (10, 4), (11, 5), (12, 6), (13, 6), (14, 5), (15, 4), (20, 2),
+        ]
+
+        self.assertEqual(sigxls._sum_within_window([]), [])
+
+        self.assertEqual(
+            sigxls._sum_within_window(sites1, half_window=1), summed_sites_w1)
+        self.assertEqual(
+            sigxls._sum_within_window(sites2, half_window=3), summed_sites_w3)
+
+        # shuffle the input:
+        sites3 = [
+            (12, 1), (10, 1), (20, 2), (11, 1),
+        ]
+        summed_sites_w1_2 = [
+            (12, 2), (10, 2), (20, 2), (11, 3),
+        ]
+        self.assertEqual(
+            sigxls._sum_within_window(sites3, half_window=1), summed_sites_w1_2)
+
+    def test_sum_within_window_types(self):
+        result = sigxls._sum_within_window([(10, 1), (11, 2)], half_window=1)
+        self.assertEqual([type(val) for _, val in result], [int, int])
+
+        # Floats are summed in the same order as with built-in sum:
+        sites = [(10, 0.1), (11, 0.2), (12, 0.3)]
+        result = sigxls._sum_within_window(sites, half_window=2)
+        self.assertEqual(result, [(10, 0.1 + 0.2 + 0.3), (11, 0.1 + 0.2 + 0.3), (12, 0.1 + 0.2 + 0.3)])
+        self.assertEqual([type(val) for _, val in result], [float, float, float])
+
+    def test_sum_within_window_nopos(self):
+        sites = [
+            (10, 1), (11, 1), (12, 1), (13, 1), (14, 1), (15, 1), (20, 2),
+        ]
+        summed_sites_w1 = [2, 3, 3, 3, 3, 2, 2]
+        summed_sites_w3 = [4, 5, 6, 6, 5, 4, 2]
+
+        self.assertEqual(sigxls._sum_within_window_nopos([]), [])
+
+        self.assertEqual(
+            sigxls._sum_within_window_nopos(sites, half_window=1), summed_sites_w1)
+        self.assertEqual(
+            sigxls._sum_within_window_nopos(sites, half_window=3), summed_sites_w3)
+        # Unsorted input:
+        self.assertEqual(
+            sigxls._sum_within_window_nopos(sites[::-1], half_window=3), summed_sites_w3)
+
+
+class TestCumulativeProb(unittest.TestCase):
+
+    def test_cumulative_prob(self):
+        vals = [2, 3, 3, 3, 2]
+        max_val = 5
+
+        expected = [1., 1., 1., 0.6, 0., 0.]
+        result = list(sigxls.cumulative_prob(vals, max_val))
+        self.assertEqual(expected, result)
+
+
+class TestRndDistrib(unittest.TestCase):
+
+    def setUp(self):
+        sigxls.PS_CACHE.clear()
+
+    def test_get_avg_rnd_distrib(self):
+        size = 5
+        total_hits = 5
+        perms = 10000
+
+        expected = [1., 1., 1., 0.86, 0.63, 0.30]
+        result = sigxls.get_avg_rnd_distrib(size, total_hits, 1, perms=perms)
+        # Repeat the same call, so also lines that use cache are executed:
+        result = sigxls.get_avg_rnd_distrib(size, total_hits, 1, perms=perms)
+
+        self.assertEqual(len(result), total_hits + 1)
+        for res, exp, in zip(result, expected):
+            self.assertAlmostEqual(res, exp, delta=0.02)
+
+    def test_same_as_loop(self):
+        # Dense (small groups) and sparse (large groups) counting, in one or
+        # in many chunks:
+        for size, total_hits, half_window in [(5, 5, 1), (30, 60, 3), (1000, 20, 3), (10 ** 6, 50, 5)]:
+            for chunk_size in [sigxls.PERMUTATION_CHUNK_SIZE, 100]:
+                numpy.random.seed(42)
+                expected = rnd_cumulative_probs_loop(size, total_hits, half_window, 50)
+                numpy.random.seed(42)
+                with mock.patch('iCount.analysis.sigxls.PERMUTATION_CHUNK_SIZE', chunk_size):
+                    result = sigxls._rnd_cumulative_probs(size, total_hits, half_window, 50)
+                # Columns above the largest SWW score are not stored:
+                numpy.testing.assert_array_equal(result, expected[:, :result.shape[1]])
+                self.assertFalse(expected[:, result.shape[1]:].any())
+
+
+def group_overlaps_intervals(fname, group_by, multi_mode):
+    """Group overlaps, iterating through pybedtools.Interval objects."""
+    groups, group_sizes = {}, {}
+    for feature in pybedtools.BedTool(fname):
+        group_id = feature.attrs[group_by]
+        if multi_mode:
+            group_id = feature[2] + '_' + group_id
+        key = (feature.chrom, feature.strand, group_id, feature.name)
+        groups.setdefault(key, []).append((int(feature.fields[10]), float(feature.fields[13])))
+        group_sizes.setdefault(key, set()).add((feature.start, feature.stop))
+    return groups, group_sizes
+
+
+class TestGroupOverlaps(unittest.TestCase):
+
+    def test_parse_attributes(self):
+        for attr_str in ['gene_id "G1"; transcript_id "T1";', 'gene_id "G1"; gene_name "A B"',
+                         'ID=g1;Name=N1;Parent=p1', ' gene_id  "G1" ; ', '']:
+            self.assertEqual(sigxls._parse_attributes(attr_str), dict(pybedtools.cbedtools.Attributes(attr_str)))
+
+    def test_same_as_intervals(self):
+        gene1 = ['1', '.', 'gene', '11', '100', '.', '+', '.', 'gene_id "G1"; gene_name "N1";']
+        gene2 = ['1', '.', 'gene', '51', '200', '.', '+', '.', 'gene_id "G2";']
+        cds = ['1', '.', 'CDS', '51', '60', '.', '+', '.', 'gene_id "G2"; transcript_id "T2";']
+        intron = ['1', '.', 'intron', '61', '70', '.', '+', '.', 'gene_id "G2"; transcript_id "T2";']
+        gene3 = ['2', '.', 'gene', '1', '50', '.', '-', '.', 'gene_id "G3"; transcript_id "T3";']
+        overlaps = make_file_from_list([
+            gene1 + ['1', '20', '21', '.', '3', '+', '1'],
+            gene1 + ['1', '55', '56', '.', '1.5', '+', '1'],
+            gene2 + ['1', '55', '56', '.', '1.5', '+', '1'],
+            gene2 + ['1', '150', '151', '.', '2', '+', '1'],
+            cds + ['1', '55', '56', '.', '1.5', '+', '1'],
+            intron + ['1', '65', '66', '.', '4', '+', '1'],
+            gene3 + ['2', '9', '10', '.', '1', '-', '1'],
+        ], bedtool=False)
+
+        for group_by, multi_mode in [('gene_id', False), ('gene_id', True)]:
+            with open(overlaps) as handle:
+                groups, group_sizes = sigxls._group_overlaps(sigxls._split_lines(handle), group_by, multi_mode)
+            self.assertEqual((groups, group_sizes), group_overlaps_intervals(overlaps, group_by, multi_mode))
+
+        with open(overlaps) as handle:
+            groups, group_sizes = sigxls._group_overlaps(sigxls._split_lines(handle), 'gene_id', False)
+        self.assertEqual(groups[('1', '+', 'G1', 'N1')], [(20, 3.0), (55, 1.5)])
+        self.assertEqual(groups[('1', '+', 'G2', 'T2')], [(55, 1.5), (65, 4.0)])
+        self.assertEqual(group_sizes[('1', '+', 'G2', 'T2')], {(50, 60), (60, 70)})
+
+        with self.assertRaises(KeyError):
+            with open(overlaps) as handle:
+                sigxls._group_overlaps(sigxls._split_lines(handle), 'transcript_id', False)
+
+
+class TestNullModels(unittest.TestCase):
+
+    def setUp(self):
+        sigxls.PS_CACHE.clear()
+
+    def test_analytic(self):
+        size, total_hits = 5000, 300
+        result = sigxls.get_analytic_distrib(size, total_hits, 3)
+        self.assertEqual(len(result), total_hits + 1)
+        self.assertEqual(result[:2], [1.0, 1.0])
+        expected = sigxls.get_avg_rnd_distrib(size, total_hits, 3, perms=300, rnd_seed=42)
+        for res, exp in zip(result, expected):
+            self.assertAlmostEqual(res, exp, delta=0.01)
+
+        self.assertEqual(sigxls.get_analytic_distrib(size, 0, 3), [1.0])
+
+    def test_get_background(self):
+        sigxls._get_background(1234, 56, 3, 100, rnd_seed=42, null_model='analytic')
+        sigxls._get_background(999, 56, 3, 100, rnd_seed=42, null_model='analytic')
+        self.assertEqual(list(sigxls.PS_CACHE), [(42, 999, 56, 3, 100)])
+
+
+class TestBackgroundCache(unittest.TestCase):
+
+    def setUp(self):
+        sigxls.PS_CACHE.clear()
+        self.fname = get_temp_file_name(extension='sqlite')
+
+    def test_get_put(self):
+        cache = sigxls._BackgroundCache(self.fname)
+        self.assertIsNone(cache.get((42, 10, 3, 1, 100)))
+        cache.put((42, 10, 3, 1, 100), [1.0, 0.5, 0.25, 0.0])
+        cache.close()
+
+        cache = sigxls._BackgroundCache(self.fname)
+        self.assertEqual(cache.get((42, 10, 3, 1, 100)), [1.0, 0.5, 0.25, 0.0])
+        self.assertIsNone(cache.get((42, 10, 3, 1, 1000)))
+        # Distributions are drawn with given random seed:
+        self.assertIsNone(cache.get((1, 10, 3, 1, 100)))
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru(self):
+        cache = sigxls._BackgroundCache(self.fname, max_entries=2)
+        for size in [10, 20, 30]:
+            cache.put((42, size, 3, 1, 100), [1.0, 0.5, 0.0, 0.0])
+            time.sleep(0.01)
+        cache.close()
+
+        cache = sigxls._BackgroundCache(self.fname, max_entries=2)
+        self.assertIsNone(cache.get((42, 10, 3, 1, 100)))
+        self.assertIsNotNone(cache.get((42, 20, 3, 1, 100)))
+        cache.put((42, 40, 3, 1, 100), [1.0, 0.5, 0.0, 0.0])
+        cache.close()
+
+        # Distribution for size 30 was used least recently:
+        cache = sigxls._BackgroundCache(self.fname, max_entries=2)
+        self.assertIsNone(cache.get((42, 30, 3, 1, 100)))
+        self.assertIsNotNone(cache.get((42, 20, 3, 1, 100)))
+        self.assertIsNotNone(cache.get((42, 40, 3, 1, 100)))
+        cache.close()
+
+    def test_shared(self):
+        cache1 = sigxls._BackgroundCache(self.fname)
+        cache2 = sigxls._BackgroundCache(self.fname)
+        cache1.put((42, 10, 3, 1, 100), [1.0, 0.5, 0.0, 0.0])
+        # Distribution is visible to other process before first cache is closed:
+        self.assertEqual(cache2.get((42, 10, 3, 1, 100)), [1.0, 0.5, 0.0, 0.0])
+        cache2.put((42, 20, 3, 1, 100), [1.0, 0.25, 0.0, 0.0])
+        self.assertEqual(cache1.get((42, 20, 3, 1, 100)), [1.0, 0.25, 0.0, 0.0])
+        cache1.put((42, 30, 3, 1, 100), [1.0, 0.0, 0.0, 0.0])
+        cache2.close()
+        cache1.close()
+        self.assertEqual((cache1.hits, cache2.hits), (1, 1))
+
+        cache = sigxls._BackgroundCache(self.fname)
+        for size in [10, 20, 30]:
+            self.assertIsNotNone(cache.get((42, size, 3, 1, 100)))
+        cache.close()
+
+    @mock.patch('iCount.analysis.sigxls.BG_CACHE_TIMEOUT', 0.01)
+    def test_locked(self):
+        cache = sigxls._BackgroundCache(self.fname)
+        cache.put((42, 10, 3, 1, 100), [1.0, 0.5, 0.0, 0.0])
+
+        locking = sigxls.sqlite3.connect(self.fname)
+        locking.execute('BEGIN EXCLUSIVE')
+        # Distributions can be read while other process is writing, but writes are skipped:
+        self.assertIsNotNone(cache.get((42, 10, 3, 1, 100)))
+        with self.assertLogs(sigxls.LOGGER, 'WARNING'):
+            cache.put((42, 20, 3, 1, 100), [1.0, 0.25, 0.0, 0.0])
+            cache.close()
+        locking.rollback()
+        locking.close()
+
+        cache = sigxls._BackgroundCache(self.fname)
+        self.assertIsNotNone(cache.get((42, 10, 3, 1, 100)))
+        self.assertIsNone(cache.get((42, 20, 3, 1, 100)))
+        cache.close()
+
+    def test_unusable(self):
+        with open(self.fname, 'wb') as handle:
+            handle.write(b'not a database' * 100)
+        for fname in ['/nonexistent/dir/bg.sqlite', self.fname]:
+            with self.assertLogs(sigxls.LOGGER, 'WARNING'):
+                cache = sigxls._BackgroundCache(fname)
+            # Distributions are computed without cache:
+            self.assertIsNone(cache.get((42, 10, 3, 1, 100)))
+            cache.put((42, 10, 3, 1, 100), [1.0, 0.5, 0.0, 0.0])
+            self.assertIsNone(cache.get((42, 10, 3, 1, 100)))
+            cache.close()
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_get_avg_rnd_distrib(self):
+        cache = sigxls._BackgroundCache(self.fname)
+        expected = sigxls.get_avg_rnd_distrib(50, 10, 3, perms=100, bg_cache=cache, rnd_seed=42)
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        sigxls.PS_CACHE.clear()
+        cache = sigxls._BackgroundCache(self.fname)
+        with mock.patch('iCount.analysis.sigxls._rnd_cumulative_probs') as rnd_mock:
+            self.assertEqual(sigxls.get_avg_rnd_distrib(50, 10, 3, perms=100, bg_cache=cache, rnd_seed=42), expected)
+            self.assertFalse(rnd_mock.called)
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+
+class TestProcessGroups(unittest.TestCase):
+
+    def setUp(self):
+        sigxls.PS_CACHE.clear()
+        rnd = numpy.random.RandomState(0)
+        self.groups, self.group_sizes = {}, {}
+        for i in range(12):
+            key = ('chr1', '+', 'G{}'.format(i), 'gene')
+            size = int(rnd.randint(50, 500))
+            positions = sorted(rnd.choice(size, size=rnd.randint(1, 20), replace=False) + 1000 * i)
+            self.groups[key] = [(int(pos), float(rnd.randint(1, 5))) for pos in positions]
+            self.group_sizes[key] = size
+        # Groups with same size and number of hits share random distribution:
+        self.groups[('chr1', '-', 'G0', 'gene')] = self.groups[('chr1', '+', 'G0', 'gene')]
+        self.group_sizes[('chr1', '-', 'G0', 'gene')] = self.group_sizes[('chr1', '+', 'G0', 'gene')]
+
+    def process(self, threads=1, bg_cache=None, **kwargs):
+        cache = sigxls._BackgroundCache(bg_cache) if bg_cache else None
+        results = sigxls._process_groups(
+            self.groups, self.group_sizes, 3, 100, 42, cache=cache, threads=threads, **kwargs)
+        if cache is not None:
+            cache.close()
+        return {key: sorted(values) for key, values in results.items()}, cache
+
+    def test_reproducible(self):
+        expected, _ = self.process()
+        self.assertEqual(len(expected), sum(len(hits) for hits in self.groups.values()))
+
+        # Results do not depend on state of global random generator:
+        sigxls.PS_CACHE.clear()
+        numpy.random.seed(1)
+        self.assertEqual(self.process()[0], expected)
+
+        # ... or on number of processes:
+        sigxls.PS_CACHE.clear()
+        self.assertEqual(self.process(threads=3)[0], expected)
+
+    def test_task_background(self):
+        key = ('chr1', '+', 'G1', 'gene')
+        task = (key, self.groups[key], self.group_sizes[key], 3, 100, 42, 'permutation')
+        _, processed, background = sigxls._process_group_task(task)
+        self.assertIsNotNone(background)
+        # Background is only returned by task that computed it:
+        self.assertEqual(sigxls._process_group_task(task), (key, processed, None))
+
+        cache_key = sigxls._background_key(self.groups[key], self.group_sizes[key], 3, 100, 42, 'permutation')
+        sigxls.PS_CACHE.clear()
+        sigxls._init_worker({cache_key: background})
+        self.assertEqual(sigxls._process_group_task(task), (key, processed, None))
+
+    def test_null_models(self):
+        expected, _ = self.process()
+        results, _ = self.process(null_model='analytic')
+        self.assertEqual(set(results), set(expected))
+
+    def test_bg_cache(self):
+        fname = get_temp_file_name(extension='sqlite')
+        expected, cache = self.process(bg_cache=fname, threads=2)
+        self.assertEqual((cache.hits, cache.misses), (0, 12))
+
+        sigxls.PS_CACHE.clear()
+        with mock.patch('iCount.analysis.sigxls._rnd_cumulative_probs') as rnd_mock:
+            results, cache = self.process(bg_cache=fname)
+            self.assertFalse(rnd_mock.called)
+        self.assertEqual(results, expected)
+        self.assertEqual((cache.hits, cache.misses), (12, 0))
+
+        # Distributions loaded from cache are passed to worker processes:
+        sigxls.PS_CACHE.clear()
+        with mock.patch('iCount.analysis.sigxls._rnd_cumulative_probs') as rnd_mock:
+            results, cache = self.process(bg_cache=fname, threads=2)
+            self.assertFalse(rnd_mock.called)
+        self.assertEqual(results, expected)
+
+
+class TestChromBlocks(unittest.TestCase):
+
+    def test_blocks(self):
+        fname = make_file_from_list([
+            ['1', '10', '11', '.', '1', '+'],
+            ['1', '20', '21', '.', '2', '+'],
+            ['2', '5', '6', '.', '3', '-'],
+            ['10', '7', '8', '.', '4', '+'],
+            ['2', '9', '10', '.', '5', '-'],
+        ], bedtool=False)
+        blocks = sigxls._chrom_blocks(fname)
+        self.assertEqual(sorted(blocks), ['1', '10', '2'])
+        self.assertEqual(len(blocks['2']), 2)
+
+        self.assertEqual([line.split('\t')[4] for line in sigxls._read_blocks(fname, blocks['1'])], ['1', '2'])
+        self.assertEqual([line.split('\t')[4] for line in sigxls._read_blocks(fname, blocks['2'])], ['3', '5'])
+        self.assertEqual(list(sigxls._read_blocks(fname, [])), [])
+
+        self.assertEqual(sigxls._chrom_blocks(make_file_from_list([], bedtool=False)), {})
+
+
+class TestAddNotAnnotated(unittest.TestCase):
+
+    def test_add(self):
+        annotated = (0.01, 'N1', 'G1', 4.0, 5.0)
+        results = {('1', 10, '+'): [annotated]}
+        lines = [
+            '1\t10\t11\t.\t4\t+\n',
+            '1\t10\t11\t.\t3\t-\n',
+            '1\t12\t13\t.\t2.5\t+\n',
+        ]
+        self.assertEqual(sigxls._add_not_annotated(lines, results), 2)
+        self.assertEqual(results, {
+            ('1', 10, '+'): [annotated],
+            ('1', 10, '-'): [(1.0, 'not_annotated', 'not_annotated', '3', 'not_calculated')],
+            ('1', 12, '+'): [(1.0, 'not_annotated', 'not_annotated', '2.5', 'not_calculated')],
+        })
+
+        with self.assertRaises(AssertionError):
+            sigxls._add_not_annotated(['1\t10\t12\t.\t4\t+\n'], results)
+
+
+class TestWriteResults(unittest.TestCase):
+
+    def test_write(self):
+        results = {
+            ('1', 20, '+'): [(0.5, 'G2', 'G2', 2.0, 3.0)],
+            ('1', 10, '+'): [(0.01, 'N1', 'G1', 4.0, 5.0), (0.01, 'N2', 'G2', 4.0, 6.0)],
+            ('1', 10, '-'): [(1.0, 'not_annotated', 'not_annotated', '7', 'not_calculated')],
+        }
+        sigxls_fname = get_temp_file_name(extension='bed')
+        scores_fname = get_temp_file_name(extension='tsv')
+        with open(sigxls_fname, 'wt') as sigxls_out, open(scores_fname, 'wt') as scores_out:
+            self.assertEqual(sigxls._write_results(results, sigxls_out, scores_out, 0.05), 1)
+
+        with open(sigxls_fname) as handle:
+            self.assertEqual(handle.read(), '1\t10\t11\tN1,N2-G1,G2\t4\t+\n')
+        with open(scores_fname) as handle:
+            self.assertEqual(handle.read(), ''.join([
+                '1\t10\t+\tN1\tG1\t4\t5\t0.01\n',
+                '1\t10\t+\tN2\tG2\t4\t6\t0.01\n',
+                '1\t10\t-\tnot_annotated\tnot_annotated\t7\tnot_calculated\t1\n',
+                '1\t20\t+\tG2\tG2\t2\t3\t0.5\n',
+            ]))
+
+
+@unittest.skipIf(shutil.which('bedtools') is None, 'bedtools is not installed')
+class TestRunEngines(unittest.TestCase):
+
+    def test_same_as_bedtools(self):
+        rnd = random.Random(11)
+        annotation = []
+        for i in range(30):
+            start = rnd.randrange(1, 5000)
+            annotation.append(['1', '.', 'gene', start, start + rnd.randint(100, 1000), '.', rnd.choice('+-'), '.',
+                               'gene_id "G{}"; gene_name "N{}";'.format(i, i)])
+        sites = [['1', pos, pos + 1, '.', rnd.randint(1, 9), rnd.choice('+-')]
+                 for pos in rnd.sample(range(6000), 800)]
+        annotation_file = make_file_from_list(annotation, extension='gtf')
+        sites_file = make_file_from_list(sites, extension='bed')
+
+        results = []
+        for native in [False, True]:
+            sigxls.PS_CACHE.clear()
+            out_file = get_temp_file_name(extension='bed')
+            scores_file = get_temp_file_name(extension='tsv')
+            sigxls.run(annotation_file, sites_file, out_file, scores=scores_file, native=native)
+            results.append((make_list_from_file(out_file, fields_separator='\t'),
+                            make_list_from_file(scores_file, fields_separator='\t')))
+        self.assertEqual(results[0], results[1])
+
+    def test_npz_sites(self):
+        annotation = [['1', '.', 'gene', 10, 300, '.', '+', '.', 'gene_id "G1"; gene_name "N1";']]
+        sites = [['1', 20, 21, '.', 3, '+'], ['1', 20, 21, '.', 1, '-'], ['1', 22, 23, '.', 2, '+']]
+        annotation_file = make_file_from_list(annotation, extension='gtf')
+        sites_file = make_file_from_list(sites, extension='bed')
+        npz_file = get_temp_file_name(extension='npz')
+        iCount.files.npz.save_sites(npz_file, {
+            'single': {'1': ([20, 20, 22], [0, 1, 0], [3, 1, 2], [3, 1, 2])},
+            'multi': {'1': ([20], [0], [1], [1])},
+        })
+
+        results = []
+        for fname in [sites_file, npz_file]:
+            sigxls.PS_CACHE.clear()
+            out_file = get_temp_file_name(extension='bed')
+            scores_file = get_temp_file_name(extension='tsv')
+            sigxls.run(annotation_file, fname, out_file, scores=scores_file)
+            results.append(make_list_from_file(scores_file, fields_separator='\t'))
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 # pylint: disable=missing-docstring, protected-access
 import os
+import random
+import shutil
 import unittest
 import warnings
 
@@ -10,6 +12,8 @@ from iCount.tests.utils import make_file_from_list, make_list_from_file, get_tem
 
 class TestMakeSummaryReport(unittest.TestCase):
 
+    native = False
+
     def setUp(self):
         warnings.simplefilter("ignore", ResourceWarning)
         self.out_dir = get_temp_dir()
@@ -23,7 +27,7 @@ class TestMakeSummaryReport(unittest.TestCase):
         cross_links_file = make_file_from_list(cross_links)
 
         segment.summary_templates(annotation_file, self.out_dir)
-        summary.summary_reports(annotation_file, cross_links_file, self.out_dir, self.out_dir)
+        summary.summary_reports(annotation_file, cross_links_file, self.out_dir, self.out_dir, native=self.native)
         return [
             make_list_from_file(os.path.join(self.out_dir, segment.SUMMARY_TYPE), '\t'),
             make_list_from_file(os.path.join(self.out_dir, segment.SUMMARY_SUBTYPE), '\t'),
@@ -166,5 +170,34 @@ class TestMakeSummaryReport(unittest.TestCase):
         ]))
 
 
+class TestMakeSummaryReportNative(TestMakeSummaryReport):
+    """Run the same tests with ``iCount.files.intervals`` instead of bedtools."""
+
+    native = True
+
+
+@unittest.skipIf(shutil.which('bedtools') is None, 'bedtools is not installed')
+class TestIntersectEngines(unittest.TestCase):
+
+    def test_same_as_bedtools(self):
+        rnd = random.Random(5)
+        cross_links = sorted(
+            [[rnd.choice(['1', '2']), pos, pos + 1, '.', rnd.randint(1, 5), rnd.choice('+-.')]
+             for pos in rnd.sample(range(1000), 300)], key=lambda x: (x[0], x[1]))
+        annotation = []
+        for i in range(100):
+            start = rnd.randrange(1, 1000)
+            annotation.append([rnd.choice(['1', '2']), '.', 'CDS', start, start + rnd.randint(0, 200), '.',
+                               rnd.choice('+-.'), '.', 'gene_id "G{}";'.format(i)])
+        annotation.sort(key=lambda x: (x[0], x[3]))
+        cross_links_file = make_file_from_list(cross_links, bedtool=False)
+        annotation_file = make_file_from_list(annotation, bedtool=False)
+
+        for stranded in [False, True]:
+            self.assertEqual(
+                [tuple(record) for record in summary._intersect(cross_links_file, annotation_file, s=stranded)],
+                list(summary._intersect(cross_links_file, annotation_file, native=True, s=stranded)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,20 @@
 # pylint: disable=missing-docstring, protected-access
 
+import os
+import re
+import random
+import tempfile
 import warnings
+import threading
 import unittest
 from unittest import mock
 
-import pybedtools
+import pysam
+
+import iCount
 
 from iCount.mapping import xlsites
-from iCount.tests.utils import get_temp_file_name, make_bam_file
+from iCount.tests.utils import get_temp_file_name, make_bam_file, make_file_from_list
 
 
 class TestGetRandomBarcode(unittest.TestCase):
@@ -19,6 +26,19 @@ class TestGetRandomBarcode(unittest.TestCase):
         name = xlsites._get_random_barcode('_____:rbc:AAA:____', mock.MagicMock())
         self.assertEqual(name, 'AAA')
 
+    def test_same_as_regex(self):
+        for query_name in ['_:rbc:AAA', '_:rbc:CC:rbc:GGT/1', '_:rbc:ACG:rbc:', '_:rbc:TTX:rbc:x', ':rbc:']:
+            metrics = mock.MagicMock()
+            metrics.invalidrandomer_recs = 0
+            match = re.match(xlsites.RANDOM_BARCODE_REGEX, query_name)
+            expected = match.group(1) if match else ''
+            self.assertEqual(xlsites._get_random_barcode(query_name, metrics), expected)
+
+    def test_interned(self):
+        name1 = xlsites._get_random_barcode(''.join(['r1:rbc:', 'ACGT']), mock.MagicMock())
+        name2 = xlsites._get_random_barcode(''.join(['r2:rbc:', 'ACGT']), mock.MagicMock())
+        self.assertIs(name1, name2)
+
     def test_no_rbc_key_valid_nucs(self):
         metrics = mock.MagicMock()
         name = xlsites._get_random_barcode('_____:AAA', metrics)
@@ -39,28 +59,27 @@ class TestGetRandomBarcode(unittest.TestCase):
         self.assertEqual(metrics.norandomer_recs, 1)
 
 
-class TestUpdate(unittest.TestCase):
+class TestSiteCounts(unittest.TestCase):
 
-    def setUp(self):
-        warnings.simplefilter("ignore", ResourceWarning)
+    def test_sum_and_sort(self):
+        counts = xlsites._SiteCounts()
+        counts.add('-', {30: (0.5, 1), 10: (1.0, 2)})
+        counts.add('+', {30: (1.0, 1)})
+        counts.add('-', {30: (0.25, 1)})
+        self.assertEqual(len(counts), 4)
 
-    def test_match_basic(self):
-        cur_vals = {
-            'A': [1, 2, 3],
-            'B': [4, 5, 0],
-        }
-        to_add = {
-            'A': [1, 0, 1],
-            'C': [42, 2, 3],
-        }
+        positions, cdna, reads = counts.reduce('-')
+        self.assertEqual(positions.tolist(), [10, 30])
+        self.assertEqual(cdna.tolist(), [1.0, 0.75])
+        self.assertEqual(reads.tolist(), [2, 2])
 
-        expected = {
-            'A': [2, 2, 4],
-            'B': [4, 5, 0],
-            'C': [42, 2, 3],
-        }
-        xlsites._update(cur_vals, to_add)
-        self.assertEqual(expected, cur_vals)
+        self.assertEqual(list(counts.sites(0)), [(10, '-', 1.0), (30, '+', 1.0), (30, '-', 0.75)])
+        self.assertEqual(list(counts.sites(1)), [(10, '-', 2), (30, '+', 1), (30, '-', 2)])
+
+    def test_empty(self):
+        counts = xlsites._SiteCounts()
+        self.assertEqual(len(counts), 0)
+        self.assertEqual(list(counts.sites(0)), [])
 
 
 class TestCollapse(unittest.TestCase):
@@ -159,37 +178,156 @@ class TestCollapse(unittest.TestCase):
         self.assertEqual(result2, expected2)
 
 
+class TestCollapseSingleMulti(unittest.TestCase):
+
+    def test_same_as_collapse(self):
+        by_bc = {
+            'AAAAA': [
+                # (middle_pos, end_pos, read_len, num_mapped, second_start)
+                (5, 10, 10, 1, 0),
+                (5, 10, 30, 1, 0),
+                (40, 80, 80, 8, 0),
+                (5, 30, 20, 1, 20),
+            ],
+            'CCCCC': [
+                (5, 10, 10, 1, 0),
+                (25, 30, 10, 10, 0),
+                (25, 30, 10, 100, 0),
+            ],
+        }
+        for group_by_index, group_by in enumerate(['start', 'middle', 'end']):
+            single, multi = xlsites._collapse_single_multi(1, by_bc, group_by_index, 10)
+            self.assertEqual(single, xlsites._collapse(1, by_bc, group_by, multimax=1))
+            self.assertEqual(multi, xlsites._collapse(1, by_bc, group_by, multimax=10))
+
+        single, multi = xlsites._collapse_single_multi(1, by_bc, 0, 10)
+        self.assertEqual(single, {1: (3.0, 4)})
+        self.assertAlmostEqual(multi[1][0], 1 + 1 / 6 + 1 / 4 + 1 / 2 + 1 / 20)
+        self.assertEqual(multi[1][1], 6)
+
+
+class TestClusterBarcodes(unittest.TestCase):
+
+    def setUp(self):
+        hit = (5, 10, 10, 1, 0)
+        self.by_bc = {
+            'AAAA': [hit] * 10,
+            'AAAC': [hit] * 4,
+            'AACC': [hit] * 2,
+            'AACG': [hit] * 1,
+            'GGGG': [hit] * 3,
+            'GGGN': [hit] * 1,
+            'GGG': [hit] * 1,
+        }
+
+    def test_encode_barcode(self):
+        self.assertEqual(xlsites._encode_barcode('A'), 0b100)
+        self.assertEqual(xlsites._encode_barcode('CT'), 0b10111)
+        self.assertIsNone(xlsites._encode_barcode('ACN'))
+        self.assertIsNone(xlsites._encode_barcode(''))
+
+    def test_directional(self):
+        by_bc, merged = xlsites._cluster_barcodes(self.by_bc, 'directional')
+        # AAAC (4) is absorbed by AAAA (10), AACC (2) by AAAC and AACG (1) by AACC.
+        # Barcodes with N and of other length are not merged.
+        self.assertEqual({barcode: len(hits) for barcode, hits in by_bc.items()},
+                         {'AAAA': 17, 'GGGG': 3, 'GGGN': 1, 'GGG': 1})
+        self.assertEqual(merged, 3)
+
+    def test_adjacency(self):
+        by_bc, merged = xlsites._cluster_barcodes(self.by_bc, 'adjacency')
+        self.assertEqual({barcode: len(hits) for barcode, hits in by_bc.items()},
+                         {'AAAA': 14, 'AACC': 3, 'GGGG': 3, 'GGGN': 1, 'GGG': 1})
+        self.assertEqual(merged, 2)
+
+    def test_directional_count_ratio(self):
+        hit = (5, 10, 10, 1, 0)
+        by_bc, merged = xlsites._cluster_barcodes({'AAAA': [hit] * 3, 'AAAC': [hit] * 3}, 'directional')
+        self.assertEqual(merged, 0)
+        self.assertEqual(by_bc, {'AAAA': [hit] * 3, 'AAAC': [hit] * 3})
+
+
+class TestLoadSegmentation(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_basic(self):
+        seg = make_file_from_list([
+            ['1', '.', 'gene', '51', '350', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '101', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'CDS', '101', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intron', '201', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intergenic', '351', '400', '.', '-', '.', 'gene_id "."; transcript_id ".";'],
+            ['2', '.', 'gene', '11', '20', '.', '-', '.', 'gene_id "G2";'],
+        ], bedtool=False, extension='gtf')
+        borders = xlsites._load_segmentation(seg)
+        self.assertEqual(borders, {
+            ('1', '+'): frozenset([100, 200, 350]),
+            ('1', '-'): frozenset([200, 300, 400]),
+            ('2', '+'): frozenset(),
+            ('2', '-'): frozenset(),
+        })
+
+        self.assertEqual(xlsites._chrom_borders(borders, '2'), {
+            ('2', '+'): frozenset(),
+            ('2', '-'): frozenset(),
+        })
+
+    def test_index(self):
+        seg = make_file_from_list([
+            ['1', '.', 'gene', '51', '350', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '101', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'CDS', '101', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intron', '201', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intergenic', '351', '400', '.', '-', '.', 'gene_id "."; transcript_id ".";'],
+            ['2', '.', 'gene', '11', '20', '.', '-', '.', 'gene_id "G2";'],
+        ], bedtool=False, extension='gtf')
+        expected = xlsites._load_segmentation(seg)
+
+        iCount.files.icidx.write_index(seg)
+        with mock.patch('iCount.mapping.xlsites.pybedtools.BedTool') as bedtool_mock:
+            self.assertEqual(xlsites._load_segmentation(seg), expected)
+            self.assertFalse(bedtool_mock.called)
+
+        # Index of a different file is not used:
+        with open(seg, 'at') as handle:
+            handle.write('\t'.join(['3', '.', 'CDS', '1', '10', '.', '+', '.', 'gene_id "G3";']) + '\n')
+        self.assertIn(('3', '+'), xlsites._load_segmentation(seg))
+
+    def test_get_borders_cached(self):
+        seg = make_file_from_list([
+            ['1', '.', 'CDS', '101', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+        ], bedtool=False, extension='gtf')
+        borders = xlsites._get_borders(seg)
+        self.assertEqual(borders, {('1', '+'): frozenset([100]), ('1', '-'): frozenset([200])})
+        with mock.patch('iCount.mapping.xlsites._load_segmentation') as load_mock:
+            self.assertIs(xlsites._get_borders(seg), borders)
+            self.assertFalse(load_mock.called)
+        self.assertEqual(xlsites._chrom_borders(borders, '3'), {})
+
+
 class TestIntersectsWithAnnotaton(unittest.TestCase):
 
     def setUp(self):
         warnings.simplefilter("ignore", ResourceWarning)
 
     def test_pos_strand(self):
-        segmentation = {
-            'gene_id_001': {
-                'tr_id_0001': [
-                    mock.MagicMock(start=100),
-                ],
-                'gene_segment': [],
-            }
-        }
+        borders = {(1, '+'): frozenset([100]), (1, '-'): frozenset()}
         self.assertTrue(
-            xlsites._intersects_with_annotaton(100, segmentation, 1, '+'))
+            xlsites._intersects_with_annotaton(100, borders, 1, '+'))
+        self.assertFalse(
+            xlsites._intersects_with_annotaton(101, borders, 1, '+'))
+        # Other chromosome:
         self.assertFalse(
-            xlsites._intersects_with_annotaton(101, segmentation, 1, '+'))
+            xlsites._intersects_with_annotaton(100, borders, 2, '+'))
 
     def test_neg_strand(self):
-        segmentation = {
-            'gene_id_002': {
-                'tr_id_0003': [
-                    mock.MagicMock(stop=100),
-                ]
-            },
-        }
+        borders = {(2, '+'): frozenset(), (2, '-'): frozenset([100])}
         self.assertTrue(
-            xlsites._intersects_with_annotaton(100, segmentation, 2, '-'))
+            xlsites._intersects_with_annotaton(100, borders, 2, '-'))
         self.assertFalse(
-            xlsites._intersects_with_annotaton(101, segmentation, 2, '-'))
+            xlsites._intersects_with_annotaton(101, borders, 2, '-'))
 
 
 class TestSecondStart(unittest.TestCase):
@@ -200,23 +338,10 @@ class TestSecondStart(unittest.TestCase):
         warnings.simplefilter("ignore", ResourceWarning)
 
     def test_second_start_segmentation(self):
+        # Borders of exon 100-200 on "+" and exon 50-100 on "-" strand:
         segmentation = {
-            'G001': {
-                'gene_segment': [],
-                'T0001': [
-                    pybedtools.create_interval_from_list(
-                        ['1', '.', 'exon', '100', '200', '.', '+', '.',
-                         'gene_id: "G001"', 'transcript_id: "T0001"']),
-                ],
-            },
-            'G002': {
-                'gene_segment': [],
-                'T0002': [
-                    pybedtools.create_interval_from_list(
-                        ['1', '.', 'exon', '50', '100', '.', '-', '.',
-                         'gene_id: "G001"', 'transcript_id: "T0001"']),
-                ],
-            },
+            (1, '+'): frozenset([99, 49]),
+            (1, '-'): frozenset([200, 100]),
         }
 
         second_start, _ = xlsites._second_start(
@@ -248,6 +373,80 @@ class TestSecondStart(unittest.TestCase):
         self.assertFalse(is_strange)
 
 
+def get_read_data_positions(read, metrics, segmentation=None, gap_th=4):
+    """Reference implementation of ``_get_read_data``, using list of all aligned positions."""
+    poss = read.get_reference_positions()
+    if read.is_reverse:
+        strand = '-'
+        xlink_pos = poss[-1] + 1
+        end_pos = poss[0]
+    else:
+        strand = '+'
+        xlink_pos = max(poss[0] - 1, 1)
+        end_pos = poss[-1]
+
+    second_start, is_strange = xlsites._second_start(
+        read, poss, strand, read.reference_name, segmentation, gap_th)
+    idx = read.query_length // 2 - 1 if (strand == '-' and read.query_length % 2 == 0) \
+        else read.query_length // 2
+    middle_pos = poss[idx]
+
+    barcode = xlsites._get_random_barcode(read.query_name, metrics)
+    return (xlink_pos, barcode, is_strange, strand, middle_pos, end_pos, read.query_length,
+            read.get_tag('NH'), second_start)
+
+
+class TestGetReadData(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    @staticmethod
+    def random_cigar(rnd):
+        cigar = [(4, rnd.randint(1, 5))] if rnd.random() < 0.2 else []
+        for i in range(rnd.choice([1, 1, 2, 3, 5])):
+            if i:
+                cigar.append((rnd.choice([1, 2, 2, 3, 3]), rnd.randint(1, 300)))
+            cigar.append((rnd.choice([0, 0, 0, 7, 8]), rnd.choice([1, 2, rnd.randint(1, 60)])))
+        if rnd.random() < 0.2:
+            cigar.append((4, rnd.randint(1, 40)))
+        return cigar
+
+    def test_same_as_positions(self):
+        """
+        Randomized alignments give same result as list of aligned positions.
+        """
+        rnd = random.Random(42)
+        segments = []
+        for i in range(2000):
+            segments.append(('r{}:rbc:AC'.format(i), rnd.choice([0, 16]), 0, rnd.randrange(0, 2000),
+                             255, self.random_cigar(rnd), {'NH': 1}))
+        segments.sort(key=lambda segment: segment[3])
+        bam_fname = make_bam_file({'chromosomes': [('chr1', 5000)], 'segments': segments}, rnd_seed=0)
+
+        borders = {('chr1', '+'): frozenset(range(0, 5000, 3)), ('chr1', '-'): frozenset(range(0, 5000, 2))}
+        compared = 0
+        with pysam.AlignmentFile(bam_fname) as bamfile:
+            for read in bamfile:
+                for segmentation in [None, borders]:
+                    metrics = xlsites.iCount.Metrics(context='test')
+                    xlsites._init_bam_metrics(metrics)
+                    try:
+                        expected = get_read_data_positions(read, metrics, segmentation, gap_th=10)
+                    except (IndexError, ValueError) as error:
+                        with self.assertRaises(type(error)):
+                            xlsites._get_read_data(read, metrics, 0, segmentation, gap_th=10)
+                        continue
+                    result = xlsites._get_read_data(read, metrics, 0, segmentation, gap_th=10)
+                    self.assertEqual(result, expected, msg=read.cigarstring)
+                    # Blocks, computed by ``_fetch``, give the same result:
+                    result = xlsites._get_read_data(read, metrics, 0, segmentation, gap_th=10,
+                                                    blocks=read.get_blocks())
+                    self.assertEqual(result, expected, msg=read.cigarstring)
+                    compared += 1
+        self.assertGreater(compared, 2000)
+
+
 class TestProcessBamFile(unittest.TestCase):
 
     def setUp(self):
@@ -346,6 +545,257 @@ class TestProcessBamFile(unittest.TestCase):
         ]
         self.assertEqual(grouped, expected)
 
+    @mock.patch('iCount.mapping.xlsites.FLUSH_WINDOW', 100)
+    def test_flush_window(self):
+        """
+        Positions behind the window are yielded before the end of chromosome.
+        """
+        bam_fname = make_bam_file({
+            'chromosomes': [('chr1', 3000)],
+            'segments': [
+                # (qname, flag, refname, pos, mapq, cigar, tags)
+                ('_:rbc:AAA', 0, 0, 50, 255, [(0, 101)], {'NH': 1}),
+                ('_:rbc:CCC', 0, 0, 500, 255, [(0, 101)], {'NH': 1}),
+            ],
+        }, rnd_seed=0)
+        grouped = list(xlsites._processs_bam_file(bam_fname, self.metrics, 10, self.tmp))
+
+        expected = [
+            (('chr1', '+'), 0.1667, {49: {'AAA': [(100, 150, 101, 1, 0)]}}),
+            (('chr1', '+'), 0.1667, {499: {'CCC': [(550, 600, 101, 1, 0)]}}),
+        ]
+        self.assertEqual(grouped, expected)
+
+
+class TestSkippedWriter(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.bam = make_bam_file({
+            'chromosomes': [('chr1', 3000)],
+            'segments': [
+                ('r{}'.format(i), 16 * (i % 2), 0, 10 * i, 255, [(0, 20), (3, 100), (0, 20)], {'NH': 1})
+                for i in range(50)
+            ],
+        }, rnd_seed=0)
+
+    @mock.patch('iCount.mapping.xlsites.SKIPPED_BATCH_SIZE', 7)
+    def test_background_bam(self):
+        fname = get_temp_file_name(extension='bam')
+        with pysam.AlignmentFile(self.bam) as bamfile:
+            writer = xlsites._SkippedWriter(fname, bamfile.header, background=True)
+            for read in bamfile:
+                writer.write(read)
+            writer.close()
+
+        with pysam.AlignmentFile(fname) as bamfile:
+            self.assertEqual([read.query_name for read in bamfile], ['r{}'.format(i) for i in range(50)])
+
+    def test_bed(self):
+        fname = get_temp_file_name(extension='bed.gz')
+        with pysam.AlignmentFile(self.bam) as bamfile:
+            writer = xlsites._SkippedWriter(fname, bamfile.header)
+            for read in bamfile:
+                writer.write(read)
+            writer.close()
+
+        with iCount.files.gz_open(fname, 'rt') as handle:
+            lines = [line.split() for line in handle]
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(lines[:2], [['chr1', '0', '140', 'r0', '255', '+'], ['chr1', '10', '150', 'r1', '255', '-']])
+
+    @mock.patch('iCount.mapping.xlsites.SKIPPED_BATCH_SIZE', 7)
+    def test_exception(self):
+        fname = get_temp_file_name(extension='bed')
+        with pysam.AlignmentFile(self.bam) as bamfile:
+            with self.assertRaises(KeyboardInterrupt):
+                with xlsites._SkippedWriter(fname, bamfile.header, background=True) as writer:
+                    for i, read in enumerate(bamfile):
+                        if i == 20:
+                            raise KeyboardInterrupt
+                        writer.write(read)
+        # Thread is stopped and reads, written before exception, are in file:
+        self.assertFalse(writer.thread.is_alive())
+        with open(fname, 'rt') as handle:
+            self.assertEqual([line.split()[3] for line in handle], ['r{}'.format(i) for i in range(20)])
+
+    def test_exception_in_quantification(self):
+        fname = get_temp_file_name(extension='bed')
+        metrics = xlsites.iCount.Metrics()
+        threads = threading.active_count()
+        with mock.patch('iCount.mapping.xlsites._get_read_data', side_effect=ValueError('Malformed read')):
+            with self.assertRaisesRegex(ValueError, 'Malformed read'):
+                list(xlsites._processs_bam_file(self.bam, metrics, 0, fname, skipped_background=True))
+        self.assertEqual(threading.active_count(), threads)
+        with open(fname, 'rt') as handle:
+            self.assertEqual(handle.read(), '')
+
+    def test_exception_in_parallel_quantification(self):
+        fname = get_temp_file_name(extension='bed')
+        tmp_dir = tempfile.mkdtemp()
+        metrics = xlsites.iCount.Metrics()
+        # Temporary files with skipped reads of chromosomes are created in ``tmp_dir``:
+        with mock.patch('iCount.TMP_ROOT', tmp_dir), \
+                mock.patch('iCount.mapping.xlsites._get_read_data', side_effect=ValueError('Malformed read')):
+            with self.assertRaisesRegex(ValueError, 'Malformed read'):
+                list(xlsites._quantify_parallel(self.bam, metrics, 0, fname, None, 4, 'start', 50, 2))
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_none(self):
+        with pysam.AlignmentFile(self.bam) as bamfile:
+            writer = xlsites._SkippedWriter(None, bamfile.header, background=True)
+            for read in bamfile:
+                writer.write(read)
+            writer.close()
+        self.assertIsNone(writer.thread)
+
+
+class TestMergeMetrics(unittest.TestCase):
+
+    def test_merge(self):
+        metrics = xlsites.iCount.Metrics(context='test', all_recs=3, bc_cn={'AAA': 1})
+        other = xlsites.iCount.Metrics(context='other', all_recs=2, strange_recs=1, bc_cn={'AAA': 2, 'CC': 1})
+        xlsites._merge_metrics(metrics, other)
+        self.assertEqual(metrics.context, 'test')
+        self.assertEqual(metrics.all_recs, 5)
+        self.assertEqual(metrics.strange_recs, 1)
+        self.assertEqual(metrics.bc_cn, {'AAA': 3, 'CC': 1})
+
+
+class TestQuantify(unittest.TestCase):
+
+    def test_chunks_summed(self):
+        """
+        Counts for same position from different chunks are summed.
+        """
+        chunks = [
+            (('chr1', '+'), 0.5, {10: {'AAA': [(30, 50, 40, 1, 0)]}}),
+            (('chr1', '+'), 1.0, {20: {'CCC': [(30, 40, 20, 1, 0)]}}),
+        ]
+        result = [(chrom, list(single.sites(0)), list(multi.sites(1)))
+                  for chrom, single, multi in xlsites._quantify(chunks, 'middle', 50)]
+        self.assertEqual(result, [('chr1', [(30, '+', 2.0)], [(30, '+', 2)])])
+
+
+class TestQuantifyParallel(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.bam = make_bam_file({
+            'chromosomes': [('chr1', 3000), ('chr2', 2000), ('chr3', 1000)],
+            'segments': [
+                ('r1:rbc:AAA', 0, 0, 50, 255, [(0, 30)], {'NH': 1}),
+                ('r2:rbc:AAA', 0, 0, 50, 255, [(0, 20), (3, 100), (0, 20)], {'NH': 1}),
+                ('r3:rbc:CCC', 16, 0, 60, 255, [(0, 30)], {'NH': 3}),
+                ('r4:rbc:GGG', 0, 1, 100, 255, [(0, 30)], {'NH': 1}),
+                ('r5:rbc:GGG', 16, 1, 120, 255, [(0, 20), (3, 100), (0, 20)], {'NH': 2}),
+                ('r6:rbc:TTT', 16, 1, 130, 255, [(0, 30)], {'NH': 1}),
+            ],
+        }, rnd_seed=0)
+
+    def test_same_as_sequential(self):
+        skipped1 = get_temp_file_name(extension='bam')
+        metrics1 = mock.MagicMock()
+        chunks = xlsites._processs_bam_file(self.bam, metrics1, 0, skipped1, gap_th=10)
+        expected = [(chrom, list(single.sites(0)), list(multi.sites(1)))
+                    for chrom, single, multi in xlsites._quantify(chunks, 'start', 50)]
+
+        skipped2 = get_temp_file_name(extension='bam')
+        metrics2 = xlsites.iCount.Metrics(context='test')
+        result = [(chrom, list(single.sites(0)), list(multi.sites(1)))
+                  for chrom, single, multi in xlsites._quantify_parallel(
+                      self.bam, metrics2, 0, skipped2, None, 10, 'start', 50, threads=2)]
+
+        self.assertEqual(result, expected)
+        self.assertEqual(metrics2.used_recs, metrics1.used_recs)
+        self.assertEqual(metrics2.strange_recs, 2)
+        self.assertEqual(metrics2.bc_cn, metrics1.bc_cn)
+        with pysam.AlignmentFile(skipped2) as bamfile:
+            self.assertEqual([read.query_name for read in bamfile], ['r2:rbc:AAA', 'r5:rbc:GGG'])
+
+
+class TestSitesWriter(unittest.TestCase):
+
+    def test_sorted_output(self):
+        fname = get_temp_file_name(extension='bed.gz')
+        chr1, chr2, chr10 = xlsites._SiteCounts(), xlsites._SiteCounts(), xlsites._SiteCounts()
+        chr1.add('+', {9: (2.0, 2)})
+        chr2.add('+', {5: (1.0, 2)})
+        chr10.add('-', {20: (0.5, 1)})
+        chr10.add('+', {100: (3.0, 3), 20: (1.0, 1)})
+        writer = xlsites._SitesWriter(fname, 0)
+        writer.write('chr2', chr2)
+        writer.write('chr10', chr10)
+        writer.write('chr1', chr1)
+        writer.close()
+
+        with iCount.files.gz_open(fname, 'rt') as handle:
+            self.assertEqual([line.split() for line in handle], [
+                ['chr1', '9', '10', '.', '2', '+'],
+                ['chr10', '20', '21', '.', '1', '+'],
+                ['chr10', '20', '21', '.', '0.5', '-'],
+                ['chr10', '100', '101', '.', '3', '+'],
+                ['chr2', '5', '6', '.', '1', '+'],
+            ])
+        self.assertEqual(writer.parts, {})
+
+
+class TestParseRegions(unittest.TestCase):
+
+    def test_parse(self):
+        bed = make_file_from_list([['chr2', '10', '20'], ['chr2', '15', '30'], ['chrX', '1', '2']], bedtool=False)
+        regions = xlsites._parse_regions(
+            ['chr1:1,001-2000', bed, 'chr3', 'chr1:1500-1600', 'chr1:2900-4000'],
+            {'chr1': 3000, 'chr2': 2000, 'chr3': 1000})
+        self.assertEqual(regions, {
+            'chr1': [(1000, 2000), (2899, 3000)],
+            'chr2': [(10, 30)],
+            'chr3': [(0, 1000)],
+        })
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, r'Invalid region: "chr1:100"'):
+            xlsites._parse_regions(['chr1:100'], {'chr1': 3000})
+        with self.assertRaisesRegex(ValueError, r'Chromosome "chr2" from region "chr2:1-10" is not in BAM file.'):
+            xlsites._parse_regions(['chr2:1-10'], {'chr1': 3000})
+
+
+class TestShardRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.chroms = ['chr1', 'chr2', 'chr3']
+        self.lengths = {'chr1': 1000, 'chr2': 500, 'chr3': 100}
+        self.regions = {chrom: [(0, length)] for chrom, length in self.lengths.items()}
+
+    def test_balanced(self):
+        mapped = {'chr1': 100, 'chr2': 100, 'chr3': 0}
+        shards = [xlsites._shard_regions(self.regions, self.chroms, self.lengths, mapped, '{}/4'.format(k))
+                  for k in range(1, 5)]
+        self.assertEqual(shards, [
+            {'chr1': [(0, 500)]},
+            {'chr1': [(500, 1000)]},
+            {'chr2': [(0, 250)]},
+            {'chr2': [(250, 500)], 'chr3': [(0, 100)]},
+        ])
+
+    def test_cover_all(self):
+        regions = {'chr1': [(10, 200), (300, 333)], 'chr3': [(5, 95)]}
+        mapped = {'chr1': 7, 'chr2': 3, 'chr3': 11}
+        for n in [1, 2, 5, 17]:
+            covered = []
+            for k in range(1, n + 1):
+                shard = xlsites._shard_regions(regions, self.chroms, self.lengths, mapped, '{}/{}'.format(k, n))
+                covered.extend((chrom, pos) for chrom, intervals in shard.items()
+                               for start, end in intervals for pos in range(start, end))
+            expected = [(chrom, pos) for chrom, intervals in regions.items()
+                        for start, end in intervals for pos in range(start, end)]
+            self.assertEqual(sorted(covered), sorted(expected))
+
+    def test_invalid(self):
+        for shard in ['0/3', '4/3', '1-3', 'a/b']:
+            with self.assertRaisesRegex(ValueError, 'Invalid shard'):
+                xlsites._shard_regions(self.regions, self.chroms, self.lengths, {}, shard)
+
 
 class TestRun(unittest.TestCase):
 
@@ -403,6 +853,160 @@ class TestRun(unittest.TestCase):
         # Strange counter:
         self.assertEqual(result.strange_recs, 1)
 
+    def test_run_shards(self):
+        """
+        Sites and records of all shards add up to the ones of whole BAM file.
+        """
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_fname = get_temp_file_name(extension='bed')
+        multi_fname = get_temp_file_name(extension='bed')
+        strange_fname = get_temp_file_name(extension='bam')
+
+        result = xlsites.run(bam_fname, unique_fname, multi_fname, strange_fname)
+        with open(multi_fname) as handle:
+            expected = handle.readlines()
+
+        sites, used_recs = [], 0
+        for shard in ['1/3', '2/3', '3/3']:
+            result_shard = xlsites.run(bam_fname, unique_fname, multi_fname, strange_fname, shard=shard)
+            used_recs += result_shard.used_recs
+            with open(multi_fname) as handle:
+                sites.extend(handle.readlines())
+        self.assertEqual(sites, expected)
+        self.assertEqual(used_recs, result.used_recs)
+
+    def test_run_skipped(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_fname = get_temp_file_name(extension='bed')
+        multi_fname = get_temp_file_name(extension='bed')
+        skipped_fname = get_temp_file_name(extension='bed')
+
+        result = xlsites.run(bam_fname, unique_fname, multi_fname, None)
+        # pylint: disable=no-member
+        self.assertEqual(result.strange_recs, 1)
+
+        for threads in [1, 2]:
+            result = xlsites.run(bam_fname, unique_fname, multi_fname, skipped_fname, threads=threads,
+                                 skipped_background=True)
+            self.assertEqual(result.strange_recs, 1)
+            with open(skipped_fname) as handle:
+                self.assertEqual(handle.readlines(), ['chr1\t100\t220\tname3:rbc:CCCC:\t20\t-\n'])
+
+    def test_run_umi(self):
+        self.data['segments'].extend([
+            ('name6:rbc:ACGT', 0, 1, 300, 20, [(0, 200)], {'NH': 1}),
+            ('name7:rbc:ACGA', 0, 1, 300, 20, [(0, 200)], {'NH': 1}),
+            ('name8:rbc:ACGA', 0, 1, 300, 20, [(0, 200)], {'NH': 1}),
+        ])
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_fname = get_temp_file_name(extension='bed')
+        multi_fname = get_temp_file_name(extension='bed')
+
+        for threads in [1, 2]:
+            result = xlsites.run(bam_fname, unique_fname, multi_fname, None, threads=threads,
+                                 umi_method='directional')
+            # pylint: disable=no-member
+            self.assertEqual(result.umi_merged_barcodes, 1)
+            with open(unique_fname) as handle:
+                self.assertEqual(handle.readlines(), ['chr2\t299\t300\t.\t1\t+\n'])
+
+    def test_run_npz(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_fname = get_temp_file_name(extension='bed')
+        multi_fname = get_temp_file_name(extension='bed')
+        strange_fname = get_temp_file_name(extension='bam')
+        npz_fname = get_temp_file_name(extension='npz')
+
+        xlsites.run(bam_fname, unique_fname, multi_fname, strange_fname, sites_npz=npz_fname)
+        for name, fname in [('single', unique_fname), ('multi', multi_fname)]:
+            sites = iCount.files.npz.load_sites(npz_fname, name)
+            with open(fname) as handle:
+                expected = [line.split() for line in handle]
+            self.assertEqual(
+                [[chrom, str(pos), str(pos + 1), '.', iCount.files._f2s(float(cdna)), strand]
+                 for chrom, pos, cdna, strand in zip(sites['chrom'], sites['pos'], sites['cdna'], sites['strand'])],
+                expected)
+
+    def test_run_regions(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_fname = get_temp_file_name(extension='bed')
+        multi_fname = get_temp_file_name(extension='bed')
+        strange_fname = get_temp_file_name(extension='bam')
+
+        result = xlsites.run(bam_fname, unique_fname, multi_fname, strange_fname, regions=['chr2:300-400'])
+        # pylint: disable=no-member
+        self.assertEqual(result.used_recs, 3)
+        with open(multi_fname) as handle:
+            self.assertEqual(handle.readlines(), ['chr2\t299\t300\t.\t0.1748\t+\n'])
+
+
+class TestReadSampleSheet(unittest.TestCase):
+
+    def test_read(self):
+        sheet = make_file_from_list([
+            ['bam', 'sites_single', 'sites_multi', 'skipped'],
+            ['# comment'],
+            ['a.bam', 'a_single.bed', 'a_multi.bed', 'a_skipped.bam'],
+            ['b.bam', 'b_single.bed', 'b_multi.bed'],
+        ], bedtool=False, extension='tsv')
+        self.assertEqual(xlsites._read_sample_sheet(sheet), [
+            {'bam': 'a.bam', 'sites_single': 'a_single.bed', 'sites_multi': 'a_multi.bed',
+             'skipped': 'a_skipped.bam'},
+            {'bam': 'b.bam', 'sites_single': 'b_single.bed', 'sites_multi': 'b_multi.bed', 'skipped': ''},
+        ])
+
+    def test_invalid(self):
+        sheet = make_file_from_list([['a.bam', 'a_single.bed']], bedtool=False, extension='tsv')
+        with self.assertRaises(ValueError):
+            xlsites._read_sample_sheet(sheet)
+
+        sheet = make_file_from_list([['# comment']], bedtool=False, extension='tsv')
+        with self.assertRaises(ValueError):
+            xlsites._read_sample_sheet(sheet)
+
+
+class TestXlsitesBatch(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.data = {
+            'chromosomes': [('chr1', 3000), ('chr2', 2000)],
+            'segments': [
+                ('name1:rbc:AAA', 0, 0, 100, 20, [(0, 50)], {'NH': 1}),
+                ('name2:rbc:CCC', 16, 0, 200, 20, [(0, 50), (3, 20), (0, 50)], {'NH': 1}),
+                ('name3:rbc:GGG', 0, 1, 300, 20, [(0, 200)], {'NH': 3}),
+            ]}
+
+    def test_batch(self):
+        samples, expected, expected_outputs = [], [], []
+        for seed in range(3):
+            bam = make_bam_file(self.data, rnd_seed=seed)
+            samples.append([bam] + [get_temp_file_name(extension=ext) for ext in ['bed', 'bed', 'bam']])
+            expected_outputs.append([get_temp_file_name(extension=ext) for ext in ['bed', 'bed', 'bam']])
+            expected.append(xlsites.run(bam, *expected_outputs[-1], mapq_th=5))
+        sheet = make_file_from_list(samples, bedtool=False, extension='tsv')
+        table = get_temp_file_name(extension='tsv')
+
+        for processes in [1, 2]:
+            metrics = xlsites.xlsites_batch(sheet, table, mapq_th=5, processes=processes)
+            self.assertEqual(metrics.samples, 3)  # pylint: disable=no-member
+
+            for sample, outputs in zip(samples, expected_outputs):
+                for fname, expected_fname in zip(sample[1:3], outputs[:2]):
+                    with open(fname) as handle, open(expected_fname) as expected_handle:
+                        self.assertEqual(handle.read(), expected_handle.read())
+
+            with open(table) as handle:
+                rows = [line.rstrip('\n').split('\t') for line in handle]
+            header = rows[0]
+            self.assertEqual(header[0], 'bam')
+            self.assertEqual([row[0] for row in rows[1:]], [sample[0] for sample in samples])
+            for row, sample_expected in zip(rows[1:], expected):
+                values = dict(zip(header, row))
+                self.assertEqual(values['used_recs'], str(sample_expected.used_recs))
+                self.assertEqual(values['strange_recs'], str(sample_expected.strange_recs))
+                self.assertNotIn('bc_cn', values)
+
 
 if __name__ == '__main__':
     unittest.main()